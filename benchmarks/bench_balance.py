@@ -0,0 +1,296 @@
+"""
+Micro-benchmark for parse_balance_message and format_balance_message
+
+Times the bot's balance parser and renderer on synthetic balance texts of
+10, 100, 1,000 and 10,000 accounts across MMK/USDT/THB. They are compared
+with the previous implementations, kept below as the legacy_* baseline.
+Every synthetic text is first checked to parse into the same accounts and
+render to the same bytes with both implementations.
+
+    python benchmarks/bench_balance.py
+    python benchmarks/bench_balance.py --sizes 10 1000 --repeat 20 --json
+
+Exits with status 1 when an output differs or a timing regresses. A timing
+regresses when it exceeds its per-account budget in THRESHOLDS, or when it
+runs slower than the legacy implementation by more than --tolerance.
+Log records are formatted but discarded while timing, so terminal I/O
+does not swamp the measurement.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+os.environ.setdefault('OPENAI_API_KEY', 'bench')
+
+import bot
+from bot import AMOUNT_SCALE, Account, Ledger, format_balance_amount, logger
+
+SIZES = (10, 100, 1000, 10000)
+
+# Microseconds per account the current implementation may take
+THRESHOLDS = {'parse': 20.0, 'format': 5.0}
+
+# ============================================================================
+# LEGACY IMPLEMENTATIONS
+# ============================================================================
+
+def legacy_parse_balance_message(message_text):
+    try:
+        text = message_text.strip()
+
+        if text.startswith('MMK'):
+            text = text[3:]
+
+        usdt_start = text.find('USDT')
+        thb_start = text.find('THB')
+
+        if usdt_start == -1:
+            logger.error("Missing USDT marker")
+            return None
+
+        mmk_section = text[:usdt_start]
+
+        if thb_start != -1 and thb_start > usdt_start:
+            usdt_section = text[usdt_start + 4:thb_start]
+            thb_section = text[thb_start + 3:]
+        else:
+            usdt_section = text[usdt_start + 4:]
+            thb_section = ""
+
+        bank_pattern = r'([A-Za-z\s]+?)\s*\(([^)]+)\)\s*-\s*\(?([\d,]+(?:\.\d+)?)\)?(?:\([^)]+\))?'
+
+        banks = []
+        for match in re.finditer(bank_pattern, mmk_section):
+            prefix = match.group(1).strip()
+            bank_name = match.group(2).strip()
+            amount_str = match.group(3).replace(',', '')
+
+            try:
+                amount = float(amount_str)
+                full_name = f"{prefix}({bank_name})"
+                banks.append(Account(full_name, amount, prefix, bank_name, AMOUNT_SCALE['mmk_banks']))
+            except ValueError:
+                logger.warning(f"Could not parse amount for {prefix}({bank_name}): {amount_str}")
+                continue
+
+        usdt_banks = []
+        for match in re.finditer(bank_pattern, usdt_section):
+            prefix = match.group(1).strip()
+            bank_name = match.group(2).strip()
+            amount_str = match.group(3).replace(',', '')
+
+            try:
+                amount = float(amount_str)
+                full_name = f"{prefix}({bank_name})"
+                usdt_banks.append(Account(full_name, amount, prefix, bank_name, AMOUNT_SCALE['usdt_banks']))
+            except ValueError:
+                logger.warning(f"Could not parse USDT amount for {prefix}({bank_name}): {amount_str}")
+                continue
+
+        thb_banks = []
+        if thb_section:
+            for match in re.finditer(bank_pattern, thb_section):
+                prefix = match.group(1).strip()
+                bank_name = match.group(2).strip()
+                amount_str = match.group(3).replace(',', '')
+
+                try:
+                    amount = float(amount_str)
+                    full_name = f"{prefix}({bank_name})"
+                    thb_banks.append(Account(full_name, amount, prefix, bank_name, AMOUNT_SCALE['thb_banks']))
+                except ValueError:
+                    logger.warning(f"Could not parse THB amount for {prefix}({bank_name}): {amount_str}")
+                    continue
+
+        logger.info(f"Parsed {len(banks)} MMK banks, {len(usdt_banks)} USDT banks, {len(thb_banks)} THB banks")
+
+        if banks:
+            logger.info(f"MMK banks: {[b['bank_name'] for b in banks]}")
+        if usdt_banks:
+            logger.info(f"USDT banks: {[b['bank_name'] for b in usdt_banks]}")
+        if thb_banks:
+            logger.info(f"THB banks: {[b['bank_name'] for b in thb_banks]}")
+
+        return Ledger(banks, usdt_banks, thb_banks)
+
+    except Exception as e:
+        logger.error(f"Parse error: {e}")
+
+        logger.error(traceback.format_exc())
+        return None
+
+def legacy_format_balance_message(mmk_banks, usdt_banks, thb_banks=None):
+    lines = [f"{bank['bank_name']} -{format_balance_amount(bank, 'mmk_banks')}" for bank in mmk_banks]
+
+    lines.append("")
+    lines.append("USDT")
+    lines.extend(f"{bank['bank_name']} -{format_balance_amount(bank, 'usdt_banks')}" for bank in usdt_banks)
+
+    if thb_banks:
+        lines.append("")
+        lines.append("THB")
+        lines.extend(f"{bank['bank_name']} -{format_balance_amount(bank, 'thb_banks')}" for bank in thb_banks)
+
+    return "\n".join(lines).strip()
+
+# ============================================================================
+# SYNTHETIC BALANCES
+# ============================================================================
+
+MMK_BANK_NAMES = ['Kpay P', 'CB M', 'CB', 'KBZ', 'AYA M', 'AYA', 'AYA Wallet', 'Wave', 'Wave M', 'Wave Channel', 'Yoma']
+USDT_BANK_NAMES = ['Swift', 'Wallet', 'Binance', 'BNB Wallet']
+THB_BANK_NAMES = ['Bkk B', 'KBank', 'SCB']
+
+def staff_prefix(index):
+    """San, TZT, ... style prefixes: letters only, as the row pattern requires"""
+    letters = ''
+    index += 26 * 26
+    while index:
+        index, digit = divmod(index, 26)
+        letters = chr(ord('A') + digit) + letters
+    return letters
+
+def balance_text(accounts, rng, single_line=False):
+    """A balance message with `accounts` rows, 70% MMK, 20% USDT, 10% THB, in the formats seen in the group"""
+    usdt_count = max(1, accounts // 5)
+    thb_count = max(1, accounts // 10)
+    mmk_count = max(1, accounts - usdt_count - thb_count)
+
+    def row(index, names, amount):
+        separator = rng.choice(['-', ' -', ' - ', '-'])
+        space = rng.choice(['', ' ']) if index % 7 == 0 else ''
+        return f"{staff_prefix(index)}{space}({names[index % len(names)]}){separator}{amount}"
+
+    mmk = []
+    for index in range(mmk_count):
+        amount = rng.randrange(0, 50_000_000)
+        mmk.append(row(index, MMK_BANK_NAMES, f"{amount:,}" if index % 3 == 0 else str(amount)))
+    usdt = []
+    for index in range(usdt_count):
+        amount = f"{rng.randrange(0, 100_000)}.{rng.randrange(0, 10000):04d}"
+        if index % 11 == 5:
+            amount = f"({amount})"
+        elif index % 13 == 6:
+            amount = f"{amount}({rng.randrange(1, 100)}.{rng.randrange(0, 100):02d})"
+        usdt.append(row(index, USDT_BANK_NAMES, amount))
+    thb = [row(index, THB_BANK_NAMES, f"{rng.randrange(0, 2_000_000):,}") for index in range(thb_count)]
+
+    separator = ' ' if single_line else '\n'
+    return separator.join(['MMK'] + mmk + ['', 'USDT'] + usdt + ['', 'THB'] + thb)
+
+# ============================================================================
+# CHECKS AND TIMING
+# ============================================================================
+
+def snapshot(ledger):
+    if ledger is None:
+        return None
+    return {
+        section: [(row.bank_name, row.prefix, row.bank, row.key, row.scale, row.units) for row in ledger[section]]
+        for section in Ledger.SECTIONS
+    }
+
+def render(format_function, ledger):
+    return format_function(ledger['mmk_banks'], ledger['usdt_banks'], ledger['thb_banks'])
+
+def check(text):
+    """Return a description of the first difference between legacy and current output, or None"""
+    legacy = legacy_parse_balance_message(text)
+    current = bot.parse_balance_message(text)
+    if snapshot(legacy) != snapshot(current):
+        return "parsed accounts differ"
+    if legacy is None:
+        return None
+    if render(legacy_format_balance_message, legacy) != render(bot.format_balance_message, current):
+        return "rendered text differs"
+    return None
+
+def best_time(function, argument, repeat, number):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function(argument)
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+def run(sizes, repeat, tolerance, seed):
+    rng = random.Random(seed)
+    results = []
+    failures = []
+
+    for size in sizes:
+        texts = [balance_text(size, rng), balance_text(size, rng, single_line=True)]
+        for text in texts:
+            problem = check(text)
+            if problem:
+                failures.append(f"{size} accounts: {problem}")
+
+        text = texts[0]
+        ledger = bot.parse_balance_message(text)
+        rows = sum(len(ledger[section]) for section in Ledger.SECTIONS)
+        number = max(1, 2000 // size)
+        timings = {
+            'parse': (best_time(legacy_parse_balance_message, text, repeat, number),
+                      best_time(bot.parse_balance_message, text, repeat, number)),
+            'format': (best_time(lambda l: render(legacy_format_balance_message, l), ledger, repeat, number),
+                       best_time(lambda l: render(bot.format_balance_message, l), ledger, repeat, number)),
+        }
+        for operation, (legacy, current) in timings.items():
+            per_account = current / rows * 1e6
+            results.append({
+                'operation': operation,
+                'accounts': rows,
+                'legacy_ms': round(legacy * 1e3, 4),
+                'current_ms': round(current * 1e3, 4),
+                'speedup': round(legacy / current, 2) if current else None,
+                'us_per_account': round(per_account, 3),
+            })
+            if per_account > THRESHOLDS[operation]:
+                failures.append(f"{operation} {rows} accounts: {per_account:.2f} us/account "
+                                f"over the {THRESHOLDS[operation]} us budget")
+            # Tiny inputs are dominated by timer noise
+            if rows >= 100 and current > legacy * (1 + tolerance):
+                failures.append(f"{operation} {rows} accounts: {current * 1e3:.3f} ms, slower than legacy "
+                                f"{legacy * 1e3:.3f} ms")
+    return results, failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='accounts per balance text')
+    parser.add_argument('--repeat', type=int, default=7, help='timing rounds; the best is reported')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed slowdown against legacy')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    root.handlers = [logging.NullHandler()]
+    try:
+        results, failures = run(args.sizes, args.repeat, args.tolerance, args.seed)
+    finally:
+        root.handlers = handlers
+
+    if args.json:
+        print(json.dumps({'results': results, 'failures': failures}, indent=2))
+    else:
+        print(f"{'operation':<10}{'accounts':>10}{'legacy ms':>12}{'current ms':>12}{'speedup':>9}{'us/acct':>9}")
+        for row in results:
+            print(f"{row['operation']:<10}{row['accounts']:>10}{row['legacy_ms']:>12.3f}{row['current_ms']:>12.3f}"
+                  f"{row['speedup']:>8.2f}x{row['us_per_account']:>9.2f}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
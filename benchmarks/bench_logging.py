@@ -0,0 +1,132 @@
+"""
+Micro-benchmark for the logging pipeline
+
+Times what one log record costs the thread that logs it, which for the bot
+is the event loop. A burst of records shaped like the bot's hot-path lines
+(the "Received" line per update, OCR response dumps) is logged through:
+
+    direct    a StreamHandler on the root logger, as basicConfig sets up
+    pipeline  the bot's LogPipeline: queue handler, writer thread, text or JSON
+    sampled   the pipeline with LOG_SAMPLE keeping a tenth of the updates
+
+Output goes to a file (or /dev/null with --null) so the comparison is of the
+logging path rather than of the terminal. --sink-latency-us makes every write
+block that long, as a log pipe under backpressure does: the direct handler
+then pays it on the logging thread, the pipeline on its writer thread.
+"drain" is the time the writer thread still needed after the burst.
+
+    python benchmarks/bench_logging.py
+    python benchmarks/bench_logging.py --sink-latency-us 100
+    python benchmarks/bench_logging.py --records 50000 --format json --json
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+os.environ.setdefault('OPENAI_API_KEY', 'bench')
+
+import bot
+
+OCR_RESPONSE = '{"banks": [' + ', '.join(f'{{"bank": "KBZ", "amount": {i * 1000}}}' for i in range(20)) + ']}'
+
+class SlowSink:
+    """File wrapper whose writes block for `latency` seconds"""
+    
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+    
+    def write(self, text):
+        time.sleep(self.latency)
+        return self.stream.write(text)
+    
+    def flush(self):
+        self.stream.flush()
+
+def log_burst(records):
+    """Log `records` hot-path lines over records // 4 transactions; returns seconds spent logging"""
+    started = time.perf_counter()
+    for i in range(records // 4):
+        bot.correlation_id.set(f"-1001234567890:{i}")
+        bot.update_log.info("🔍 Received %s message - Chat: %s, Topic: %s", "photo", -1001234567890, 7)
+        bot.update_log.info("🔍 Message ID: %s, Reply to: %s", i, i - 1)
+        bot.ocr_log.info("USDT OCR raw response: %.200s...", OCR_RESPONSE)
+        bot.balance_log.debug("Parsed balances: %s", OCR_RESPONSE)
+    return time.perf_counter() - started
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    for category in bot.LOG_CATEGORIES.values():
+        category.setLevel(logging.NOTSET)
+    root.setLevel(logging.INFO)
+
+def run_direct(records, stream):
+    reset_root()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logging.getLogger().addHandler(handler)
+    elapsed = log_burst(records)
+    handler.flush()
+    return {'logging_s': elapsed, 'drain_s': 0.0}
+
+def run_pipeline(records, stream, log_format, sample):
+    reset_root()
+    bot.LOG_FORMAT, bot.LOG_SAMPLE = log_format, sample
+    pipeline = bot.LogPipeline()
+    real_stderr, sys.stderr = sys.stderr, stream
+    try:
+        pipeline.start()
+    finally:
+        sys.stderr = real_stderr
+    elapsed = log_burst(records)
+    summary = pipeline.summary()
+    started = time.perf_counter()
+    pipeline.stop()
+    return {'logging_s': elapsed, 'drain_s': time.perf_counter() - started, 'summary': summary}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=20000, help='log records per run')
+    parser.add_argument('--format', choices=['text', 'json'], default='text', help='pipeline output format')
+    parser.add_argument('--null', action='store_true', help='write to /dev/null instead of a temporary file')
+    parser.add_argument('--sink-latency-us', type=float, default=0, help='block every write this long')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    results = {}
+    runs = [
+        ('direct', lambda stream: run_direct(args.records, stream)),
+        ('pipeline', lambda stream: run_pipeline(args.records, stream, args.format, '')),
+        ('sampled', lambda stream: run_pipeline(args.records, stream, args.format, 'updates=0.1')),
+    ]
+    for name, run in runs:
+        with (open(os.devnull, 'w') if args.null else tempfile.TemporaryFile('w+')) as stream:
+            result = run(SlowSink(stream, args.sink_latency_us / 1e6) if args.sink_latency_us else stream)
+        result['us_per_record'] = result['logging_s'] / args.records * 1e6
+        results[name] = result
+    reset_root()
+
+    if args.json:
+        print(json.dumps({'records': args.records, 'format': args.format, 'sink_latency_us': args.sink_latency_us, 'results': {
+            name: {key: round(value, 3) if isinstance(value, float) else value for key, value in result.items()}
+            for name, result in results.items()
+        }}, indent=2))
+    else:
+        print(f"{args.records} records, pipeline format {args.format}, sink latency {args.sink_latency_us:g} us")
+        print(f"{'run':<10}{'us/record':>12}{'drain ms':>10}  queue")
+        for name, result in results.items():
+            print(f"{name:<10}{result['us_per_record']:>12.2f}{result['drain_s'] * 1000:>10.0f}  {result.get('summary', '')}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
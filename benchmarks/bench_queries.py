@@ -0,0 +1,146 @@
+"""
+Per-call overhead of the database helpers
+
+Times a few hot helpers (the replay check run on every message, settings
+reads, media group lookups) through the query layer against the previous
+pattern, kept below as legacy_*: a new connection per call, the dialect
+picked per call, and for media groups the PostgreSQL statement tried
+first with the SQLite one as the fallback.
+
+    python benchmarks/bench_queries.py
+    DATABASE_URL=postgresql://... python benchmarks/bench_queries.py --calls 500
+
+Runs on a throwaway SQLite database unless DATABASE_URL is set. Exits with
+status 1 if a helper got slower than its legacy version.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+os.environ.setdefault('OPENAI_API_KEY', 'bench')
+if not os.getenv('DATABASE_URL'):
+    os.environ['SQLITE_DB_FILE'] = os.path.join(tempfile.mkdtemp(prefix='bench-queries-'), 'bench.db')
+
+import bot
+from bot import get_db_connection
+
+# ============================================================================
+# LEGACY IMPLEMENTATIONS
+# ============================================================================
+
+def legacy_get_setting(key, default=None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if isinstance(conn, sqlite3.Connection):
+        cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
+    else:
+        cursor.execute('SELECT value FROM settings WHERE key = %s', (key,))
+    result = cursor.fetchone()
+    conn.close()
+    if not result:
+        return default
+    return result['value'] if isinstance(result, dict) else result[0]
+
+def legacy_get_media_group_photos(media_group_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT message_id, file_path FROM media_group_photos
+            WHERE media_group_id = %s
+            ORDER BY message_id
+        ''', (media_group_id,))
+    except Exception:
+        cursor.execute('''
+            SELECT message_id, file_path FROM media_group_photos
+            WHERE media_group_id = ?
+            ORDER BY message_id
+        ''', (media_group_id,))
+    results = cursor.fetchall()
+    conn.close()
+    return results
+
+def legacy_insert_processed_message(chat_id, message_id, handler):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if isinstance(conn, sqlite3.Connection):
+        cursor.execute('''
+            INSERT OR IGNORE INTO processed_messages (chat_id, message_id, handler, created_at)
+            VALUES (?, ?, ?, ?)
+        ''', (chat_id, message_id, handler, time.time()))
+    else:
+        cursor.execute('''
+            INSERT INTO processed_messages (chat_id, message_id, handler, created_at)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (chat_id, message_id, handler) DO NOTHING
+        ''', (chat_id, message_id, handler, time.time()))
+    inserted = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return inserted
+
+# ============================================================================
+# TIMING
+# ============================================================================
+
+def per_call(function, args_for, calls):
+    started = time.perf_counter()
+    for index in range(calls):
+        function(*args_for(index))
+    return (time.perf_counter() - started) / calls
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000, help='calls per helper')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    bot.init_database()
+    bot.set_setting('bench', 'value')
+    for message_id in range(10):
+        bot.db.execute(bot.SAVE_MEDIA_GROUP_PHOTO, ('bench-group', message_id, f'bench_{message_id}.jpg'))
+
+    same = lambda *args: (lambda i: args)
+    cases = [
+        ('get_setting', legacy_get_setting, bot.get_setting, same('bench'), same('bench')),
+        ('get_media_group_photos', legacy_get_media_group_photos, bot.get_media_group_photos,
+         same('bench-group'), same('bench-group')),
+        # Fresh message ids on both sides: every call is a real insert, as for new messages
+        ('insert_processed_message', legacy_insert_processed_message, bot.insert_processed_message,
+         lambda i: (-1, i, 'bench'), lambda i: (-1, args.calls + i, 'bench')),
+    ]
+
+    results = []
+    failures = []
+    for name, legacy, current, legacy_args, current_args in cases:
+        legacy_time = per_call(legacy, legacy_args, args.calls)
+        current_time = per_call(current, current_args, args.calls)
+        results.append({
+            'helper': name,
+            'legacy_us': round(legacy_time * 1e6, 1),
+            'current_us': round(current_time * 1e6, 1),
+            'speedup': round(legacy_time / current_time, 2),
+        })
+        if current_time > legacy_time:
+            failures.append(f"{name}: {current_time * 1e6:.1f} us per call, slower than legacy {legacy_time * 1e6:.1f} us")
+
+    if args.json:
+        print(json.dumps({'dialect': bot.db.dialect, 'results': results, 'failures': failures}, indent=2))
+    else:
+        print(f"Dialect: {bot.db.dialect}, {args.calls} calls per helper")
+        print(f"{'helper':<26}{'legacy us':>11}{'current us':>12}{'speedup':>9}")
+        for row in results:
+            print(f"{row['helper']:<26}{row['legacy_us']:>11.1f}{row['current_us']:>12.1f}{row['speedup']:>8.2f}x")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,602 @@
+"""
+Replay benchmark for Infinity Balance Bot
+
+Pushes a corpus of group updates (sale messages, albums, staff replies, P2P
+sells, internal transfers) through the real handlers - handle_message, the
+update processor, the OCR job queue and the outbound scheduler - against a
+stubbed Bot API and a local OpenAI-compatible vision server, then reports
+throughput, end-to-end latency and OCR calls per transaction.
+
+    python benchmarks/replay.py --transactions 200 --rate 4 --ocr-latency 0.8 --ocr-error-rate 0.02
+
+The corpus is synthetic by default. --save-corpus writes it as JSON lines and
+--corpus replays a saved or recorded one. Each line has the transaction id,
+its kind, the offset in seconds from the start of the run, the raw Telegram
+update and the receipt images it references (base64, keyed by file_id).
+Receipt images carry the answer the stand-in vision server gives, as a
+trailing "BENCH{...}" block after the JPEG data.
+
+The bot module is imported after the environment is set up, so it runs on a
+throwaway SQLite database in a temporary directory. Set DATABASE_URL to
+benchmark against PostgreSQL instead.
+
+--trace-file turns on the bot's tracing and writes the spans of the run to
+that file, for benchmarks/trace_report.py:
+
+    python benchmarks/replay.py --transactions 100 --trace-file traces.jsonl
+    python benchmarks/trace_report.py traces.jsonl
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import base64
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from io import BytesIO
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+GROUP_ID = -1001000000001
+BALANCE_TOPIC_ID = 2
+ACCOUNTS_TOPIC_ID = 3
+ALERT_TOPIC_ID = 4
+
+STAFF = {'id': 1001, 'is_bot': False, 'first_name': 'San', 'username': 'san_staff'}
+CUSTOMER = {'id': 2001, 'is_bot': False, 'first_name': 'Sale', 'username': 'sale_bot'}
+
+MMK_BANKS = {'San(KBZ)': '27251127201844001', 'San(CB)': '02251000016042', 'San(Wave)': '09791234567', 'San(AYA)': '20012345672957'}
+USDT_BANKS = {'San(Swift)': ('TJKBfj3qY7mZ1pXc9wLr4VnDnv4NKY', 'TRC20'), 'San(Wallet)': ('0x4f2a9c81d7e3b6a5c0f19e2d3b7a8c6e5d4f3a21', 'BEP20')}
+THB_BANKS = {'ACT(Bkk B)': None}
+
+DEFAULT_MIX = 'buy=3,sell=3,buy_album=1,p2p_sell=1,staff_p2p_sell=1,internal_transfer=1'
+
+logger = logging.getLogger('replay')
+
+# ============================================================================
+# FAKE VISION API
+# ============================================================================
+
+def receipt_image(truth, size, rng):
+    """JPEG bytes whose trailing BENCH block tells the stand-in server what the receipt shows"""
+    if Image is not None:
+        noise = Image.frombytes('L', (64, 64), bytes(rng.getrandbits(8) for _ in range(64 * 64)))
+        buffer = BytesIO()
+        noise.convert('RGB').save(buffer, 'JPEG', quality=90)
+        head = buffer.getvalue()
+    else:
+        head = b'\xff\xd8\xff\xd9'
+    padding = rng.randbytes(max(0, size - len(head)))
+    return head + padding + b'\nBENCH' + json.dumps(truth).encode()
+
+def receipt_truth(data_url):
+    data = base64.b64decode(data_url.split(',', 1)[1])
+    return json.loads(data[data.rfind(b'\nBENCH') + 6:])
+
+def bank_numbers(prompt):
+    """Bank name -> number as listed in an OCR prompt ("Bank ID 2: San(CB)" or "2. San(CB)")"""
+    numbers = {}
+    for number, name in re.findall(r'Bank ID (\d+): ([^\n]+)', prompt):
+        numbers.setdefault(name.strip(), int(number))
+    for number, name in re.findall(r'(?<![\w.])(\d+)\. ([^,\n]+)', prompt):
+        numbers.setdefault(name.strip(), int(number))
+    return numbers
+
+def vision_answer(prompt, truth):
+    """One JSON answer carrying every field the bot's OCR prompts ask for"""
+    amount = truth['amount']
+    fee = truth.get('fee', 0)
+    number = bank_numbers(prompt).get(truth.get('bank'))
+    return json.dumps({
+        'amount': amount,
+        'bank_number': number or 0,
+        'banks': {str(number): 100} if number else {},
+        'network_fee': fee,
+        'total_amount': amount + fee,
+        'received_amount': amount,
+        'bank_type': truth.get('bank_type', 'wallet'),
+    })
+
+class FakeVisionServer:
+    """OpenAI-compatible /v1/chat/completions on localhost with configurable latency and error rate"""
+
+    def __init__(self, latency, error_rate, seed):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                with server.lock:
+                    server.requests += 1
+                    fail = server.rng.random() < server.error_rate
+                    delay = server.latency * server.rng.uniform(0.5, 1.5)
+                    if fail:
+                        server.errors += 1
+                time.sleep(delay)
+                if fail:
+                    self._reply(500, {'error': {'message': 'injected failure', 'type': 'server_error'}})
+                    return
+                content = body['messages'][0]['content']
+                prompt = next(part['text'] for part in content if part['type'] == 'text')
+                data_url = next(part['image_url']['url'] for part in content if part['type'] == 'image_url')
+                self._reply(200, {
+                    'id': f"chatcmpl-bench-{server.requests}",
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': body.get('model', 'gpt-4o'),
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': vision_answer(prompt, receipt_truth(data_url))},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+                })
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+# ============================================================================
+# CORPUS
+# ============================================================================
+
+class CorpusBuilder:
+    """Synthetic transactions as (txn, kind, offset, update, images) entries"""
+
+    def __init__(self, seed, image_kb, reply_delay):
+        self.rng = random.Random(seed)
+        self.image_size = image_kb * 1024
+        self.reply_delay = reply_delay
+        self.message_id = 100
+        self.update_id = 0
+        self.file_seq = 0
+        self.entries = []
+
+    def _photo(self, truth, images):
+        self.file_seq += 1
+        file_id = f"bench-photo-{self.file_seq}"
+        images[file_id] = receipt_image(truth, self.image_size, self.rng)
+        return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 64, 'height': 64,
+                 'file_size': len(images[file_id])}]
+
+    def message(self, user, *, text=None, caption=None, photo=None, reply_to=None, thread=None, media_group=None):
+        self.message_id += 1
+        message = {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': GROUP_ID, 'type': 'supergroup', 'title': 'Bench', 'is_forum': True},
+            'from': user,
+        }
+        if text is not None:
+            message['text'] = text
+        if caption is not None:
+            message['caption'] = caption
+        if photo is not None:
+            message['photo'] = photo
+        if reply_to is not None:
+            message['reply_to_message'] = reply_to
+        if thread is not None:
+            message['message_thread_id'] = thread
+            message['is_topic_message'] = True
+        if media_group is not None:
+            message['media_group_id'] = media_group
+        return message
+
+    def add(self, txn, kind, at, message, images=None):
+        self.update_id += 1
+        self.entries.append({
+            'txn': txn, 'kind': kind, 'at': round(at, 3),
+            'update': {'update_id': self.update_id, 'message': message},
+            'images': {file_id: base64.b64encode(data).decode() for file_id, data in (images or {}).items()}
+        })
+
+    def balance(self):
+        lines = [f"{name} -{self.rng.randrange(50, 500) * 1_000_000:,}" for name in MMK_BANKS]
+        lines += ["", "USDT"] + [f"{name} -{self.rng.randrange(50, 500) * 1000}.0000" for name in USDT_BANKS]
+        lines += ["", "THB"] + [f"{name} -{self.rng.randrange(100, 900) * 1000:,}" for name in THB_BANKS]
+        self.add(0, 'balance', 0.0, self.message(STAFF, text="\n".join(lines), thread=BALANCE_TOPIC_ID))
+
+    def transaction(self, txn, kind, at):
+        rng = self.rng
+        usdt = rng.randrange(20, 2000)
+        rate = rng.randrange(4000, 4200)
+        mmk = usdt * rate
+        mmk_bank = rng.choice(list(MMK_BANKS))
+        images = {}
+
+        if kind in ('buy', 'sell', 'buy_album'):
+            word = 'Sell' if kind == 'sell' else 'Buy'
+            caption = f"{word} {usdt} x {rate} = {mmk:,}"
+            if kind == 'sell':
+                sale_truth = [{'bank': mmk_bank, 'amount': mmk}]
+                reply_truth = {'amount': usdt, 'fee': 0, 'bank_type': 'swift'}
+            else:
+                count = 2 if kind == 'buy_album' else 1
+                sale_truth = [{'bank': 'San(Swift)', 'amount': usdt / count}] * count
+                reply_truth = {'bank': mmk_bank, 'amount': mmk}
+
+            media_group = f"bench-album-{txn}" if len(sale_truth) > 1 else None
+            first = None
+            for idx, truth in enumerate(sale_truth):
+                message = self.message(CUSTOMER, caption=caption if idx == 0 else None,
+                                       photo=self._photo(truth, images), media_group=media_group)
+                first = first or message
+                self.add(txn, kind, at + idx * 0.1, message, images)
+                images = {}
+            reply = self.message(STAFF, photo=self._photo(reply_truth, images), reply_to=first)
+            self.add(txn, kind, at + self.reply_delay, reply, images)
+
+        elif kind == 'p2p_sell':
+            caption = f"sell {mmk:,}/{usdt}={rate} fee-0.5"
+            self.add(txn, kind, at, self.message(STAFF, caption=caption,
+                                                 photo=self._photo({'bank': mmk_bank, 'amount': mmk}, images)), images)
+
+        elif kind == 'staff_p2p_sell':
+            text = f"P2P Sell {usdt}x{rate} ={mmk}\n{mmk} to {mmk_bank.replace('(', ' (')}\nFrom San(Swift)"
+            self.add(txn, kind, at, self.message(STAFF, text=text))
+
+        elif kind == 'internal_transfer':
+            to_bank = rng.choice([name for name in MMK_BANKS if name != mmk_bank])
+            amount = rng.randrange(100, 5000) * 1000
+            message = self.message(STAFF, caption=f"{mmk_bank} to {to_bank}", thread=ACCOUNTS_TOPIC_ID,
+                                   photo=self._photo({'bank': mmk_bank, 'amount': amount}, images))
+            self.add(txn, kind, at, message, images)
+
+        else:
+            raise ValueError(f"Unknown transaction kind: {kind}")
+
+def build_corpus(args):
+    builder = CorpusBuilder(args.seed, args.image_kb, args.reply_delay)
+    builder.balance()
+    kinds, weights = zip(*((kind, float(weight)) for kind, weight in
+                           (item.split('=') for item in args.mix.split(','))))
+    at = 0.5
+    for txn in range(1, args.transactions + 1):
+        builder.transaction(txn, builder.rng.choices(kinds, weights)[0], at)
+        at += builder.rng.expovariate(args.rate)
+    return sorted(builder.entries, key=lambda entry: (entry['at'], entry['update']['update_id']))
+
+# ============================================================================
+# FAKE BOT API
+# ============================================================================
+
+def build_fake_bot_request(images, latency):
+    """telegram.request.BaseRequest answering Bot API calls locally and serving corpus images as files"""
+    from telegram.request import BaseRequest
+
+    class FakeBotApi(BaseRequest):
+        def __init__(self):
+            self.calls = defaultdict(int)
+            self.alerts = 0
+            self._message_id = 10_000_000
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            if latency:
+                await asyncio.sleep(latency)
+            if '/file/bot' in url:
+                self.calls['download'] += 1
+                return 200, images[url.rsplit('/', 1)[1]]
+
+            endpoint = url.rsplit('/', 1)[1]
+            params = request_data.parameters if request_data else {}
+            self.calls[endpoint] += 1
+            if endpoint == 'getMe':
+                result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+                          'can_join_groups': True, 'can_read_all_group_messages': True,
+                          'supports_inline_queries': False}
+            elif endpoint == 'getFile':
+                result = {'file_id': params['file_id'], 'file_unique_id': params['file_id'],
+                          'file_path': params['file_id']}
+            elif endpoint in ('sendMessage', 'editMessageText'):
+                if str(params.get('text', '')).startswith('❌'):
+                    self.alerts += 1
+                self._message_id += 1
+                result = {'message_id': params.get('message_id', self._message_id), 'date': int(time.time()),
+                          'chat': {'id': params.get('chat_id', GROUP_ID), 'type': 'supergroup'},
+                          'text': params.get('text', '')}
+            elif endpoint == 'forwardMessage':
+                # Album photos are never refetched by forwarding in the benchmark
+                return 400, json.dumps({'ok': False, 'error_code': 400,
+                                        'description': 'Bad Request: message to forward not found'}).encode()
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    return FakeBotApi()
+
+# ============================================================================
+# REPLAY
+# ============================================================================
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))]
+
+class Recorder:
+    """First-enqueue and last-finish times plus OCR calls per transaction"""
+
+    def __init__(self, entries):
+        self.txn_of = {entry['update']['message']['message_id']: entry['txn'] for entry in entries}
+        self.kind_of = {entry['txn']: entry['kind'] for entry in entries}
+        self.started = {}
+        self.finished = {}
+        self.ocr_calls = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def txn(self, message):
+        return self.txn_of.get(message.message_id) if message is not None else None
+
+    def start(self, txn):
+        self.started.setdefault(txn, time.perf_counter())
+
+    def finish(self, message, error=None):
+        txn = self.txn(message)
+        if txn is not None:
+            self.finished[txn] = time.perf_counter()
+            if error is not None:
+                self.errors[txn] += 1
+
+def instrument(bot, recorder):
+    """Wrap the message handler, OCR job handlers and vision client to attribute work to transactions"""
+    handle_message = bot.handle_message
+
+    async def timed_handle_message(update, context):
+        try:
+            await handle_message(update, context)
+        except Exception as e:
+            recorder.finish(update.message, e)
+            raise
+        recorder.finish(update.message)
+
+    for kind, handler in list(bot.OCR_JOB_HANDLERS.items()):
+        async def timed_job(application, payload, handler=handler):
+            try:
+                await handler(application, payload)
+            except Exception as e:
+                recorder.finish(bot.current_message.get(), e)
+                raise
+            recorder.finish(bot.current_message.get())
+        bot.OCR_JOB_HANDLERS[kind] = timed_job
+
+    create = bot.openai_client().chat.completions.create
+
+    def counted_create(*args, **kwargs):
+        # asyncio.to_thread copies context variables, so the handled message is visible here
+        txn = recorder.txn(bot.current_message.get())
+        recorder.ocr_calls[txn] += 1
+        return create(*args, **kwargs)
+
+    bot.openai_client().chat.completions.create = counted_create
+    return timed_handle_message
+
+async def wait_idle(bot, app, processor, settle=0.3):
+    """Return once no update, job or outbound message has been pending for `settle` seconds"""
+    quiet_since = None
+    while True:
+        jobs = bot.get_ocr_job_counts()
+        busy = (app.update_queue.qsize() or processor.stats()['active_chains'] or jobs['queued'] or jobs['running']
+                or bot.ocr_job_worker.running or bot.outbound.depth)
+        if busy:
+            quiet_since = None
+        elif quiet_since is None:
+            quiet_since = time.perf_counter()
+        elif time.perf_counter() - quiet_since >= settle:
+            return
+        await asyncio.sleep(0.05)
+
+async def replay(bot, entries, args):
+    from telegram import Update
+    from telegram.ext import Application, MessageHandler, filters
+
+    images = {file_id: base64.b64decode(data) for entry in entries for file_id, data in entry['images'].items()}
+    fake_api = build_fake_bot_request(images, args.bot_latency)
+    processor = bot.chain_update_processor(args.concurrency)
+    app = (
+        Application.builder()
+        .token(os.environ['TELEGRAM_BOT_TOKEN'])
+        .request(fake_api)
+        .get_updates_request(build_fake_bot_request(images, 0))
+        .updater(None)
+        .concurrent_updates(processor)
+        .build()
+    )
+    recorder = Recorder(entries)
+    app.add_error_handler(bot.error_handler)
+    app.add_handler(MessageHandler(filters.ALL, instrument(bot, recorder)))
+
+    async with app:
+        await app.start()
+        await bot.on_start(app)
+
+        # Load the balance first, as the bot would have it before any sale arrives
+        setup = [entry for entry in entries if entry['kind'] == 'balance']
+        for entry in setup:
+            await app.update_queue.put(Update.de_json(entry['update'], app.bot))
+        await wait_idle(bot, app, processor)
+
+        traffic = [entry for entry in entries if entry['kind'] != 'balance']
+        started = time.perf_counter()
+        for entry in traffic:
+            delay = entry['at'] - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            recorder.start(entry['txn'])
+            await app.update_queue.put(Update.de_json(entry['update'], app.bot))
+        await wait_idle(bot, app, processor)
+        elapsed = max(recorder.finished.values(), default=started) - started
+
+        await app.stop()
+        await bot.on_stop(app)
+
+    return report(recorder, fake_api, elapsed, args)
+
+def report(recorder, fake_api, elapsed, args):
+    by_kind = defaultdict(list)
+    for txn, started in recorder.started.items():
+        latency = recorder.finished.get(txn, started) - started
+        by_kind[recorder.kind_of[txn]].append((latency, recorder.ocr_calls.get(txn, 0), recorder.errors.get(txn, 0)))
+    everything = [row for rows in by_kind.values() for row in rows]
+
+    def summary(rows):
+        latencies = [latency for latency, _, _ in rows]
+        return {
+            'transactions': len(rows),
+            'p50_s': round(percentile(latencies, 50), 3),
+            'p95_s': round(percentile(latencies, 95), 3),
+            'p99_s': round(percentile(latencies, 99), 3),
+            'ocr_calls_per_txn': round(sum(calls for _, calls, _ in rows) / len(rows), 2) if rows else 0.0,
+            'failed': sum(1 for _, _, errors in rows if errors),
+        }
+
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'transactions_per_s': round(len(everything) / elapsed, 2) if elapsed > 0 else 0.0,
+        'overall': summary(everything),
+        'by_kind': {kind: summary(rows) for kind, rows in sorted(by_kind.items())},
+        'ocr_requests': args.vision.requests,
+        'ocr_injected_errors': args.vision.errors,
+        'bot_api_calls': dict(sorted(fake_api.calls.items())),
+        'alerts_sent': fake_api.alerts,
+    }
+
+def print_report(result):
+    print(f"\nReplayed {result['overall']['transactions']} transactions in {result['elapsed_s']:.1f}s "
+          f"({result['transactions_per_s']:.2f} tx/s)")
+    print(f"{'kind':<20}{'txns':>6}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'OCR/txn':>9}{'failed':>8}")
+    for kind, row in [('all', result['overall'])] + list(result['by_kind'].items()):
+        print(f"{kind:<20}{row['transactions']:>6}{row['p50_s']:>9.3f}{row['p95_s']:>9.3f}"
+              f"{row['p99_s']:>9.3f}{row['ocr_calls_per_txn']:>9.2f}{row['failed']:>8}")
+    print(f"\nOCR requests: {result['ocr_requests']} ({result['ocr_injected_errors']} injected errors)")
+    print(f"Alerts sent: {result['alerts_sent']}")
+    print("Bot API calls: " + ", ".join(f"{name} {count}" for name, count in result['bot_api_calls'].items()))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--transactions', type=int, default=100, help='synthetic transactions to generate')
+    parser.add_argument('--rate', type=float, default=2.0, help='mean new transactions per second')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'kind=weight list (default {DEFAULT_MIX})')
+    parser.add_argument('--reply-delay', type=float, default=1.0, help='seconds between a sale message and the staff reply')
+    parser.add_argument('--image-kb', type=int, default=150, help='size of each synthetic receipt image')
+    parser.add_argument('--ocr-latency', type=float, default=0.8, help='mean vision API latency in seconds')
+    parser.add_argument('--ocr-error-rate', type=float, default=0.0, help='fraction of vision requests answered with HTTP 500')
+    parser.add_argument('--bot-latency', type=float, default=0.02, help='Bot API latency in seconds')
+    parser.add_argument('--concurrency', type=int, default=8, help='updates processed in parallel')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--corpus', help='replay this JSON-lines corpus instead of generating one')
+    parser.add_argument('--save-corpus', help='write the generated corpus to this file and exit')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own log output")
+    parser.add_argument('--trace-file', help='trace the run and write the spans (OTLP/JSON) to this file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.corpus:
+        with open(args.corpus) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    else:
+        entries = build_corpus(args)
+    if args.save_corpus:
+        with open(args.save_corpus, 'w') as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
+        print(f"Wrote {len(entries)} updates to {args.save_corpus}")
+        return
+
+    args.vision = FakeVisionServer(args.ocr_latency, args.ocr_error_rate, args.seed)
+    args.vision.start()
+
+    workdir = tempfile.mkdtemp(prefix='ibb-replay-')
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123456:BENCHMARK',
+        'OPENAI_API_KEY': 'bench',
+        'OPENAI_BASE_URL': f"http://127.0.0.1:{args.vision.port}/v1",
+        'TARGET_GROUP_ID': str(GROUP_ID),
+        'USDT_TRANSFERS_TOPIC_ID': '0',
+        'AUTO_BALANCE_TOPIC_ID': str(BALANCE_TOPIC_ID),
+        'ACCOUNTS_MATTER_TOPIC_ID': str(ACCOUNTS_TOPIC_ID),
+        'ALERT_TOPIC_ID': str(ALERT_TOPIC_ID),
+        'MAX_CONCURRENT_UPDATES': str(args.concurrency),
+        'SQLITE_DB_FILE': os.path.join(workdir, 'bench.db'),
+    })
+    # The fake Bot API has no flood limits; keep the outbound pacing out of the measurement
+    os.environ.setdefault('OUTBOUND_GROUP_RATE', '100000')
+    os.environ.setdefault('BALANCE_PUBLISH_INTERVAL', '0')
+    os.environ.pop('PORT', None)
+    if args.trace_file:
+        os.environ['TRACE_FILE'] = os.path.abspath(args.trace_file)
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import bot
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.CRITICAL)
+    if args.trace_file:
+        bot.tracer.start()
+    bot.init_database()
+    bot.set_user_prefix(STAFF['id'], 'San', STAFF['username'])
+    for name, account in MMK_BANKS.items():
+        bot.set_mmk_bank_account(name, account, 'CHAW SU THU ZAR')
+    for name, (wallet, network) in USDT_BANKS.items():
+        bot.set_usdt_bank_account(name, wallet, network)
+
+    try:
+        result = asyncio.run(replay(bot, entries, args))
+    finally:
+        args.vision.stop()
+        # Exports the spans still buffered
+        bot.tracer.stop()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Import-time profile of the bot module
+
+Imports bot in a fresh interpreter under `python -X importtime` and prints
+the total import time with the slowest top-level packages, so that a heavy
+dependency creeping back onto the import path shows up before a deploy.
+
+    python benchmarks/startup_profile.py
+    python benchmarks/startup_profile.py --top 20 --target-ms 400 --json
+
+Exits with status 1 if importing bot takes longer than --target-ms.
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import time:     self [us] | cumulative | imported package
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+def profile_import(module='bot'):
+    """Import `module` in a subprocess; returns [(module, self_us, cumulative_us, depth)]"""
+    env = dict(os.environ)
+    env.setdefault('TELEGRAM_BOT_TOKEN', '123456:STARTUP')
+    env.setdefault('OPENAI_API_KEY', 'startup')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--top', type=int, default=10, help='top-level packages to list')
+    parser.add_argument('--target-ms', type=float, default=500, help='fail above this total import time')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    entries = profile_import()
+    total_us = next(cumulative for name, _, cumulative, _ in entries if name == 'bot')
+    bot_self_us = next(self_us for name, self_us, _, _ in entries if name == 'bot')
+
+    # Attribute every module's own time to its top-level package
+    packages = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        if name != 'bot':
+            packages[name.split('.')[0]] += self_us
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    total_ms = total_us / 1000
+    failed = total_ms > args.target_ms
+    if args.json:
+        print(json.dumps({
+            'total_ms': round(total_ms, 1),
+            'bot_self_ms': round(bot_self_us / 1000, 1),
+            'target_ms': args.target_ms,
+            'packages': [{'package': name, 'ms': round(us / 1000, 1)} for name, us in slowest],
+            'failed': failed,
+        }, indent=2))
+    else:
+        print(f"import bot: {total_ms:.0f} ms (bot itself {bot_self_us / 1000:.0f} ms, target {args.target_ms:.0f} ms)")
+        print(f"{'package':<24}{'ms':>8}")
+        for name, us in slowest:
+            print(f"{name:<24}{us / 1000:>8.1f}")
+        if failed:
+            print(f"FAIL: import took {total_ms:.0f} ms, over the {args.target_ms:.0f} ms target")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
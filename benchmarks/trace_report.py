@@ -0,0 +1,143 @@
+"""
+Settlement time report from exported traces
+
+Reads the OTLP/JSON trace file the bot writes with TRACE_FILE (one export
+request per line; a collector's file exporter writes the same format) and
+prints end-to-end settlement time - sale message to the staff reply that
+settled it - per staff member and per bank, plus where the time inside
+transactions goes: downloads, OCR, database, Telegram sends.
+
+    python benchmarks/trace_report.py traces.jsonl
+    python benchmarks/trace_report.py traces.jsonl --since-hours 24 --json
+"""
+
+import sys
+import json
+import time
+import argparse
+from collections import defaultdict
+
+def attribute_value(value):
+    """Plain Python value of an OTLP/JSON AnyValue"""
+    if 'arrayValue' in value:
+        return [attribute_value(item) for item in value['arrayValue'].get('values', [])]
+    if 'intValue' in value:
+        return int(value['intValue'])
+    for key in ('stringValue', 'doubleValue', 'boolValue'):
+        if key in value:
+            return value[key]
+    return None
+
+def read_spans(paths, since_ns=0):
+    """Every span in the files, as dicts with name, trace_id, start/end (ns) and attributes"""
+    spans = []
+    for path in paths:
+        with open(path, encoding='utf-8') as trace_file:
+            for line in trace_file:
+                if not line.strip():
+                    continue
+                for resource_spans in json.loads(line).get('resourceSpans', []):
+                    for scope_spans in resource_spans.get('scopeSpans', []):
+                        for span in scope_spans.get('spans', []):
+                            start = int(span['startTimeUnixNano'])
+                            if start < since_ns:
+                                continue
+                            spans.append({
+                                'name': span['name'],
+                                'trace_id': span['traceId'],
+                                'start': start,
+                                'end': int(span['endTimeUnixNano']),
+                                'attributes': {item['key']: attribute_value(item['value'])
+                                               for item in span.get('attributes', [])},
+                            })
+    return spans
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summarize(durations):
+    return {
+        'count': len(durations),
+        'p50_s': round(percentile(durations, 0.50), 3),
+        'p95_s': round(percentile(durations, 0.95), 3),
+        'max_s': round(max(durations), 3),
+    }
+
+def stage(span):
+    """Stage a span's time counts towards, or None for spans that contain others"""
+    name = span['name']
+    if name == 'ocr':
+        return 'ocr'
+    if name == 'telegram download':
+        return 'download'
+    if name.startswith('telegram '):
+        return 'send'
+    if 'db.system' in span['attributes']:
+        return 'database'
+    return None
+
+def report(spans):
+    settlements = [span for span in spans if span['name'] == 'settlement']
+    by_staff = defaultdict(list)
+    by_bank = defaultdict(list)
+    by_type = defaultdict(list)
+    for span in settlements:
+        seconds = (span['end'] - span['start']) / 1e9
+        attributes = span['attributes']
+        by_staff[attributes.get('staff.prefix') or str(attributes.get('staff.user_id', '?'))].append(seconds)
+        by_type[attributes.get('transaction.type', '?')].append(seconds)
+        for bank_name in attributes.get('bank.names') or ['(no balance change)']:
+            by_bank[bank_name].append(seconds)
+
+    # Time per stage, over the traces that were settled
+    settled = {span['trace_id'] for span in settlements}
+    stages = defaultdict(list)
+    for span in spans:
+        kind = stage(span)
+        if kind and span['trace_id'] in settled:
+            stages[kind].append((span['end'] - span['start']) / 1e9)
+
+    return {
+        'settlements': len(settlements),
+        'by_type': {key: summarize(values) for key, values in sorted(by_type.items())},
+        'by_staff': {key: summarize(values) for key, values in sorted(by_staff.items())},
+        'by_bank': {key: summarize(values) for key, values in sorted(by_bank.items())},
+        'stages': {
+            key: {'spans': len(values), 'total_s': round(sum(values), 3),
+                  'per_transaction_s': round(sum(values) / max(1, len(settled)), 3)}
+            for key, values in sorted(stages.items())
+        },
+    }
+
+def print_table(title, rows):
+    print(f"\n{title:<24}{'n':>6}{'p50 s':>10}{'p95 s':>10}{'max s':>10}")
+    for key, row in rows.items():
+        print(f"{key:<24}{row['count']:>6}{row['p50_s']:>10.3f}{row['p95_s']:>10.3f}{row['max_s']:>10.3f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('files', nargs='+', help='OTLP/JSON trace files (TRACE_FILE)')
+    parser.add_argument('--since-hours', type=float, default=0, help='only spans started in the last N hours')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+
+    since_ns = int((time.time() - args.since_hours * 3600) * 1e9) if args.since_hours else 0
+    result = report(read_spans(args.files, since_ns))
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    print(f"Settled transactions: {result['settlements']}")
+    if not result['settlements']:
+        return 0
+    print_table('type', result['by_type'])
+    print_table('staff', result['by_staff'])
+    print_table('bank', result['by_bank'])
+    print(f"\n{'stage':<24}{'spans':>6}{'total s':>10}{'per tx s':>10}")
+    for key, row in result['stages'].items():
+        print(f"{key:<24}{row['spans']:>6}{row['total_s']:>10.3f}{row['per_transaction_s']:>10.3f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,23 +2,51 @@
 """
 Infinity Balance Bot - Independent Mode
 Manages MMK and USDT balances via Telegram messages (no backend required)
+
+Heavy dependencies (telegram, openai, psycopg, Pillow) are imported where
+they are first used, so importing this module stays cheap for tools,
+benchmarks and worker processes; see STARTUP below.
 """
 
+from __future__ import annotations
+
+import time
+
+# Start of the import, for the startup report
+IMPORT_STARTED = time.perf_counter()
+
 import os
 import re
+import sys
 import json
+import queue
+import atexit
+import random
+import zlib
 import logging
-import base64
+import logging.handlers
+import binascii
 import sqlite3
-import psycopg
-from psycopg.rows import dict_row
 import asyncio
+import contextvars
+import functools
+import hashlib
+import hmac
+import io
+import itertools
+import signal
+import threading
 import traceback
-from telegram import Update
-from telegram.ext import Application, MessageHandler, CommandHandler, filters, ContextTypes
-from openai import OpenAI
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import TYPE_CHECKING, NamedTuple
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes
+
 # Load environment
 load_dotenv()
 
@@ -28,6 +56,11 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+# Hot-path categories, each with its own level and sample rate (LOG_LEVELS, LOG_SAMPLE):
+# per-update routing, OCR requests and answers, balance parsing
+update_log = logger.getChild('updates')
+ocr_log = logger.getChild('ocr')
+balance_log = logger.getChild('balance')
 
 # Configuration
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -38,15 +71,467 @@ AUTO_BALANCE_TOPIC_ID = int(os.getenv('AUTO_BALANCE_TOPIC_ID', '0'))
 ACCOUNTS_MATTER_TOPIC_ID = int(os.getenv('ACCOUNTS_MATTER_TOPIC_ID', '0'))
 ALERT_TOPIC_ID = int(os.getenv('ALERT_TOPIC_ID', '0'))
 
-if not TELEGRAM_BOT_TOKEN or not OPENAI_API_KEY:
-    raise ValueError("Missing required environment variables")
+# Minimum seconds between auto-balance posts; updates inside the window are
+# coalesced into one post of the latest state (0 = post after every transaction)
+BALANCE_PUBLISH_INTERVAL = int(os.getenv('BALANCE_PUBLISH_INTERVAL', '10'))
+# 1 = keep one pinned balance message edited in place and post only per-update delta lines
+BALANCE_LIVE_MESSAGE = int(os.getenv('BALANCE_LIVE_MESSAGE', '0'))
+# Outbound pacing: messages per minute per group (Telegram allows about 20)
+OUTBOUND_GROUP_RATE = int(os.getenv('OUTBOUND_GROUP_RATE', '20'))
+# 1 = merge adjacent queued status messages into one message
+OUTBOUND_MERGE_STATUS = int(os.getenv('OUTBOUND_MERGE_STATUS', '1'))
+# Updates processed in parallel (updates of the same transaction chain always run in order)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '8'))
+# Hours a handled message id is remembered to ignore redelivered updates
+PROCESSED_MESSAGE_TTL_HOURS = int(os.getenv('PROCESSED_MESSAGE_TTL_HOURS', '168'))
+# Receipts within this many bits (of 256) of an earlier receipt are duplicate candidates, confirmed by OCR
+DUPLICATE_HASH_DISTANCE = int(os.getenv('DUPLICATE_HASH_DISTANCE', '12'))
+# Hours receipts are remembered for duplicate detection and OCR reuse
+DUPLICATE_WINDOW_HOURS = int(os.getenv('DUPLICATE_WINDOW_HOURS', '24'))
+# Megabytes of recently downloaded photos kept in memory, so one receipt is fetched from Telegram once
+PHOTO_CACHE_MB = int(os.getenv('PHOTO_CACHE_MB', '32'))
+# Megabytes of receipt images that may be in flight to the vision model at once
+OCR_PAYLOAD_BUDGET_MB = int(os.getenv('OCR_PAYLOAD_BUDGET_MB', '16'))
+# Unsettled sale messages are forgotten after this many hours, or beyond this many entries
+PENDING_TTL_HOURS = int(os.getenv('PENDING_TTL_HOURS', '48'))
+PENDING_MAX_SIZE = int(os.getenv('PENDING_MAX_SIZE', '1000'))
+# OCR jobs (pre-scans, delayed media groups) run in parallel from the persisted job queue
+OCR_JOB_WORKERS = int(os.getenv('OCR_JOB_WORKERS', '2'))
+# Seconds a claimed job may run before another worker may take it over
+OCR_JOB_LEASE_SECONDS = int(os.getenv('OCR_JOB_LEASE_SECONDS', '300'))
+# 1 = leave sale receipt pre-scans to separate `python bot.py --worker` processes
+OCR_REMOTE_WORKERS = int(os.getenv('OCR_REMOTE_WORKERS', '0'))
+# Number of those worker processes; each process paces its own sends, so with workers the outbound
+# rates are split evenly between the bot and them
+OCR_WORKER_PROCESSES = int(os.getenv('OCR_WORKER_PROCESSES', '1'))
+# Photo transactions of each class handled at once; more wait their turn (pre-scans over the limit are left to the staff reply)
+ADMIT_PRESCAN = int(os.getenv('ADMIT_PRESCAN', '2'))
+ADMIT_STAFF_REPLY = int(os.getenv('ADMIT_STAFF_REPLY', '4'))
+ADMIT_P2P = int(os.getenv('ADMIT_P2P', '2'))
+ADMIT_INTERNAL_TRANSFER = int(os.getenv('ADMIT_INTERNAL_TRANSFER', '2'))
+# Waiting photo transactions at which one "backlog" notice is posted to the alert topic
+BACKLOG_NOTICE_AT = int(os.getenv('BACKLOG_NOTICE_AT', '5'))
+# Log output: 'text' (default) or 'json', one object per line with the transaction's correlation id
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').strip().lower()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').strip().upper()
+# Per-category levels and sample rates, e.g. LOG_LEVELS=ocr=WARNING,httpx=WARNING and LOG_SAMPLE=updates=0.1
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_SAMPLE = os.getenv('LOG_SAMPLE', '')
+# Log records buffered for the writer thread; beyond this they are dropped (and counted) rather than blocking
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Tracing (off unless an exporter is set): spans of each transaction, from the sale message to its settlement,
+# as OTLP/JSON posted to a collector's OTLP/HTTP endpoint (e.g. http://localhost:4318) and/or appended to a file
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT', '').rstrip('/')
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+OTEL_SERVICE_NAME = os.getenv('OTEL_SERVICE_NAME', 'infinity-balance-bot')
+# Seconds between span exports
+TRACE_EXPORT_INTERVAL = int(os.getenv('TRACE_EXPORT_INTERVAL', '5'))
+# Started with --worker: run queued OCR pre-scans only, without receiving Telegram updates
+OCR_WORKER_PROCESS = '--worker' in sys.argv[1:]
+
+# Update ingestion: 'polling' (default) or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling').strip().lower()
+# Public base URL Telegram posts updates to in webhook mode, e.g. https://my-bot.herokuapp.com
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = '/' + os.getenv('WEBHOOK_PATH', 'telegram').strip('/')
+# Checked against the X-Telegram-Bot-Api-Secret-Token header of every webhook request; required in webhook
+# mode, 1-256 characters of A-Z, a-z, 0-9, _ and - (Telegram's limits)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# HTTP listen port (set by the platform for web dynos); also serves /health in polling mode
+PORT = int(os.getenv('PORT', '0'))
+# 1 = drop updates that queued up while the bot was down, 0 = replay them on startup
+DROP_PENDING_UPDATES = int(os.getenv('DROP_PENDING_UPDATES', '1'))
+# Seconds from process start to the end of the warm-up that a restart should stay within (a warning is logged beyond it)
+STARTUP_TARGET_SECONDS = int(os.getenv('STARTUP_TARGET_SECONDS', '5'))
+# Longest time updates are held while the startup warm-up runs
+WARMUP_TIMEOUT_SECONDS = int(os.getenv('WARMUP_TIMEOUT_SECONDS', '30'))
+# OCR warm-up at startup: 0 = off, 1 = connect to the API (no tokens used), 2 = also a one-token completion as a health check
+OCR_WARMUP = int(os.getenv('OCR_WARMUP', '1'))
+
+# ============================================================================
+# LOGGING
+# ============================================================================
+
+# The transaction the current task is working on: its update chain key (see UpdateChains)
+correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+LOG_CATEGORIES = {'updates': update_log, 'ocr': ocr_log, 'balance': balance_log}
+
+def parse_log_settings(text):
+    """'ocr=WARNING, updates=0.1' -> {logger name: value}; category names map to their loggers"""
+    settings = {}
+    for item in text.split(','):
+        name, _, value = item.partition('=')
+        name, value = name.strip(), value.strip()
+        if name and value:
+            category = LOG_CATEGORIES.get(name)
+            settings[category.name if category else name] = value
+    return settings
+
+class LogContext(logging.Filter):
+    """Stamps records with the correlation id and samples the hot-path categories.
+    
+    Runs on the thread that logs, where the correlation id is visible.
+    Sampling keeps or drops whole transactions (by correlation id), so a
+    sampled transaction's log reads end to end; warnings and errors are
+    always kept.
+    """
+    
+    def __init__(self, sample_rates):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.sampled_out = 0
+    
+    def filter(self, record):
+        cid = correlation_id.get()
+        record.cid = cid or '-'
+        span = current_span.get()
+        record.trace_id = span.trace_id if span is not None else None
+        rate = self.sample_rates.get(record.name)
+        if rate is None or rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        if cid:
+            keep = zlib.crc32(cid.encode()) % 10000 < rate * 10000
+        else:
+            keep = random.random() < rate
+        if not keep:
+            self.sampled_out += 1
+        return keep
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the writer thread and never blocks.
+    
+    The stock prepare() formats every record on the logging thread. Here a
+    record whose arguments are plain values is queued as is and formatted by
+    the writer; other arguments could change before the writer gets to them,
+    so those records (and tracebacks) are rendered first. A full queue drops
+    the record instead of stalling the event loop.
+    """
+    
+    PLAIN = (str, int, float, bool, type(None))
+    
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.queued = 0
+        self.dropped = 0
+    
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        if record.args and not (isinstance(record.args, tuple) and all(isinstance(arg, self.PLAIN) for arg in record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line: time (UTC), level, logger, correlation id, trace id, message, exception"""
+    
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'cid': record.cid if getattr(record, 'cid', '-') != '-' else None,
+            'trace': getattr(record, 'trace_id', None),
+            'msg': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class LogPipeline:
+    """Moves log output off the event loop.
+    
+    Every record goes through a bounded queue to a writer thread
+    (QueueListener) that formats it as text or JSON (LOG_FORMAT) and writes
+    it to stderr, where basicConfig wrote before. LOG_LEVELS sets levels per
+    category or logger, LOG_SAMPLE keeps a fraction of a category's
+    transactions. Started by main(), so importing the module keeps plain
+    basicConfig logging.
+    """
+    
+    def __init__(self):
+        self.handler = None
+        self.context = None
+        self._listener = None
+    
+    def start(self):
+        if self._listener is not None:
+            return
+        output = logging.StreamHandler()
+        if LOG_FORMAT == 'json':
+            output.setFormatter(JsonLogFormatter())
+        else:
+            output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(cid)s - %(message)s'))
+        
+        self.context = LogContext({name: float(rate) for name, rate in parse_log_settings(LOG_SAMPLE).items()})
+        self.handler = LogQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        self.handler.addFilter(self.context)
+        
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(LOG_LEVEL)
+        for name, level in parse_log_settings(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level.upper())
+        
+        self._listener = logging.handlers.QueueListener(self.handler.queue, output)
+        self._listener.start()
+        atexit.register(self.stop)
+    
+    def stop(self):
+        """Write out what is still queued and stop the writer thread"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+    
+    def summary(self):
+        if self.handler is None:
+            return "direct (pipeline not started)"
+        return (f"{self.handler.queued} queued, {self.context.sampled_out} sampled out, "
+                f"{self.handler.dropped} dropped, {self.handler.queue.qsize()} waiting")
+
+log_pipeline = LogPipeline()
+
+# ============================================================================
+# TRACING
+# ============================================================================
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_CONSUMER = 5
+
+# The span the current task is in; child spans and the logs' trace ids come from it
+current_span = contextvars.ContextVar('current_span', default=None)
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+class Span:
+    """One timed step of a transaction (times in Unix nanoseconds).
+
+    `trace_start` is when the transaction's first span started; it travels
+    with the trace context (carrier()) so the settlement span can cover the
+    whole transaction, even across a restart.
+    """
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'kind', 'start', 'end', 'trace_start', 'attributes', 'error')
+
+    def __init__(self, name, trace_id, parent_id=None, kind=SPAN_KIND_INTERNAL, start=None, trace_start=None,
+                 attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start = start or time.time_ns()
+        self.end = None
+        self.trace_start = trace_start or self.start
+        self.attributes = dict(attributes) if attributes else {}
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def carrier(self):
+        """JSON-serializable trace context, stored with queued jobs"""
+        return {'traceparent': f"00-{self.trace_id}-{self.span_id}-01", 'start': self.trace_start}
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in self.attributes.items()],
+        }
+        if self.error:
+            span['status'] = {'code': 2, 'message': self.error}
+        return span
+
+class _NoSpan:
+    """Stands in for a span when tracing is off or the code runs outside any transaction"""
+
+    def set(self, key, value):
+        pass
+
+NO_SPAN = nullcontext(_NoSpan())
+
+def otlp_value(value):
+    """An attribute value in OTLP/JSON form"""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    if isinstance(value, (list, tuple)):
+        return {'arrayValue': {'values': [otlp_value(item) for item in value]}}
+    return {'stringValue': str(value)}
+
+class Tracer:
+    """Spans of each transaction, exported as OTLP/JSON.
+
+    A transaction's trace starts with its sale message; the trace context is
+    stored with the pending sale and with queued jobs, and the staff reply
+    resumes it (see UpdateChains.trace), so the sale, its pre-scan, album
+    delays, the staff reply and the settlement read as one trace. Downloads,
+    OCR requests, database statements, Telegram sends and balance posts are
+    spans within it.
+
+    Finished spans are buffered and exported by a background thread every
+    TRACE_EXPORT_INTERVAL seconds: posted to OTEL_EXPORTER_OTLP_ENDPOINT
+    (/v1/traces) and/or appended to TRACE_FILE, one export request per line.
+    Until start() finds an exporter configured, span() is a no-op.
+    """
+
+    MAX_BUFFERED = 20000
+
+    def __init__(self, endpoint, path, service_name, interval):
+        self.endpoint = endpoint
+        self.path = path
+        self.service_name = service_name
+        self.interval = interval
+        self.enabled = False
+        self.exported = 0
+        self.dropped = 0
+        self.failed_exports = 0
+        self._failing = False
+        self._spans = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None or not (self.endpoint or self.path):
+            return
+        self.enabled = True
+        self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info("🔭 Tracing to %s", ' and '.join(filter(None, [self.endpoint, self.path])))
+
+    def stop(self):
+        """Export what is still buffered and stop the export thread"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.export()
+
+    def new_span(self, name, parent=None, kind=SPAN_KIND_INTERNAL, attributes=None, start=None):
+        """A span under `parent` (a Span, or a carrier() dict from another task or process); a new trace without one"""
+        if isinstance(parent, Span):
+            return Span(name, parent.trace_id, parent.span_id, kind, start, parent.trace_start, attributes)
+        context = parse_traceparent(parent['traceparent']) if parent else None
+        if context is None:
+            return Span(name, os.urandom(16).hex(), None, kind, start, None, attributes)
+        trace_id, parent_id = context
+        return Span(name, trace_id, parent_id, kind, start, parent.get('start'), attributes)
+
+    @contextmanager
+    def activate(self, span):
+        """Run the block in `span`, which ends (and records any exception) with it"""
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current_span.reset(token)
+            self.finish(span)
+
+    def span(self, name, attributes=None, kind=SPAN_KIND_INTERNAL):
+        """Context manager for a child of the current span; a no-op outside a transaction or with tracing off"""
+        if not self.enabled:
+            return NO_SPAN
+        parent = current_span.get()
+        if parent is None:
+            return NO_SPAN
+        return self.activate(self.new_span(name, parent, kind, attributes))
+
+    def finish(self, span, end=None):
+        span.end = end or time.time_ns()
+        with self._lock:
+            if len(self._spans) >= self.MAX_BUFFERED:
+                self.dropped += 1
+                return
+            self._spans.append(span)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def export(self):
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        request = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': otlp_value(self.service_name)}]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [span.to_otlp() for span in spans]}],
+        }]}
+        try:
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as trace_file:
+                    trace_file.write(json.dumps(request, ensure_ascii=False) + '\n')
+            if self.endpoint:
+                import httpx
+                httpx.post(f"{self.endpoint}/v1/traces", json=request, timeout=10).raise_for_status()
+            self.exported += len(spans)
+            if self._failing:
+                self._failing = False
+                logger.info("🔭 Span export recovered")
+        except Exception as e:
+            self.failed_exports += 1
+            self.dropped += len(spans)
+            # Once per outage, not every interval
+            if not self._failing:
+                self._failing = True
+                logger.warning("Could not export %s spans, dropping spans until the exporter recovers: %s",
+                               len(spans), e)
+
+    def summary(self):
+        if not self.enabled:
+            return "off"
+        return f"{self.exported} spans exported, {len(self._spans)} buffered, {self.dropped} dropped, {self.failed_exports} failed exports"
+
+def parse_traceparent(text):
+    """W3C traceparent '00-<trace id>-<parent id>-<flags>' -> (trace id, parent id), or None"""
+    parts = (text or '').split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+tracer = Tracer(OTEL_EXPORTER_OTLP_ENDPOINT, TRACE_FILE, OTEL_SERVICE_NAME, TRACE_EXPORT_INTERVAL)
+
+@functools.cache
+def openai_client():
+    """The OpenAI client, built (and the openai package imported) on first use"""
+    from openai import OpenAI
+    return OpenAI(api_key=OPENAI_API_KEY)
 
 def get_db_connection():
     """Return a database connection (PostgreSQL or SQLite based on env)"""
     db_url = os.getenv('DATABASE_URL')
     if db_url and db_url.startswith('postgres'):
+        import psycopg
+        from psycopg.rows import dict_row
         conn = psycopg.connect(db_url, row_factory=dict_row)
         return conn
     else:
@@ -54,336 +539,590 @@ def get_db_connection():
         conn = sqlite3.connect(db_file)
         return conn
 
+# ============================================================================
+# QUERY LAYER
+# ============================================================================
+
+class Query:
+    """One SQL statement, with its text for each dialect worked out up front.
+
+    `sqlite` uses ? placeholders; `postgres` defaults to the same text with %s
+    placeholders and only needs spelling out where the SQL itself differs
+    (INSERT OR REPLACE vs ON CONFLICT ...). Rows come back as `row`, a
+    NamedTuple built from the selected columns in order, on either dialect.
+    `summary` (e.g. "SELECT pending_transactions") names its trace spans.
+    """
+
+    __slots__ = ('sqlite', 'postgres', 'row', 'summary')
+
+    def __init__(self, sqlite, postgres=None, row=None):
+        self.sqlite = sqlite
+        self.postgres = postgres if postgres is not None else sqlite.replace('?', '%s')
+        self.row = row
+        table = re.search(r'\b(?:FROM|INTO|UPDATE)\s+(\w+)', sqlite, re.IGNORECASE)
+        self.summary = ' '.join(filter(None, [sqlite.split(None, 1)[0].upper(), table and table.group(1)]))
+
+class Database:
+    """Per-thread connections to the configured database, with the dialect resolved once.
+
+    Connections are kept open and in autocommit mode, so each statement
+    commits on its own as the old connect-execute-commit-close helpers did,
+    without paying for a new connection every call. Statements are prepared
+    once per connection: sqlite3 caches them itself, and on PostgreSQL they
+    are executed with prepare=True.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._dialect = None
+        self.connects = 0
+
+    @property
+    def dialect(self):
+        if self._dialect is None:
+            db_url = os.getenv('DATABASE_URL')
+            self._dialect = 'postgres' if db_url and db_url.startswith('postgres') else 'sqlite'
+        return self._dialect
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self.dialect == 'postgres' and (conn.closed or conn.broken):
+            # The server went away since the last call: reconnect rather than fail
+            conn = None
+        if conn is None:
+            if self.dialect == 'postgres':
+                import psycopg
+                from psycopg.rows import tuple_row
+                conn = psycopg.connect(os.getenv('DATABASE_URL'), autocommit=True, row_factory=tuple_row)
+            else:
+                conn = sqlite3.connect(os.getenv('SQLITE_DB_FILE', 'bot_data.db'), isolation_level=None)
+            self._local.conn = conn
+            self.connects += 1
+        return conn
+
+    def _run(self, query, params, result):
+        with tracer.span(query.summary, {'db.system': self.dialect}, SPAN_KIND_CLIENT):
+            cursor = self.connection().cursor()
+            if self.dialect == 'postgres':
+                cursor.execute(query.postgres, params, prepare=True)
+            else:
+                cursor.execute(query.sqlite, params)
+            return result(cursor)
+
+    @contextmanager
+    def transaction(self):
+        """Run the block's statements in one transaction on this thread's connection
+
+        On SQLite it starts with BEGIN IMMEDIATE, which takes the write lock
+        up front, so two processes cannot both read a row and then update it.
+        On PostgreSQL the statements lock the rows they read themselves
+        (SELECT ... FOR UPDATE [SKIP LOCKED]).
+        """
+        conn = self.connection()
+        if self.dialect == 'postgres':
+            with conn.transaction():
+                yield
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def execute(self, query, params=()):
+        """Run a statement; returns the number of rows it changed"""
+        return self._run(query, params, lambda cursor: cursor.rowcount)
+
+    def fetchone(self, query, params=()):
+        row = self._run(query, params, lambda cursor: cursor.fetchone())
+        if row is None or query.row is None:
+            return row
+        return query.row._make(row)
+
+    def fetchall(self, query, params=()):
+        rows = self._run(query, params, lambda cursor: cursor.fetchall())
+        if query.row is None:
+            return rows
+        return [query.row._make(row) for row in rows]
+
+    def close(self):
+        """Close this thread's connection (the next call opens a new one)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+db = Database()
+
+# ============================================================================
+# SCHEMA MIGRATIONS
+# ============================================================================
+
+# Default verification accounts, seeded once by the initial migration
+DEFAULT_MMK_BANK_ACCOUNTS = [
+    ('San(CB)', '0225100900026042', 'Chaw Su Thu Zar'),
+    ('San(KBZ)', '27251127201844001', 'CHAW SU THU ZAR'),
+    ('San(Yoma)', '007011118014339', 'Daw Chaw Su Thu Zar'),
+    ('San(Kpay P)', '300948464', 'Chaw Su'),
+    ('San(AYA)', '40038204256', 'CHAW SU THU ZAR'),
+]
+DEFAULT_USDT_BANK_ACCOUNTS = [
+    ('ACT(BNB Wallet)', '0x640e9AEde10B610834876cCc0ef2576C9469CB0e', 'BNB'),
+    ('ACT(Tron Wallet)', 'TCFKANz7vhaMLtxjTSYSZRRGdVivNNPDEy', 'Tron'),
+    ('ACT(SOL Wallet)', 'EECRtME4j6uqd3GsjbkoWhKuYxX2V7LCcHjwP3y5JPnD', 'SOL'),
+    ('ACT(TON Wallet)', 'UQBkM-eV3JW6pzFaf_JGvTewOEw6nl38lXIdnDMF3H8UpRCQ', 'TON'),
+]
+
+# Ordered schema migrations: (version, description, {dialect: [statement, ...]}).
+# A statement is SQL text or an (SQL, params) pair. Each migration runs in one
+# transaction together with its schema_version row; append new versions at the
+# end and never edit one that has shipped. Version 1 is the schema that used to
+# be created on every boot, written with IF NOT EXISTS / ignore-on-conflict so it
+# also adopts databases created before schema_version existed.
+SCHEMA_MIGRATIONS = [
+    (1, "Initial schema and default accounts", {
+        'sqlite': [
+            # User prefixes table
+            '''
+                CREATE TABLE IF NOT EXISTS user_prefixes (
+                    user_id INTEGER PRIMARY KEY,
+                    prefix_name TEXT NOT NULL,
+                    username TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''',
+            # Settings table for receiving USDT account
+            '''
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''',
+            # MMK bank accounts table for verification
+            '''
+                CREATE TABLE IF NOT EXISTS mmk_bank_accounts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bank_name TEXT NOT NULL UNIQUE,
+                    account_number TEXT NOT NULL,
+                    account_holder TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''',
+            # USDT bank accounts table for receiving USDT (buy transactions)
+            '''
+                CREATE TABLE IF NOT EXISTS usdt_bank_accounts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bank_name TEXT NOT NULL UNIQUE,
+                    wallet_address TEXT NOT NULL,
+                    network TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''',
+            # Media group photos table for storing downloaded photos
+            '''
+                CREATE TABLE IF NOT EXISTS media_group_photos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    media_group_id TEXT NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    file_path TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(media_group_id, message_id)
+                )
+            ''',
+            # Create index for faster lookups
+            '''
+                CREATE INDEX IF NOT EXISTS idx_media_group_id ON media_group_photos(media_group_id)
+            ''',
+            '''
+                CREATE INDEX IF NOT EXISTS idx_message_id ON media_group_photos(message_id)
+            ''',
+            # Sale receipt OCR results table - stores pre-scanned receipt data
+            '''
+                CREATE TABLE IF NOT EXISTS sale_receipt_ocr (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message_id INTEGER NOT NULL,
+                    media_group_id TEXT,
+                    receipt_index INTEGER DEFAULT 0,
+                    transaction_type TEXT,
+                    detected_amount REAL,
+                    detected_bank TEXT,
+                    detected_usdt REAL,
+                    ocr_raw_data TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(message_id, receipt_index)
+                )
+            ''',
+            # Create index for sale receipt lookups
+            '''
+                CREATE INDEX IF NOT EXISTS idx_sale_receipt_message_id ON sale_receipt_ocr(message_id)
+            ''',
+            '''
+                CREATE INDEX IF NOT EXISTS idx_sale_receipt_media_group ON sale_receipt_ocr(media_group_id)
+            ''',
+            # OCR job queue - pre-scans and delayed media group processing survive restarts
+            # (run_after / lease_until / updated_at are unix timestamps)
+            '''
+                CREATE TABLE IF NOT EXISTS ocr_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    dedupe_key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 5,
+                    run_after REAL NOT NULL,
+                    lease_owner TEXT,
+                    lease_until REAL,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at REAL
+                )
+            ''',
+            '''
+                CREATE INDEX IF NOT EXISTS idx_ocr_jobs_state_run_after ON ocr_jobs(state, run_after)
+            ''',
+            # Sale messages waiting for the staff reply that settles them (created_at is a unix timestamp)
+            '''
+                CREATE TABLE IF NOT EXISTS pending_transactions (
+                    message_id INTEGER PRIMARY KEY,
+                    media_group_id TEXT,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''',
+            '''
+                CREATE INDEX IF NOT EXISTS idx_pending_transactions_media_group ON pending_transactions(media_group_id)
+            ''',
+            # Messages already handled, so redelivered updates and re-run jobs do not apply twice
+            # (effect is the JSON list of balance changes made; created_at is a unix timestamp)
+            '''
+                CREATE TABLE IF NOT EXISTS processed_messages (
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    handler TEXT NOT NULL,
+                    effect TEXT,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (chat_id, message_id, handler)
+                )
+            ''',
+            # Default receiving USDT account and verification accounts
+            "INSERT OR IGNORE INTO settings (key, value) VALUES ('receiving_usdt_account', 'ACT(Wallet)')",
+            *[('INSERT OR IGNORE INTO mmk_bank_accounts (bank_name, account_number, account_holder) VALUES (?, ?, ?)', row)
+              for row in DEFAULT_MMK_BANK_ACCOUNTS],
+            *[('INSERT OR IGNORE INTO usdt_bank_accounts (bank_name, wallet_address, network) VALUES (?, ?, ?)', row)
+              for row in DEFAULT_USDT_BANK_ACCOUNTS],
+        ],
+        'postgres': [
+            # User prefixes table
+            '''
+                CREATE TABLE IF NOT EXISTS user_prefixes (
+                    user_id SERIAL PRIMARY KEY,
+                    prefix_name TEXT NOT NULL,
+                    username TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''',
+            # Settings table for receiving USDT account
+            '''
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''',
+            # MMK bank accounts table for verification
+            '''
+                CREATE TABLE IF NOT EXISTS mmk_bank_accounts (
+                    id SERIAL PRIMARY KEY,
+                    bank_name TEXT NOT NULL UNIQUE,
+                    account_number TEXT NOT NULL,
+                    account_holder TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''',
+            # USDT bank accounts table for receiving USDT (buy transactions)
+            '''
+                CREATE TABLE IF NOT EXISTS usdt_bank_accounts (
+                    id SERIAL PRIMARY KEY,
+                    bank_name TEXT NOT NULL UNIQUE,
+                    wallet_address TEXT NOT NULL,
+                    network TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''',
+            # Media group photos table for storing downloaded photos
+            '''
+                CREATE TABLE IF NOT EXISTS media_group_photos (
+                    id SERIAL PRIMARY KEY,
+                    media_group_id TEXT NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    file_path TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(media_group_id, message_id)
+                )
+            ''',
+            # Create index for faster lookups
+            '''
+                CREATE INDEX IF NOT EXISTS idx_media_group_id ON media_group_photos(media_group_id)
+            ''',
+            '''
+                CREATE INDEX IF NOT EXISTS idx_message_id ON media_group_photos(message_id)
+            ''',
+            # Sale receipt OCR results table - stores pre-scanned receipt data
+            '''
+                CREATE TABLE IF NOT EXISTS sale_receipt_ocr (
+                    id SERIAL PRIMARY KEY,
+                    message_id INTEGER NOT NULL,
+                    media_group_id TEXT,
+                    receipt_index INTEGER DEFAULT 0,
+                    transaction_type TEXT,
+                    detected_amount REAL,
+                    detected_bank TEXT,
+                    detected_usdt REAL,
+                    ocr_raw_data TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(message_id, receipt_index)
+                )
+            ''',
+            # Create index for sale receipt lookups
+            '''
+                CREATE INDEX IF NOT EXISTS idx_sale_receipt_message_id ON sale_receipt_ocr(message_id)
+            ''',
+            '''
+                CREATE INDEX IF NOT EXISTS idx_sale_receipt_media_group ON sale_receipt_ocr(media_group_id)
+            ''',
+            # OCR job queue - pre-scans and delayed media group processing survive restarts
+            # (run_after / lease_until / updated_at are unix timestamps)
+            '''
+                CREATE TABLE IF NOT EXISTS ocr_jobs (
+                    id SERIAL PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    dedupe_key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 5,
+                    run_after DOUBLE PRECISION NOT NULL,
+                    lease_owner TEXT,
+                    lease_until DOUBLE PRECISION,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DOUBLE PRECISION
+                )
+            ''',
+            '''
+                CREATE INDEX IF NOT EXISTS idx_ocr_jobs_state_run_after ON ocr_jobs(state, run_after)
+            ''',
+            # Sale messages waiting for the staff reply that settles them (created_at is a unix timestamp)
+            '''
+                CREATE TABLE IF NOT EXISTS pending_transactions (
+                    message_id BIGINT PRIMARY KEY,
+                    media_group_id TEXT,
+                    data TEXT NOT NULL,
+                    created_at DOUBLE PRECISION NOT NULL
+                )
+            ''',
+            '''
+                CREATE INDEX IF NOT EXISTS idx_pending_transactions_media_group ON pending_transactions(media_group_id)
+            ''',
+            # Messages already handled, so redelivered updates and re-run jobs do not apply twice
+            # (effect is the JSON list of balance changes made; created_at is a unix timestamp)
+            '''
+                CREATE TABLE IF NOT EXISTS processed_messages (
+                    chat_id BIGINT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    handler TEXT NOT NULL,
+                    effect TEXT,
+                    created_at DOUBLE PRECISION NOT NULL,
+                    PRIMARY KEY (chat_id, message_id, handler)
+                )
+            ''',
+            # Default receiving USDT account and verification accounts
+            "INSERT INTO settings (key, value) VALUES ('receiving_usdt_account', 'ACT(Wallet)') ON CONFLICT (key) DO NOTHING",
+            *[('INSERT INTO mmk_bank_accounts (bank_name, account_number, account_holder) VALUES (%s, %s, %s) '
+               'ON CONFLICT (bank_name) DO NOTHING', row)
+              for row in DEFAULT_MMK_BANK_ACCOUNTS],
+            *[('INSERT INTO usdt_bank_accounts (bank_name, wallet_address, network) VALUES (%s, %s, %s) '
+               'ON CONFLICT (bank_name) DO NOTHING', row)
+              for row in DEFAULT_USDT_BANK_ACCOUNTS],
+        ],
+    }),
+    (2, "Indexes for age-based pruning", {
+        'sqlite': [
+            'CREATE INDEX IF NOT EXISTS idx_processed_messages_created_at ON processed_messages(created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_pending_transactions_created_at ON pending_transactions(created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_sale_receipt_created_at ON sale_receipt_ocr(created_at)',
+        ],
+        'postgres': [
+            'CREATE INDEX IF NOT EXISTS idx_processed_messages_created_at ON processed_messages(created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_pending_transactions_created_at ON pending_transactions(created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_sale_receipt_created_at ON sale_receipt_ocr(created_at)',
+        ],
+    }),
+    (3, "Telegram photo of each stored media group photo", {
+        'sqlite': [
+            'ALTER TABLE media_group_photos ADD COLUMN photo TEXT',
+        ],
+        'postgres': [
+            'ALTER TABLE media_group_photos ADD COLUMN IF NOT EXISTS photo TEXT',
+        ],
+    }),
+]
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+# A primary-key lookup: the whole startup cost when the schema is up to date
+SELECT_SCHEMA_VERSION = Query('SELECT MAX(version) FROM schema_version')
+CREATE_SCHEMA_VERSION_TABLE = Query(
+    '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    '''
+)
+INSERT_SCHEMA_VERSION = Query('INSERT INTO schema_version (version, description) VALUES (?, ?)')
+
+def get_schema_version():
+    """Highest applied migration version, or 0 for a database without schema_version"""
+    try:
+        row = db.fetchone(SELECT_SCHEMA_VERSION)
+    except Exception:
+        return 0
+    return row[0] or 0
+
+def apply_migration(version, description, statements):
+    """Run one migration and record it in schema_version, in a single transaction"""
+    with db.transaction():
+        db.execute(CREATE_SCHEMA_VERSION_TABLE)
+        for statement in statements:
+            sql, params = statement if isinstance(statement, tuple) else (statement, ())
+            # Already written for the dialect it runs on
+            db.execute(Query(sql, postgres=sql), params)
+        db.execute(INSERT_SCHEMA_VERSION, (version, description))
+
 def init_database():
-    """Initialize database for user-prefix mappings and settings (Postgres or SQLite)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # User prefixes table
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_prefixes (
-                user_id INTEGER PRIMARY KEY,
-                prefix_name TEXT NOT NULL,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-    else:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_prefixes (
-                user_id SERIAL PRIMARY KEY,
-                prefix_name TEXT NOT NULL,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-    
-    # Settings table for receiving USDT account
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # MMK bank accounts table for verification
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS mmk_bank_accounts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                bank_name TEXT NOT NULL UNIQUE,
-                account_number TEXT NOT NULL,
-                account_holder TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-    else:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS mmk_bank_accounts (
-                id SERIAL PRIMARY KEY,
-                bank_name TEXT NOT NULL UNIQUE,
-                account_number TEXT NOT NULL,
-                account_holder TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-    
-    # USDT bank accounts table for receiving USDT (buy transactions)
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS usdt_bank_accounts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                bank_name TEXT NOT NULL UNIQUE,
-                wallet_address TEXT NOT NULL,
-                network TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-    else:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS usdt_bank_accounts (
-                id SERIAL PRIMARY KEY,
-                bank_name TEXT NOT NULL UNIQUE,
-                wallet_address TEXT NOT NULL,
-                network TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-    
-    # Media group photos table for storing downloaded photos
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS media_group_photos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                media_group_id TEXT NOT NULL,
-                message_id INTEGER NOT NULL,
-                file_path TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(media_group_id, message_id)
-            )
-        ''')
-    else:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS media_group_photos (
-                id SERIAL PRIMARY KEY,
-                media_group_id TEXT NOT NULL,
-                message_id INTEGER NOT NULL,
-                file_path TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(media_group_id, message_id)
-            )
-        ''')
-    
-    # Create index for faster lookups
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_media_group_id ON media_group_photos(media_group_id)
-    ''')
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_message_id ON media_group_photos(message_id)
-    ''')
-    
-    # Sale receipt OCR results table - stores pre-scanned receipt data
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sale_receipt_ocr (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                message_id INTEGER NOT NULL,
-                media_group_id TEXT,
-                receipt_index INTEGER DEFAULT 0,
-                transaction_type TEXT,
-                detected_amount REAL,
-                detected_bank TEXT,
-                detected_usdt REAL,
-                ocr_raw_data TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(message_id, receipt_index)
-            )
-        ''')
-    else:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sale_receipt_ocr (
-                id SERIAL PRIMARY KEY,
-                message_id INTEGER NOT NULL,
-                media_group_id TEXT,
-                receipt_index INTEGER DEFAULT 0,
-                transaction_type TEXT,
-                detected_amount REAL,
-                detected_bank TEXT,
-                detected_usdt REAL,
-                ocr_raw_data TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(message_id, receipt_index)
-            )
-        ''')
-    
-    # Create index for sale receipt lookups
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_sale_receipt_message_id ON sale_receipt_ocr(message_id)
-    ''')
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_sale_receipt_media_group ON sale_receipt_ocr(media_group_id)
-    ''')
-    
-    # Set default receiving USDT account if not exists
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            INSERT OR IGNORE INTO settings (key, value)
-            VALUES ('receiving_usdt_account', 'ACT(Wallet)')
-        ''')
-    else:
-        cursor.execute('''
-            INSERT INTO settings (key, value)
-            VALUES ('receiving_usdt_account', 'ACT(Wallet)')
-            ON CONFLICT (key) DO NOTHING
-        ''')
-    
-    # Insert default MMK bank accounts if not exists
-    default_banks = [
-        ('San(CB)', '0225100900026042', 'Chaw Su Thu Zar'),
-        ('San(KBZ)', '27251127201844001', 'CHAW SU THU ZAR'),
-        ('San(Yoma)', '007011118014339', 'Daw Chaw Su Thu Zar'),
-        ('San(Kpay P)', '300948464', 'Chaw Su'),
-        ('San(AYA)', '40038204256', 'CHAW SU THU ZAR'),
-    ]
-    
-    for bank_name, account_number, account_holder in default_banks:
-        if isinstance(conn, sqlite3.Connection):
-            cursor.execute('''
-                INSERT OR IGNORE INTO mmk_bank_accounts (bank_name, account_number, account_holder)
-                VALUES (?, ?, ?)
-            ''', (bank_name, account_number, account_holder))
-        else:
-            cursor.execute('''
-                INSERT INTO mmk_bank_accounts (bank_name, account_number, account_holder)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (bank_name) DO NOTHING
-            ''', (bank_name, account_number, account_holder))
-    
-    # Insert default USDT bank accounts if not exists
-    default_usdt_banks = [
-        ('ACT(BNB Wallet)', '0x640e9AEde10B610834876cCc0ef2576C9469CB0e', 'BNB'),
-        ('ACT(Tron Wallet)', 'TCFKANz7vhaMLtxjTSYSZRRGdVivNNPDEy', 'Tron'),
-        ('ACT(SOL Wallet)', 'EECRtME4j6uqd3GsjbkoWhKuYxX2V7LCcHjwP3y5JPnD', 'SOL'),
-        ('ACT(TON Wallet)', 'UQBkM-eV3JW6pzFaf_JGvTewOEw6nl38lXIdnDMF3H8UpRCQ', 'TON'),
-    ]
-    
-    for bank_name, wallet_address, network in default_usdt_banks:
-        if isinstance(conn, sqlite3.Connection):
-            cursor.execute('''
-                INSERT OR IGNORE INTO usdt_bank_accounts (bank_name, wallet_address, network)
-                VALUES (?, ?, ?)
-            ''', (bank_name, wallet_address, network))
-        else:
-            cursor.execute('''
-                INSERT INTO usdt_bank_accounts (bank_name, wallet_address, network)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (bank_name) DO NOTHING
-            ''', (bank_name, wallet_address, network))
-    
-    conn.commit()
-    conn.close()
-    logger.info("✅ Database initialized with default MMK and USDT banks")
+    """Bring the database schema (Postgres or SQLite) up to SCHEMA_VERSION
+
+    One query when the schema is already current; otherwise every pending
+    migration runs in its own transaction and its timing is logged.
+    """
+    current = get_schema_version()
+    if current >= SCHEMA_VERSION:
+        logger.info("✅ Database schema up to date (version %s)", current)
+        return
 
-# Media group photos directory
+    started = time.perf_counter()
+    for version, description, scripts in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        migration_started = time.perf_counter()
+        try:
+            apply_migration(version, description, scripts[db.dialect])
+        except Exception:
+            # The bot and a --worker process starting together may race to apply it
+            if get_schema_version() >= version:
+                logger.info("⏭️ Schema migration %s was applied by another process", version)
+                continue
+            logger.error("❌ Schema migration %s (%s) failed and was rolled back", version, description)
+            raise
+        logger.info("🗄️ Applied schema migration %s: %s (%.1f ms)",
+                    version, description, (time.perf_counter() - migration_started) * 1000)
+    logger.info("✅ Database schema migrated from version %s to %s in %.1f ms",
+                current, SCHEMA_VERSION, (time.perf_counter() - started) * 1000)
+
+# Media group photos directory (created with the first saved photo)
 MEDIA_GROUP_DIR = 'media_group_photos'
-os.makedirs(MEDIA_GROUP_DIR, exist_ok=True)
 
-def save_media_group_photo(media_group_id: str, message_id: int, photo_bytes: bytes) -> str:
-    """Save a photo from media group to disk and record in database"""
+class MediaGroupPhoto(NamedTuple):
+    message_id: int
+    file_path: str
+
+SAVE_MEDIA_GROUP_PHOTO = Query(
+    '''
+    INSERT OR REPLACE INTO media_group_photos (media_group_id, message_id, file_path, photo)
+    VALUES (?, ?, ?, ?)
+    ''',
+    '''
+    INSERT INTO media_group_photos (media_group_id, message_id, file_path, photo)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (media_group_id, message_id) DO UPDATE SET file_path = EXCLUDED.file_path, photo = EXCLUDED.photo
+    '''
+)
+SELECT_MEDIA_GROUP_PHOTOS = Query(
+    '''
+    SELECT message_id, file_path FROM media_group_photos
+    WHERE media_group_id = ?
+    ORDER BY message_id
+    ''',
+    row=MediaGroupPhoto
+)
+SELECT_MEDIA_GROUP_TELEGRAM_PHOTOS = Query(
+    'SELECT message_id, photo FROM media_group_photos WHERE media_group_id = ? AND photo IS NOT NULL'
+)
+SELECT_MEDIA_GROUP_ID = Query('SELECT media_group_id FROM media_group_photos WHERE message_id = ?')
+SELECT_MEDIA_GROUP_FILES = Query('SELECT file_path FROM media_group_photos WHERE media_group_id = ?')
+DELETE_MEDIA_GROUP_PHOTOS = Query('DELETE FROM media_group_photos WHERE media_group_id = ?')
+SELECT_OLD_MEDIA_GROUPS = Query(
+    "SELECT DISTINCT media_group_id FROM media_group_photos WHERE created_at < datetime('now', ? || ' hours')",
+    "SELECT DISTINCT media_group_id FROM media_group_photos WHERE created_at < NOW() - %s * INTERVAL '1 hour'"
+)
+
+def save_media_group_photo(media_group_id: str, message_id: int, photo_bytes: bytes, photo=None) -> str:
+    """Save a photo from media group to disk and record in database
+
+    `photo` (the PhotoSize) is recorded too, so processes without the file
+    on their disk can download it from Telegram.
+    """
     # Create filename
     filename = f"{media_group_id}_{message_id}.jpg"
     file_path = os.path.join(MEDIA_GROUP_DIR, filename)
-    
+
     # Save to disk
+    os.makedirs(MEDIA_GROUP_DIR, exist_ok=True)
     with open(file_path, 'wb') as f:
         f.write(photo_bytes)
-    
+
     # Save to database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            INSERT INTO media_group_photos (media_group_id, message_id, file_path)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (media_group_id, message_id) DO UPDATE SET file_path = EXCLUDED.file_path
-        ''', (media_group_id, message_id, file_path))
-    except Exception:
-        cursor.execute('''
-            INSERT OR REPLACE INTO media_group_photos (media_group_id, message_id, file_path)
-            VALUES (?, ?, ?)
-        ''', (media_group_id, message_id, file_path))
-    conn.commit()
-    conn.close()
-    
+    db.execute(SAVE_MEDIA_GROUP_PHOTO, (media_group_id, message_id, file_path,
+                                        json.dumps(photo.to_dict()) if photo is not None else None))
+
     logger.info(f"Saved media group photo: {file_path}")
     return file_path
 
 def get_media_group_photos(media_group_id: str) -> list:
-    """Get all photo paths for a media group from database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            SELECT message_id, file_path FROM media_group_photos
-            WHERE media_group_id = %s
-            ORDER BY message_id
-        ''', (media_group_id,))
-    except Exception:
-        cursor.execute('''
-            SELECT message_id, file_path FROM media_group_photos
-            WHERE media_group_id = ?
-            ORDER BY message_id
-        ''', (media_group_id,))
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    """Get all (message_id, file_path) photos for a media group from database"""
+    return db.fetchall(SELECT_MEDIA_GROUP_PHOTOS, (media_group_id,))
+
+def get_media_group_telegram_photos(media_group_id: str) -> dict:
+    """message_id -> PhotoSize dict of the photos saved with one, for a media group"""
+    return {message_id: json.loads(photo) for message_id, photo in db.fetchall(SELECT_MEDIA_GROUP_TELEGRAM_PHOTOS, (media_group_id,))}
 
 def get_media_group_by_message_id(message_id: int) -> tuple:
     """Get media group ID and all photos by any message ID in the group"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # First find the media_group_id for this message
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            SELECT media_group_id FROM media_group_photos
-            WHERE message_id = ?
-        ''', (message_id,))
-    else:
-        cursor.execute('''
-            SELECT media_group_id FROM media_group_photos
-            WHERE message_id = %s
-        ''', (message_id,))
-    result = cursor.fetchone()
-    
+    result = db.fetchone(SELECT_MEDIA_GROUP_ID, (message_id,))
     if not result:
-        conn.close()
         return None, []
-    
+
     media_group_id = result[0]
-    
+
     # Get all photos in this media group
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            SELECT message_id, file_path FROM media_group_photos
-            WHERE media_group_id = ?
-            ORDER BY message_id
-        ''', (media_group_id,))
-    else:
-        cursor.execute('''
-            SELECT message_id, file_path FROM media_group_photos
-            WHERE media_group_id = %s
-            ORDER BY message_id
-        ''', (media_group_id,))
-    photos = cursor.fetchall()
-    conn.close()
-    
-    return media_group_id, photos
+    return media_group_id, db.fetchall(SELECT_MEDIA_GROUP_PHOTOS, (media_group_id,))
 
 def delete_media_group_photos(media_group_id: str):
     """Delete all photos for a media group from disk and database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # Get file paths first
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            SELECT file_path FROM media_group_photos
-            WHERE media_group_id = ?
-        ''', (media_group_id,))
-    else:
-        cursor.execute('''
-            SELECT file_path FROM media_group_photos
-            WHERE media_group_id = %s
-        ''', (media_group_id,))
-    results = cursor.fetchall()
-    
+    results = db.fetchall(SELECT_MEDIA_GROUP_FILES, (media_group_id,))
+
     # Delete files from disk
     for (file_path,) in results:
         try:
@@ -392,46 +1131,22 @@ def delete_media_group_photos(media_group_id: str):
                 logger.info(f"Deleted media group photo: {file_path}")
         except Exception as e:
             logger.warning(f"Could not delete file {file_path}: {e}")
-    
+
     # Delete from database
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            DELETE FROM media_group_photos
-            WHERE media_group_id = ?
-        ''', (media_group_id,))
-    else:
-        cursor.execute('''
-            DELETE FROM media_group_photos
-            WHERE media_group_id = %s
-        ''', (media_group_id,))
-    conn.commit()
-    conn.close()
-    
+    db.execute(DELETE_MEDIA_GROUP_PHOTOS, (media_group_id,))
+
     logger.info(f"Cleaned up media group {media_group_id}")
 
 def cleanup_old_media_group_photos(max_age_hours: int = 24):
     """Clean up media group photos older than max_age_hours"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # Find old media groups
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            SELECT DISTINCT media_group_id FROM media_group_photos
-            WHERE created_at < datetime('now', ? || ' hours')
-        ''', (f'-{max_age_hours}',))
-    else:
-        cursor.execute('''
-            SELECT DISTINCT media_group_id FROM media_group_photos
-            WHERE created_at < NOW() - INTERVAL '%s hours'
-        ''', (max_age_hours,))
-    old_groups = cursor.fetchall()
-    conn.close()
-    
+    params = (f'-{max_age_hours}',) if db.dialect == 'sqlite' else (max_age_hours,)
+    old_groups = db.fetchall(SELECT_OLD_MEDIA_GROUPS, params)
+
     # Delete each old group
     for (media_group_id,) in old_groups:
         delete_media_group_photos(media_group_id)
-    
+
     if old_groups:
         logger.info(f"Cleaned up {len(old_groups)} old media groups (older than {max_age_hours} hours)")
 
@@ -439,183 +1154,109 @@ def cleanup_old_media_group_photos(max_age_hours: int = 24):
 # SALE RECEIPT OCR STORAGE FUNCTIONS
 # ============================================================================
 
-def save_sale_receipt_ocr(message_id: int, receipt_index: int, transaction_type: str, 
-                          detected_amount: float, detected_bank: str = None, 
+class SaleReceiptOcr(NamedTuple):
+    message_id: int
+    media_group_id: str
+    receipt_index: int
+    transaction_type: str
+    detected_amount: float
+    detected_bank: str
+    detected_usdt: float
+    ocr_raw_data: str
+
+SAVE_SALE_RECEIPT_OCR = Query(
+    '''
+    INSERT OR REPLACE INTO sale_receipt_ocr
+    (message_id, media_group_id, receipt_index, transaction_type,
+     detected_amount, detected_bank, detected_usdt, ocr_raw_data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    '''
+    INSERT INTO sale_receipt_ocr
+    (message_id, media_group_id, receipt_index, transaction_type,
+     detected_amount, detected_bank, detected_usdt, ocr_raw_data)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (message_id, receipt_index) DO UPDATE SET
+        media_group_id = EXCLUDED.media_group_id,
+        transaction_type = EXCLUDED.transaction_type,
+        detected_amount = EXCLUDED.detected_amount,
+        detected_bank = EXCLUDED.detected_bank,
+        detected_usdt = EXCLUDED.detected_usdt,
+        ocr_raw_data = EXCLUDED.ocr_raw_data
+    '''
+)
+SELECT_SALE_RECEIPT_OCR = Query(
+    '''
+    SELECT message_id, media_group_id, receipt_index, transaction_type,
+           detected_amount, detected_bank, detected_usdt, ocr_raw_data
+    FROM sale_receipt_ocr
+    WHERE message_id = ?
+    ORDER BY receipt_index
+    ''',
+    row=SaleReceiptOcr
+)
+SELECT_SALE_RECEIPT_OCR_BY_MEDIA_GROUP = Query(
+    '''
+    SELECT message_id, media_group_id, receipt_index, transaction_type,
+           detected_amount, detected_bank, detected_usdt, ocr_raw_data
+    FROM sale_receipt_ocr
+    WHERE media_group_id = ?
+    ORDER BY receipt_index
+    ''',
+    row=SaleReceiptOcr
+)
+DELETE_SALE_RECEIPT_OCR = Query('DELETE FROM sale_receipt_ocr WHERE message_id = ?')
+DELETE_SALE_RECEIPT_OCR_BY_MEDIA_GROUP = Query('DELETE FROM sale_receipt_ocr WHERE media_group_id = ?')
+DELETE_OLD_SALE_RECEIPT_OCR = Query(
+    "DELETE FROM sale_receipt_ocr WHERE created_at < datetime('now', ? || ' hours')",
+    "DELETE FROM sale_receipt_ocr WHERE created_at < NOW() - %s * INTERVAL '1 hour'"
+)
+
+def save_sale_receipt_ocr(message_id: int, receipt_index: int, transaction_type: str,
+                          detected_amount: float, detected_bank: str = None,
                           detected_usdt: float = None, media_group_id: str = None,
                           ocr_raw_data: dict = None):
     """Save OCR result for a sale receipt to database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     raw_data_json = json.dumps(ocr_raw_data) if ocr_raw_data else None
-    
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            INSERT OR REPLACE INTO sale_receipt_ocr 
-            (message_id, media_group_id, receipt_index, transaction_type, 
-             detected_amount, detected_bank, detected_usdt, ocr_raw_data)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (message_id, media_group_id, receipt_index, transaction_type,
-              detected_amount, detected_bank, detected_usdt, raw_data_json))
-    else:
-        cursor.execute('''
-            INSERT INTO sale_receipt_ocr 
-            (message_id, media_group_id, receipt_index, transaction_type, 
-             detected_amount, detected_bank, detected_usdt, ocr_raw_data)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (message_id, receipt_index) DO UPDATE SET 
-                media_group_id = EXCLUDED.media_group_id,
-                transaction_type = EXCLUDED.transaction_type,
-                detected_amount = EXCLUDED.detected_amount,
-                detected_bank = EXCLUDED.detected_bank,
-                detected_usdt = EXCLUDED.detected_usdt,
-                ocr_raw_data = EXCLUDED.ocr_raw_data
-        ''', (message_id, media_group_id, receipt_index, transaction_type,
-              detected_amount, detected_bank, detected_usdt, raw_data_json))
-    conn.commit()
-    conn.close()
-    
+
+    db.execute(SAVE_SALE_RECEIPT_OCR, (message_id, media_group_id, receipt_index, transaction_type,
+                                       detected_amount, detected_bank, detected_usdt, raw_data_json))
+
     logger.info(f"Saved sale receipt OCR: msg_id={message_id}, idx={receipt_index}, "
                 f"type={transaction_type}, amount={detected_amount}, bank={detected_bank}")
 
+def _sale_receipt_ocr_dict(row):
+    result = row._asdict()
+    result['ocr_raw_data'] = json.loads(row.ocr_raw_data) if row.ocr_raw_data else None
+    return result
+
 def get_sale_receipt_ocr(message_id: int) -> list:
     """Get all OCR results for a sale message (supports multiple receipts)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            SELECT message_id, media_group_id, receipt_index, transaction_type,
-                   detected_amount, detected_bank, detected_usdt, ocr_raw_data
-            FROM sale_receipt_ocr
-            WHERE message_id = ?
-            ORDER BY receipt_index
-        ''', (message_id,))
-    else:
-        cursor.execute('''
-            SELECT message_id, media_group_id, receipt_index, transaction_type,
-                   detected_amount, detected_bank, detected_usdt, ocr_raw_data
-            FROM sale_receipt_ocr
-            WHERE message_id = %s
-            ORDER BY receipt_index
-        ''', (message_id,))
-    results = cursor.fetchall()
-    conn.close()
-    
-    ocr_results = []
-    for row in results:
-        raw_data = json.loads(row[7]) if row[7] else None
-        ocr_results.append({
-            'message_id': row[0],
-            'media_group_id': row[1],
-            'receipt_index': row[2],
-            'transaction_type': row[3],
-            'detected_amount': row[4],
-            'detected_bank': row[5],
-            'detected_usdt': row[6],
-            'ocr_raw_data': raw_data
-        })
-    
-    return ocr_results
+    return [_sale_receipt_ocr_dict(row) for row in db.fetchall(SELECT_SALE_RECEIPT_OCR, (message_id,))]
 
 def get_sale_receipt_ocr_by_media_group(media_group_id: str) -> list:
     """Get all OCR results for a media group"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            SELECT message_id, media_group_id, receipt_index, transaction_type,
-                   detected_amount, detected_bank, detected_usdt, ocr_raw_data
-            FROM sale_receipt_ocr
-            WHERE media_group_id = ?
-            ORDER BY receipt_index
-        ''', (media_group_id,))
-    else:
-        cursor.execute('''
-            SELECT message_id, media_group_id, receipt_index, transaction_type,
-                   detected_amount, detected_bank, detected_usdt, ocr_raw_data
-            FROM sale_receipt_ocr
-            WHERE media_group_id = %s
-            ORDER BY receipt_index
-        ''', (media_group_id,))
-    results = cursor.fetchall()
-    conn.close()
-    
-    ocr_results = []
-    for row in results:
-        raw_data = json.loads(row[7]) if row[7] else None
-        ocr_results.append({
-            'message_id': row[0],
-            'media_group_id': row[1],
-            'receipt_index': row[2],
-            'transaction_type': row[3],
-            'detected_amount': row[4],
-            'detected_bank': row[5],
-            'detected_usdt': row[6],
-            'ocr_raw_data': raw_data
-        })
-    
-    return ocr_results
+    return [_sale_receipt_ocr_dict(row) for row in db.fetchall(SELECT_SALE_RECEIPT_OCR_BY_MEDIA_GROUP, (media_group_id,))]
 
 def delete_sale_receipt_ocr(message_id: int):
     """Delete OCR results for a sale message"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            DELETE FROM sale_receipt_ocr
-            WHERE message_id = ?
-        ''', (message_id,))
-    else:
-        cursor.execute('''
-            DELETE FROM sale_receipt_ocr
-            WHERE message_id = %s
-        ''', (message_id,))
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
-    
+    deleted = db.execute(DELETE_SALE_RECEIPT_OCR, (message_id,))
+
     if deleted > 0:
         logger.info(f"Deleted {deleted} sale receipt OCR record(s) for message {message_id}")
 
 def delete_sale_receipt_ocr_by_media_group(media_group_id: str):
     """Delete OCR results for a media group"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            DELETE FROM sale_receipt_ocr
-            WHERE media_group_id = ?
-        ''', (media_group_id,))
-    else:
-        cursor.execute('''
-            DELETE FROM sale_receipt_ocr
-            WHERE media_group_id = %s
-        ''', (media_group_id,))
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
-    
+    deleted = db.execute(DELETE_SALE_RECEIPT_OCR_BY_MEDIA_GROUP, (media_group_id,))
+
     if deleted > 0:
         logger.info(f"Deleted {deleted} sale receipt OCR record(s) for media group {media_group_id}")
 
 def cleanup_old_sale_receipt_ocr(max_age_hours: int = 48):
     """Clean up old sale receipt OCR data"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            DELETE FROM sale_receipt_ocr
-            WHERE created_at < datetime('now', ? || ' hours')
-        ''', (f'-{max_age_hours}',))
-    else:
-        cursor.execute('''
-            DELETE FROM sale_receipt_ocr
-            WHERE created_at < NOW() - INTERVAL '%s hours'
-        ''', (max_age_hours,))
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
-    
+    params = (f'-{max_age_hours}',) if db.dialect == 'sqlite' else (max_age_hours,)
+    deleted = db.execute(DELETE_OLD_SALE_RECEIPT_OCR, params)
+
     if deleted > 0:
         logger.info(f"Cleaned up {deleted} old sale receipt OCR records (older than {max_age_hours} hours)")
 
@@ -636,176 +1277,673 @@ def banks_match(bank_name1, bank_name2):
     """Check if two bank names match (case-insensitive, space-insensitive)"""
     return normalize_bank_name(bank_name1) == normalize_bank_name(bank_name2)
 
+class UserPrefix(NamedTuple):
+    user_id: int
+    prefix_name: str
+    username: str
+
+class MmkBankAccount(NamedTuple):
+    bank_name: str
+    account_number: str
+    account_holder: str
+
+class UsdtBankAccount(NamedTuple):
+    bank_name: str
+    wallet_address: str
+    network: str
+
+SELECT_USER_PREFIX = Query('SELECT prefix_name FROM user_prefixes WHERE user_id = ?')
+SET_USER_PREFIX = Query(
+    '''
+    INSERT OR REPLACE INTO user_prefixes (user_id, prefix_name, username)
+    VALUES (?, ?, ?)
+    ''',
+    '''
+    INSERT INTO user_prefixes (user_id, prefix_name, username)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (user_id) DO UPDATE SET prefix_name = EXCLUDED.prefix_name, username = EXCLUDED.username
+    '''
+)
+SELECT_USER_PREFIXES = Query('SELECT user_id, prefix_name, username FROM user_prefixes ORDER BY prefix_name', row=UserPrefix)
+SELECT_SETTING = Query('SELECT value FROM settings WHERE key = ?')
+SET_SETTING = Query(
+    '''
+    INSERT OR REPLACE INTO settings (key, value, updated_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+    ''',
+    '''
+    INSERT INTO settings (key, value, updated_at)
+    VALUES (%s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+    '''
+)
+SET_MMK_BANK_ACCOUNT = Query(
+    '''
+    INSERT OR REPLACE INTO mmk_bank_accounts (bank_name, account_number, account_holder, updated_at)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+    ''',
+    '''
+    INSERT INTO mmk_bank_accounts (bank_name, account_number, account_holder, updated_at)
+    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (bank_name) DO UPDATE SET account_number = EXCLUDED.account_number, account_holder = EXCLUDED.account_holder, updated_at = EXCLUDED.updated_at
+    '''
+)
+SELECT_MMK_BANK_ACCOUNT = Query(
+    'SELECT bank_name, account_number, account_holder FROM mmk_bank_accounts WHERE bank_name = ?',
+    row=MmkBankAccount
+)
+SELECT_MMK_BANK_ACCOUNTS = Query(
+    'SELECT bank_name, account_number, account_holder FROM mmk_bank_accounts ORDER BY bank_name',
+    row=MmkBankAccount
+)
+SET_USDT_BANK_ACCOUNT = Query(
+    '''
+    INSERT OR REPLACE INTO usdt_bank_accounts (bank_name, wallet_address, network, updated_at)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+    ''',
+    '''
+    INSERT INTO usdt_bank_accounts (bank_name, wallet_address, network, updated_at)
+    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (bank_name) DO UPDATE SET wallet_address = EXCLUDED.wallet_address, network = EXCLUDED.network, updated_at = EXCLUDED.updated_at
+    '''
+)
+SELECT_USDT_BANK_ACCOUNT = Query(
+    'SELECT bank_name, wallet_address, network FROM usdt_bank_accounts WHERE bank_name = ?',
+    row=UsdtBankAccount
+)
+SELECT_USDT_BANK_ACCOUNTS = Query(
+    'SELECT bank_name, wallet_address, network FROM usdt_bank_accounts ORDER BY bank_name',
+    row=UsdtBankAccount
+)
+DELETE_USDT_BANK_ACCOUNT = Query('DELETE FROM usdt_bank_accounts WHERE bank_name = ?')
+
 def get_user_prefix(user_id):
     """Get prefix name for a user"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('SELECT prefix_name FROM user_prefixes WHERE user_id = ?', (user_id,))
-    else:
-        cursor.execute('SELECT prefix_name FROM user_prefixes WHERE user_id = %s', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = db.fetchone(SELECT_USER_PREFIX, (user_id,))
     return result[0] if result else None
 
 def set_user_prefix(user_id, prefix_name, username=None):
     """Set prefix name for a user"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_prefixes (user_id, prefix_name, username)
-            VALUES (?, ?, ?)
-        ''', (user_id, prefix_name, username))
-    else:
-        cursor.execute('''
-            INSERT INTO user_prefixes (user_id, prefix_name, username)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (user_id) DO UPDATE SET prefix_name = EXCLUDED.prefix_name, username = EXCLUDED.username
-        ''', (user_id, prefix_name, username))
-    conn.commit()
-    conn.close()
+    db.execute(SET_USER_PREFIX, (user_id, prefix_name, username))
     logger.info(f"✅ Set prefix '{prefix_name}' for user {user_id} (@{username})")
 
 def get_all_user_prefixes():
     """Get all user-prefix mappings"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, prefix_name, username FROM user_prefixes ORDER BY prefix_name')
-    results = cursor.fetchall()
-    conn.close()
-    return [{'user_id': r[0], 'prefix_name': r[1], 'username': r[2]} for r in results]
+    return [row._asdict() for row in db.fetchall(SELECT_USER_PREFIXES)]
 
 def get_receiving_usdt_account():
     """Get the receiving USDT account for buy transactions"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('SELECT value FROM settings WHERE key = ?', ('receiving_usdt_account',))
-    else:
-        cursor.execute('SELECT value FROM settings WHERE key = %s', ('receiving_usdt_account',))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 'ACT(Wallet)'
+    return get_setting('receiving_usdt_account', 'ACT(Wallet)')
 
 def set_receiving_usdt_account(account_name):
     """Set the receiving USDT account for buy transactions"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            INSERT OR REPLACE INTO settings (key, value, updated_at)
-            VALUES ('receiving_usdt_account', ?, CURRENT_TIMESTAMP)
-        ''', (account_name,))
-    else:
-        cursor.execute('''
-            INSERT INTO settings (key, value, updated_at)
-            VALUES ('receiving_usdt_account', %s, CURRENT_TIMESTAMP)
-            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
-        ''', (account_name,))
-    conn.commit()
-    conn.close()
+    set_setting('receiving_usdt_account', account_name)
     logger.info(f"✅ Set receiving USDT account to '{account_name}'")
 
+def get_setting(key, default=None):
+    """Get a value from the settings table"""
+    result = db.fetchone(SELECT_SETTING, (key,))
+    return result[0] if result else default
+
+def set_setting(key, value):
+    """Store a value in the settings table"""
+    db.execute(SET_SETTING, (key, value))
+
 def set_mmk_bank_account(bank_name, account_number, account_holder):
     """Set MMK bank account details for verification"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            INSERT OR REPLACE INTO mmk_bank_accounts (bank_name, account_number, account_holder, updated_at)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (bank_name, account_number, account_holder))
-    else:
-        cursor.execute('''
-            INSERT INTO mmk_bank_accounts (bank_name, account_number, account_holder, updated_at)
-            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-            ON CONFLICT (bank_name) DO UPDATE SET account_number = EXCLUDED.account_number, account_holder = EXCLUDED.account_holder, updated_at = EXCLUDED.updated_at
-        ''', (bank_name, account_number, account_holder))
-    conn.commit()
-    conn.close()
+    db.execute(SET_MMK_BANK_ACCOUNT, (bank_name, account_number, account_holder))
     logger.info(f"✅ Set MMK bank account: {bank_name} - {account_holder} ({account_number})")
 
 def get_mmk_bank_account(bank_name):
     """Get MMK bank account details"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('SELECT account_number, account_holder FROM mmk_bank_accounts WHERE bank_name = ?', (bank_name,))
-    else:
-        cursor.execute('SELECT account_number, account_holder FROM mmk_bank_accounts WHERE bank_name = %s', (bank_name,))
-    result = cursor.fetchone()
-    conn.close()
+    result = db.fetchone(SELECT_MMK_BANK_ACCOUNT, (bank_name,))
     if result:
-        return {'account_number': result[0], 'account_holder': result[1]}
+        return {'account_number': result.account_number, 'account_holder': result.account_holder}
     return None
 
 def get_all_mmk_bank_accounts():
     """Get all MMK bank accounts"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT bank_name, account_number, account_holder FROM mmk_bank_accounts ORDER BY bank_name')
-    results = cursor.fetchall()
-    conn.close()
-    return [{'bank_name': r[0], 'account_number': r[1], 'account_holder': r[2]} for r in results]
+    return [row._asdict() for row in db.fetchall(SELECT_MMK_BANK_ACCOUNTS)]
 
 def set_usdt_bank_account(bank_name, wallet_address, network):
     """Set USDT bank account details for receiving USDT"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('''
-            INSERT OR REPLACE INTO usdt_bank_accounts (bank_name, wallet_address, network, updated_at)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (bank_name, wallet_address, network))
-    else:
-        cursor.execute('''
-            INSERT INTO usdt_bank_accounts (bank_name, wallet_address, network, updated_at)
-            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-            ON CONFLICT (bank_name) DO UPDATE SET wallet_address = EXCLUDED.wallet_address, network = EXCLUDED.network, updated_at = EXCLUDED.updated_at
-        ''', (bank_name, wallet_address, network))
-    conn.commit()
-    conn.close()
+    db.execute(SET_USDT_BANK_ACCOUNT, (bank_name, wallet_address, network))
     logger.info(f"✅ Set USDT bank account: {bank_name} - {wallet_address} ({network})")
 
 def get_usdt_bank_account(bank_name):
     """Get USDT bank account details"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('SELECT wallet_address, network FROM usdt_bank_accounts WHERE bank_name = ?', (bank_name,))
-    else:
-        cursor.execute('SELECT wallet_address, network FROM usdt_bank_accounts WHERE bank_name = %s', (bank_name,))
-    result = cursor.fetchone()
-    conn.close()
+    result = db.fetchone(SELECT_USDT_BANK_ACCOUNT, (bank_name,))
     if result:
-        return {'wallet_address': result[0], 'network': result[1]}
+        return {'wallet_address': result.wallet_address, 'network': result.network}
     return None
 
 def get_all_usdt_bank_accounts():
     """Get all USDT bank accounts"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT bank_name, wallet_address, network FROM usdt_bank_accounts ORDER BY bank_name')
-    results = cursor.fetchall()
-    conn.close()
-    return [{'bank_name': r[0], 'wallet_address': r[1], 'network': r[2]} for r in results]
+    return [row._asdict() for row in db.fetchall(SELECT_USDT_BANK_ACCOUNTS)]
 
 def remove_usdt_bank_account(bank_name):
     """Remove USDT bank account"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if isinstance(conn, sqlite3.Connection):
-        cursor.execute('DELETE FROM usdt_bank_accounts WHERE bank_name = ?', (bank_name,))
-    else:
-        cursor.execute('DELETE FROM usdt_bank_accounts WHERE bank_name = %s', (bank_name,))
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
+    deleted = db.execute(DELETE_USDT_BANK_ACCOUNT, (bank_name,))
     if deleted > 0:
         logger.info(f"✅ Removed USDT bank account: {bank_name}")
     return deleted > 0
 
+# ============================================================================
+# OCR JOB QUEUE STORAGE FUNCTIONS
+# ============================================================================
+
+OCR_JOB_COLUMNS = ('id', 'kind', 'dedupe_key', 'payload', 'state', 'attempts',
+                   'max_attempts', 'run_after', 'lease_owner', 'lease_until', 'last_error')
+
+def _ocr_job_from_row(row):
+    """Build a job dict from an ocr_jobs row selected in OCR_JOB_COLUMNS order"""
+    job = dict(zip(OCR_JOB_COLUMNS, row))
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+ENQUEUE_OCR_JOB = Query(
+    '''
+    INSERT OR IGNORE INTO ocr_jobs (kind, dedupe_key, payload, run_after, max_attempts, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''',
+    postgres='''
+    INSERT INTO ocr_jobs (kind, dedupe_key, payload, run_after, max_attempts, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (dedupe_key) DO NOTHING
+    '''
+)
+# Wakes worker processes waiting in LISTEN (PostgreSQL only)
+NOTIFY_OCR_JOBS = Query("SELECT pg_notify('ocr_jobs', '')")
+SELECT_OCR_JOB_PAYLOAD = Query('SELECT payload FROM ocr_jobs WHERE dedupe_key = ?')
+# Row-locked on PostgreSQL, so a photo appended by another process is not lost
+SELECT_QUEUED_OCR_JOB_PAYLOAD = Query(
+    "SELECT id, payload FROM ocr_jobs WHERE dedupe_key = ? AND state = 'queued'",
+    postgres="SELECT id, payload FROM ocr_jobs WHERE dedupe_key = %s AND state = 'queued' FOR UPDATE"
+)
+UPDATE_QUEUED_OCR_JOB_PAYLOAD = Query(
+    "UPDATE ocr_jobs SET payload = ?, updated_at = ? WHERE id = ? AND state = 'queued'"
+)
+FAIL_EXHAUSTED_OCR_JOBS = Query(
+    '''
+    UPDATE ocr_jobs SET state = 'failed', last_error = COALESCE(last_error, 'lease expired'), updated_at = ?
+    WHERE state = 'running' AND lease_until < ? AND attempts >= max_attempts
+    '''
+)
+LEASE_OCR_JOB = Query(
+    '''
+    UPDATE ocr_jobs
+    SET state = 'running', lease_owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+    WHERE id = ?
+    '''
+)
+SELECT_OCR_JOB = Query(f"SELECT {', '.join(OCR_JOB_COLUMNS)} FROM ocr_jobs WHERE id = ?")
+RENEW_OCR_JOB_LEASE = Query(
+    '''
+    UPDATE ocr_jobs SET lease_until = ?, updated_at = ?
+    WHERE id = ? AND lease_owner = ? AND state = 'running'
+    '''
+)
+COMPLETE_OCR_JOB = Query(
+    '''
+    UPDATE ocr_jobs SET state = 'done', lease_until = NULL, last_error = NULL, updated_at = ?
+    WHERE id = ? AND lease_owner = ? AND state = 'running'
+    '''
+)
+FAIL_OCR_JOB = Query(
+    '''
+    UPDATE ocr_jobs
+    SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+        run_after = ?, last_error = ?, lease_owner = NULL, lease_until = NULL, updated_at = ?
+    WHERE id = ? AND lease_owner = ? AND state = 'running'
+    '''
+)
+SELECT_OCR_JOB_STATE = Query('SELECT state FROM ocr_jobs WHERE id = ?')
+SELECT_OCR_JOB_COUNTS = Query('SELECT state, COUNT(*) FROM ocr_jobs GROUP BY state')
+SELECT_OLDEST_DUE_OCR_JOB = Query("SELECT MIN(run_after) FROM ocr_jobs WHERE state = 'queued' AND run_after <= ?")
+DELETE_OLD_OCR_JOBS = Query("DELETE FROM ocr_jobs WHERE state IN ('done', 'failed') AND updated_at < ?")
+
+@functools.cache
+def _due_ocr_job_query(kinds):
+    """The lookup of the next due job, of `kinds` (a tuple) only when given
+
+    On PostgreSQL it locks the row, and SKIP LOCKED lets concurrent workers
+    claim different jobs without waiting.
+    """
+    kind_filter = f"AND kind IN ({', '.join('?' * len(kinds))})" if kinds else ''
+    sql = f'''
+    SELECT id FROM ocr_jobs
+    WHERE ((state = 'queued' AND run_after <= ?) OR (state = 'running' AND lease_until < ?))
+    {kind_filter}
+    ORDER BY run_after
+    LIMIT 1
+    '''
+    return Query(sql, postgres=sql.replace('?', '%s') + 'FOR UPDATE SKIP LOCKED\n')
+
+def get_ocr_job_trace(dedupe_key: str):
+    """The trace context a job was queued in, or None"""
+    row = db.fetchone(SELECT_OCR_JOB_PAYLOAD, (dedupe_key,))
+    return json.loads(row[0]).get('trace') if row else None
+
+def enqueue_ocr_job(kind: str, dedupe_key: str, payload: dict, delay: float = 0, max_attempts: int = 5):
+    """Persist a job to run after `delay` seconds
+
+    Returns True if the job was queued, False if a job with the same dedupe key
+    already exists (e.g. a replayed update).
+    """
+    span = current_span.get()
+    if span is not None:
+        payload = dict(payload, trace=span.carrier())
+    now = time.time()
+    queued = db.execute(ENQUEUE_OCR_JOB, (kind, dedupe_key, json.dumps(payload), now + delay, max_attempts, now)) > 0
+    if queued and db.dialect == 'postgres':
+        db.fetchone(NOTIFY_OCR_JOBS)
+
+    if queued:
+        logger.info("📥 Queued %s job %s (runs in %.1fs)", kind, dedupe_key, delay)
+    else:
+        logger.info("Job %s already queued, skipping", dedupe_key)
+    return queued
+
+def append_ocr_job_photo(dedupe_key: str, photo: dict):
+    """Add a photo to a job that has not started yet
+
+    Returns the new photo count, or None if no queued job has this key (the
+    photo then belongs to something else, or arrived after the job started).
+    """
+    with db.transaction():
+        row = db.fetchone(SELECT_QUEUED_OCR_JOB_PAYLOAD, (dedupe_key,))
+        if not row:
+            return None
+        job_id, payload = row
+        payload = json.loads(payload)
+        payload['photos'].append(photo)
+        updated = db.execute(UPDATE_QUEUED_OCR_JOB_PAYLOAD, (json.dumps(payload), time.time(), job_id)) > 0
+    return len(payload['photos']) if updated else None
+
+def claim_ocr_job(owner: str, lease_seconds: float, kinds=None):
+    """Lease the next due job to `owner`
+
+    Due means queued with run_after in the past, or running with an expired
+    lease (its worker died). Returns the job dict, or None if nothing is due.
+    """
+    now = time.time()
+    kinds = tuple(kinds) if kinds else ()
+    with db.transaction():
+        # Expired leases that have used up their attempts are not retried again
+        db.execute(FAIL_EXHAUSTED_OCR_JOBS, (now, now))
+        row = db.fetchone(_due_ocr_job_query(kinds), (now, now) + kinds)
+        if not row:
+            return None
+        db.execute(LEASE_OCR_JOB, (owner, now + lease_seconds, now, row[0]))
+        return _ocr_job_from_row(db.fetchone(SELECT_OCR_JOB, (row[0],)))
+
+def renew_ocr_job_lease(job_id: int, owner: str, lease_seconds: float):
+    """Extend `owner`'s lease on a running job; False if the lease was already lost"""
+    now = time.time()
+    return db.execute(RENEW_OCR_JOB_LEASE, (now + lease_seconds, now, job_id, owner)) > 0
+
+def complete_ocr_job(job_id: int, owner: str):
+    """Mark a job done if `owner` still holds its lease
+
+    Returns False when the lease was lost (expired and taken by another
+    worker), in which case the other worker's run is the one that counts.
+    """
+    return db.execute(COMPLETE_OCR_JOB, (time.time(), job_id, owner)) > 0
+
+def fail_ocr_job(job_id: int, owner: str, error: str, retry_delay: float):
+    """Record a failed attempt: requeue after `retry_delay`, or mark failed once attempts run out
+
+    Returns the new state, or None if `owner` no longer holds the lease.
+    """
+    now = time.time()
+    with db.transaction():
+        if not db.execute(FAIL_OCR_JOB, (now + retry_delay, error[:1000], now, job_id, owner)):
+            return None
+        return db.fetchone(SELECT_OCR_JOB_STATE, (job_id,))[0]
+
+def get_ocr_job_counts():
+    """Job counts per state, plus the age in seconds of the oldest due queued job"""
+    now = time.time()
+    counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+    counts.update(db.fetchall(SELECT_OCR_JOB_COUNTS))
+    oldest = db.fetchone(SELECT_OLDEST_DUE_OCR_JOB, (now,))[0]
+    counts['oldest_due_age'] = now - oldest if oldest else 0
+    return counts
+
+def cleanup_old_ocr_jobs(max_age_hours: int = 48):
+    """Delete finished and failed jobs older than max_age_hours"""
+    deleted = db.execute(DELETE_OLD_OCR_JOBS, (time.time() - max_age_hours * 3600,))
+    if deleted > 0:
+        logger.info("Cleaned up %s old OCR jobs (older than %s hours)", deleted, max_age_hours)
+
+# ============================================================================
+# PENDING TRANSACTION STORAGE FUNCTIONS
+# ============================================================================
+
+class PendingTransactionRow(NamedTuple):
+    message_id: int
+    media_group_id: str
+    data: str
+    created_at: float
+
+SAVE_PENDING_TRANSACTION = Query(
+    '''
+    INSERT OR REPLACE INTO pending_transactions (message_id, media_group_id, data, created_at)
+    VALUES (?, ?, ?, ?)
+    ''',
+    '''
+    INSERT INTO pending_transactions (message_id, media_group_id, data, created_at)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (message_id) DO UPDATE SET
+        media_group_id = EXCLUDED.media_group_id, data = EXCLUDED.data, created_at = EXCLUDED.created_at
+    '''
+)
+SELECT_PENDING_TRANSACTIONS = Query(
+    '''
+    SELECT message_id, media_group_id, data, created_at FROM pending_transactions
+    WHERE created_at >= ?
+    ORDER BY created_at
+    ''',
+    row=PendingTransactionRow
+)
+DELETE_OLD_PENDING_TRANSACTIONS = Query('DELETE FROM pending_transactions WHERE created_at < ?')
+
+def save_pending_transaction(message_id: int, media_group_id, data: dict, created_at: float):
+    """Insert or replace a pending sale"""
+    db.execute(SAVE_PENDING_TRANSACTION, (message_id, media_group_id, json.dumps(data), created_at))
+
+def delete_pending_transactions(message_ids: list):
+    """Delete pending sales by sale message id"""
+    if not message_ids:
+        return
+    query = Query(f'DELETE FROM pending_transactions WHERE message_id IN ({", ".join("?" * len(message_ids))})')
+    db.execute(query, tuple(message_ids))
+
+def load_pending_transactions(since: float) -> list:
+    """Pending sales created after `since`, oldest first, as (message_id, media_group_id, data, created_at)"""
+    return [
+        row._replace(data=json.loads(row.data))
+        for row in db.fetchall(SELECT_PENDING_TRANSACTIONS, (since,))
+    ]
+
+def cleanup_old_pending_transactions(before: float):
+    """Delete pending sales created before `before`"""
+    deleted = db.execute(DELETE_OLD_PENDING_TRANSACTIONS, (before,))
+
+    if deleted > 0:
+        logger.info("Cleaned up %s expired pending transactions", deleted)
+
+# ============================================================================
+# PROCESSED MESSAGE STORAGE FUNCTIONS
+# ============================================================================
+
+INSERT_PROCESSED_MESSAGE = Query(
+    '''
+    INSERT OR IGNORE INTO processed_messages (chat_id, message_id, handler, created_at)
+    VALUES (?, ?, ?, ?)
+    ''',
+    '''
+    INSERT INTO processed_messages (chat_id, message_id, handler, created_at)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (chat_id, message_id, handler) DO NOTHING
+    '''
+)
+UPDATE_PROCESSED_MESSAGE_EFFECT = Query(
+    '''
+    UPDATE processed_messages SET effect = ?
+    WHERE chat_id = ? AND message_id = ? AND handler = ?
+    '''
+)
+SELECT_PROCESSED_MESSAGE_EFFECT = Query(
+    '''
+    SELECT effect FROM processed_messages
+    WHERE chat_id = ? AND message_id = ? AND handler = ?
+    '''
+)
+DELETE_PROCESSED_MESSAGE = Query(
+    '''
+    DELETE FROM processed_messages
+    WHERE chat_id = ? AND message_id = ? AND handler = ?
+    '''
+)
+DELETE_OLD_PROCESSED_MESSAGES = Query('DELETE FROM processed_messages WHERE created_at < ?')
+
+def insert_processed_message(chat_id: int, message_id: int, handler: str) -> bool:
+    """Record that a handler started on a message; False if it was already recorded"""
+    return db.execute(INSERT_PROCESSED_MESSAGE, (chat_id, message_id, handler, time.time())) > 0
+
+def update_processed_message_effect(chat_id: int, message_id: int, handler: str, effect: list):
+    """Store the balance changes a handler made"""
+    db.execute(UPDATE_PROCESSED_MESSAGE_EFFECT, (json.dumps(effect), chat_id, message_id, handler))
+
+def get_processed_message_effect(chat_id: int, message_id: int, handler: str):
+    """The recorded balance changes of a processed message, or None"""
+    row = db.fetchone(SELECT_PROCESSED_MESSAGE_EFFECT, (chat_id, message_id, handler))
+    effect = row[0] if row else None
+    return json.loads(effect) if effect else None
+
+def delete_processed_message(chat_id: int, message_id: int, handler: str):
+    """Forget a message so it can be processed again (its handler failed)"""
+    db.execute(DELETE_PROCESSED_MESSAGE, (chat_id, message_id, handler))
+
+def cleanup_old_processed_messages(max_age_hours: int = 168):
+    """Clean up processed message records older than max_age_hours"""
+    deleted = db.execute(DELETE_OLD_PROCESSED_MESSAGES, (time.time() - max_age_hours * 3600,))
+
+    if deleted > 0:
+        logger.info("Cleaned up %s old processed message records (older than %s hours)", deleted, max_age_hours)
+
+# ============================================================================
+# OUTBOUND MESSAGE SCHEDULER
+# ============================================================================
+
+# Outbound priority lanes, most urgent first
+LANE_BALANCE = 0
+LANE_ALERT = 1
+LANE_STATUS = 2
+LANE_COMMAND = 3
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+class TokenBucket:
+    """Token bucket refilling `rate` tokens per second, holding at most `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        """Seconds until a token is available (0 if one is available now)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class OutboundRequest:
+    """One queued Bot API call"""
+
+    __slots__ = ('bot', 'method', 'kwargs', 'future', 'merged', 'span')
+
+    def __init__(self, bot, method, kwargs, future, span=None):
+        self.bot = bot
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.merged = []
+        # Trace span from queueing to delivery, in the transaction that queued the call
+        self.span = span
+
+class OutboundScheduler:
+    """Single outbound queue for everything the bot sends to Telegram.
+
+    Requests are served by priority lane (balance > alerts > status > command
+    replies), FIFO within a lane, and paced by a per-chat token bucket sized
+    to Telegram's group limit plus a global one. A RetryAfter (429) pauses
+    the queue for as long as Telegram asks and the same request is retried
+    rather than surfacing in error_handler and being lost. Adjacent queued
+    status messages for the same chat/topic can be merged into one.
+
+    Until start() is called (e.g. outside the running bot) calls go straight
+    to the Bot API.
+    """
+
+    def __init__(self, group_rate_per_minute, global_rate_per_second=30, merge_status=True):
+        self.group_rate = group_rate_per_minute / 60
+        self.group_burst = max(1, int(group_rate_per_minute // 4))
+        self.merge_status = merge_status
+        self._global = TokenBucket(global_rate_per_second, global_rate_per_second)
+        self._buckets = {}
+        self._queue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._worker = None
+        self._busy = False
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def running(self):
+        return self._worker is not None and not self._worker.done()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if not self.running:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=10):
+        """Drain what is queued (up to timeout seconds), then stop the worker"""
+        if not self.running:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._busy or not self._queue.empty()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self._worker.cancel()
+        self._worker = None
+        logger.info("📮 Outbound: %s sent, %s merged, %s flood retries, %s failed, %s left in queue",
+                    self.sent, self.merged, self.retried, self.failed, self.depth)
+
+    async def send(self, lane, bot, method, wait=False, **kwargs):
+        """Queue bot.<method>(**kwargs) on a lane.
+
+        With wait=True, returns the API result (or raises its error) once the
+        call has gone out; otherwise returns as soon as it is queued.
+        """
+        if not self.running:
+            with tracer.span(f"telegram {method}", kind=SPAN_KIND_CLIENT):
+                return await getattr(bot, method)(**kwargs)
+        
+        future = asyncio.get_running_loop().create_future() if wait else None
+        parent = current_span.get() if tracer.enabled else None
+        span = tracer.new_span(f"telegram {method}", parent, SPAN_KIND_CLIENT, {'outbound.lane': lane}) if parent else None
+        self._queue.put_nowait((lane, next(self._seq), OutboundRequest(bot, method, kwargs, future, span)))
+        if wait:
+            return await future
+        return None
+
+    async def _run(self):
+        while True:
+            lane, _, request = await self._queue.get()
+            self._busy = True
+            try:
+                if self.merge_status and lane == LANE_STATUS:
+                    self._merge_adjacent(request)
+                await self._deliver(request)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Outbound scheduler error: %s", e)
+            finally:
+                self._busy = False
+
+    @staticmethod
+    def _mergeable(first, other):
+        if first.method != 'send_message' or other.method != 'send_message':
+            return False
+        if first.future is not None or other.future is not None:
+            return False
+        a, b = first.kwargs, other.kwargs
+        keys = ('chat_id', 'message_thread_id', 'parse_mode', 'reply_to_message_id')
+        if any(a.get(key) != b.get(key) for key in keys) or a.get('reply_to_message_id'):
+            return False
+        return len(a['text']) + len(b['text']) + 2 <= TELEGRAM_MAX_MESSAGE_LENGTH
+
+    def _merge_adjacent(self, request):
+        """Fold the next queued status messages for the same destination into request"""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            lane, _, other = item
+            if lane != LANE_STATUS or not self._mergeable(request, other):
+                self._queue.put_nowait(item)
+                return
+            request.kwargs['text'] += "\n\n" + other.kwargs['text']
+            self.merged += 1
+            if other.span is not None:
+                other.span.set('outbound.merged', True)
+                tracer.finish(other.span)
+
+    async def _acquire(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.group_rate, self.group_burst)
+        while True:
+            wait = max(self._global.wait_time(), bucket.wait_time())
+            if wait <= 0:
+                self._global.take()
+                bucket.take()
+                return
+            await asyncio.sleep(wait)
+
+    async def _deliver(self, request):
+        from telegram.error import RetryAfter
+        while True:
+            await self._acquire(request.kwargs.get('chat_id'))
+            try:
+                result = await getattr(request.bot, request.method)(**request.kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                delay = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+                self.retried += 1
+                logger.warning("⏳ Telegram flood control on %s, retrying in %.0fs", request.method, delay)
+                if request.span is not None:
+                    request.span.set('outbound.flood_wait_seconds', delay)
+                await asyncio.sleep(delay)
+                continue
+            except Exception as e:
+                self.failed += 1
+                logger.error("Error sending %s: %s", request.method, e)
+                if request.span is not None:
+                    request.span.error = f"{type(e).__name__}: {e}"
+                    tracer.finish(request.span)
+                if request.future is not None and not request.future.done():
+                    request.future.set_exception(e)
+                return
+            
+            self.sent += 1
+            if request.span is not None:
+                tracer.finish(request.span)
+            if request.future is not None and not request.future.done():
+                request.future.set_result(result)
+            return
+
+# Every process sending with the bot token gets an equal share of the group and global rates
+OUTBOUND_PROCESSES = 1 + max(1, OCR_WORKER_PROCESSES) if OCR_REMOTE_WORKERS or OCR_WORKER_PROCESS else 1
+outbound = OutboundScheduler(OUTBOUND_GROUP_RATE / OUTBOUND_PROCESSES, global_rate_per_second=30 / OUTBOUND_PROCESSES,
+                             merge_status=bool(OUTBOUND_MERGE_STATUS))
+
 async def send_alert(message, alert_text, context):
     """Send alert message (error/warning) to alert topic if configured, otherwise reply to message
     
@@ -816,14 +1954,21 @@ async def send_alert(message, alert_text, context):
     """
     if ALERT_TOPIC_ID:
         # Send to alert topic
-        await context.bot.send_message(
+        await outbound.send(
+            LANE_ALERT, context.bot, 'send_message',
             chat_id=TARGET_GROUP_ID,
             message_thread_id=ALERT_TOPIC_ID,
             text=alert_text
         )
     else:
         # Send as reply to original message
-        await message.reply_text(alert_text)
+        await outbound.send(
+            LANE_ALERT, context.bot, 'send_message',
+            chat_id=message.chat_id,
+            message_thread_id=message.message_thread_id if message.is_topic_message else None,
+            reply_to_message_id=message.message_id,
+            text=alert_text
+        )
 
 async def send_command_response(context, response_text, parse_mode=None):
     """Send command response to alert topic
@@ -835,7 +1980,8 @@ async def send_command_response(context, response_text, parse_mode=None):
     """
     if ALERT_TOPIC_ID:
         # Send to alert topic
-        await context.bot.send_message(
+        await outbound.send(
+            LANE_COMMAND, context.bot, 'send_message',
             chat_id=TARGET_GROUP_ID,
             message_thread_id=ALERT_TOPIC_ID,
             text=response_text,
@@ -843,7 +1989,8 @@ async def send_command_response(context, response_text, parse_mode=None):
         )
     else:
         # Fallback: send to general chat (shouldn't happen if ALERT_TOPIC_ID is configured)
-        await context.bot.send_message(
+        await outbound.send(
+            LANE_COMMAND, context.bot, 'send_message',
             chat_id=TARGET_GROUP_ID,
             text=response_text,
             parse_mode=parse_mode
@@ -859,7 +2006,8 @@ async def send_status_message(context, status_text, parse_mode=None):
     """
     if ALERT_TOPIC_ID:
         # Send to alert topic
-        await context.bot.send_message(
+        await outbound.send(
+            LANE_STATUS, context.bot, 'send_message',
             chat_id=TARGET_GROUP_ID,
             message_thread_id=ALERT_TOPIC_ID,
             text=status_text,
@@ -867,24 +2015,575 @@ async def send_status_message(context, status_text, parse_mode=None):
         )
     else:
         # Fallback: send to general chat (shouldn't happen if ALERT_TOPIC_ID is configured)
-        await context.bot.send_message(
+        await outbound.send(
+            LANE_STATUS, context.bot, 'send_message',
             chat_id=TARGET_GROUP_ID,
             text=status_text,
             parse_mode=parse_mode
         )
 
-# Storage for tracking multiple photo replies to same transaction
-# Format: {original_message_id: {'amounts': [amount1, amount2], 'bank': bank_obj, 'expected': amount, 'type': 'buy/sell'}}
-pending_transactions = {}
+class PendingStore:
+    """Sale messages waiting for the staff reply that settles them.
+
+    Entries are kept oldest first in memory and written through to the
+    pending_transactions table, so a restart does not forget them. They
+    expire after `ttl` seconds and the oldest are evicted beyond `max_size`,
+    so sales nobody settles no longer pile up. Lookup is by sale message id
+    or by media group id (a staff reply may point at any photo of an album).
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._by_media_group = {}
+        self._loaded = False
+        self.expired = 0
+        self.evicted = 0
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        cutoff = time.time() - self.ttl
+        cleanup_old_pending_transactions(cutoff)
+        for message_id, media_group_id, data, created_at in load_pending_transactions(cutoff):
+            self._remember(message_id, dict(data, message_id=message_id, media_group_id=media_group_id,
+                                            created_at=created_at))
+        if self._entries:
+            logger.info("📋 Restored %s pending transaction(s)", len(self._entries))
+
+    def _remember(self, message_id, entry):
+        self._entries.pop(message_id, None)
+        self._entries[message_id] = entry
+        if entry.get('media_group_id'):
+            self._by_media_group[entry['media_group_id']] = message_id
+
+    def _forget(self, message_id):
+        entry = self._entries.pop(message_id, None)
+        if entry and entry.get('media_group_id'):
+            self._by_media_group.pop(entry['media_group_id'], None)
+        return entry
+
+    def _expire(self):
+        # Entries are in insertion order, so expired ones are at the front
+        cutoff = time.time() - self.ttl
+        stale = []
+        for message_id, entry in self._entries.items():
+            if entry['created_at'] >= cutoff:
+                break
+            stale.append(message_id)
+        expired = len(stale)
+        overflow = len(self._entries) - expired - self.max_size
+        if overflow > 0:
+            stale.extend(itertools.islice(self._entries, expired, expired + overflow))
+        
+        if not stale:
+            return
+        for message_id in stale:
+            self._forget(message_id)
+        delete_pending_transactions(stale)
+        self.expired += expired
+        self.evicted += len(stale) - expired
+        logger.info("🧹 Dropped %s unmatched pending transaction(s) (%s expired, %s over the %s limit)",
+                    len(stale), expired, len(stale) - expired, self.max_size)
+
+    def put(self, message_id, data, media_group_id=None):
+        """Record a sale; data must be JSON serializable"""
+        self._ensure_loaded()
+        created_at = time.time()
+        self._remember(message_id, dict(data, message_id=message_id, media_group_id=media_group_id,
+                                        created_at=created_at))
+        save_pending_transaction(message_id, media_group_id, data, created_at)
+        self._expire()
+
+    def get(self, message_id, media_group_id=None):
+        """The pending sale for a message id, or for its media group"""
+        self._ensure_loaded()
+        entry = self._entries.get(message_id)
+        if entry is None and media_group_id:
+            entry = self._entries.get(self._by_media_group.get(media_group_id))
+        return entry
+
+    def pop(self, message_id, media_group_id=None):
+        """Remove and return the pending sale once it is settled"""
+        entry = self.get(message_id, media_group_id)
+        if entry is None:
+            return None
+        self._forget(entry['message_id'])
+        delete_pending_transactions([entry['message_id']])
+        trace_settlement(entry)
+        return entry
+
+    def older_than(self, seconds):
+        """Unsettled sales at least `seconds` old, oldest first"""
+        self._ensure_loaded()
+        self._expire()
+        cutoff = time.time() - seconds
+        return [entry for entry in self._entries.values() if entry['created_at'] <= cutoff]
+
+    def __contains__(self, message_id):
+        self._ensure_loaded()
+        return message_id in self._entries
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._entries)
+
+# Sale messages waiting for the staff reply, keyed by sale message id
+pending_transactions = PendingStore(PENDING_TTL_HOURS * 3600, PENDING_MAX_SIZE)
+
+def trace_settlement(entry):
+    """Record a 'settlement' span for a pending sale the current staff reply settled.
+
+    It runs from the start of the sale's trace to now and is tagged with the
+    staff member who replied and the accounts whose balance changed, so
+    settlement time can be broken down per staff member and per bank.
+    """
+    span = current_span.get()
+    if not tracer.enabled or span is None:
+        return
+    settlement = tracer.new_span('settlement', span, attributes={
+        'transaction.type': entry.get('type', ''),
+        'sale.message_id': entry['message_id'],
+    })
+    # From the sale message; when the reply could not resume the sale's trace, from when the sale was recorded
+    settlement.start = min(settlement.trace_start, int(entry['created_at'] * 1e9))
+    
+    message = current_message.get()
+    staff = message.from_user if message else None
+    if staff:
+        settlement.set('staff.user_id', staff.id)
+        settlement.set('staff.prefix', get_user_prefix(staff.id) or '')
+    changes = ledger_journal.get() or []
+    settlement.set('bank.names', sorted({bank_name for bank_name, delta in changes if delta}))
+    settlement.set('settlement.seconds', round((time.time_ns() - settlement.start) / 1e9, 3))
+    tracer.finish(settlement)
+
+# Balance changes made by the handler running in the current task: [(bank_name, delta), ...]
+ledger_journal = contextvars.ContextVar('ledger_journal', default=None)
+
+# Held by every handler from re-reading context.chat_data['balances'] to writing it back, and by every
+# balance load: handlers for different transactions run concurrently, and one still holding the ledger
+# it read before its OCR would otherwise write it back over a balance loaded in the meantime
+ledger_lock = asyncio.Lock()
+
+class IdempotencyRegistry:
+    """(chat_id, message_id, handler) keys of messages that were already handled.
+
+    A recent window is kept in memory; the processed_messages table (primary
+    key on the tuple) catches older keys and replays after a restart. A key
+    is claimed before the handler runs and released again if it raises
+    before changing any balance, so a failed message can still be retried.
+    """
+
+    WINDOW = 10000
+
+    def __init__(self, max_age_hours):
+        self.max_age_hours = max_age_hours
+        self._recent = OrderedDict()
+        self._cleaned = False
+        self.replays = 0
+
+    def claim(self, chat_id, message_id, handler):
+        """True if this handler has not processed this message before"""
+        key = (chat_id, message_id, handler)
+        if key in self._recent:
+            self.replays += 1
+            return False
+        if not self._cleaned:
+            self._cleaned = True
+            cleanup_old_processed_messages(self.max_age_hours)
+        
+        claimed = insert_processed_message(chat_id, message_id, handler)
+        self._recent[key] = True
+        if len(self._recent) > self.WINDOW:
+            self._recent.popitem(last=False)
+        if not claimed:
+            self.replays += 1
+        return claimed
+
+    def release(self, chat_id, message_id, handler):
+        self._recent.pop((chat_id, message_id, handler), None)
+        delete_processed_message(chat_id, message_id, handler)
+
+    def record_effect(self, chat_id, message_id, handler, changes):
+        """Store the net balance change per account for a handled message"""
+        effect = {}
+        for bank_name, delta in changes:
+            effect[bank_name] = effect.get(bank_name, 0) + delta
+        effect = [[bank_name, delta] for bank_name, delta in effect.items() if delta]
+        if effect:
+            update_processed_message_effect(chat_id, message_id, handler, effect)
+
+processed_messages = IdempotencyRegistry(PROCESSED_MESSAGE_TTL_HOURS)
+
+def idempotent(handler):
+    """Run the decorated `(update, context, ...)` handler at most once per message
+
+    A replay (redelivered update, or a job re-run after a crash) returns None
+    before the handler downloads or OCRs anything. The balance changes the
+    handler makes are recorded with the key. A handler that raises after it
+    changed balances keeps its claim - a retry would apply those changes
+    again - and the partial changes go to the alert topic to be reconciled
+    by hand.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            message = update.message
+            if message is None:
+                return await func(update, context, *args, **kwargs)
+            
+            key = (message.chat_id, message.message_id, handler)
+            if not processed_messages.claim(*key):
+                effect = get_processed_message_effect(*key)
+                effect_text = ', '.join(f"{bank_name} {delta:+,.4f}".rstrip('0').rstrip('.') for bank_name, delta in effect) if effect else 'no balance change'
+                logger.info("⏭️ Message %s already handled by %s (%s), skipping",
+                            message.message_id, handler, effect_text)
+                return None
+            
+            parent = ledger_journal.get()
+            changes = []
+            token = ledger_journal.set(changes)
+            try:
+                result = await func(update, context, *args, **kwargs)
+            except BaseException as e:
+                if not changes:
+                    processed_messages.release(*key)
+                    raise
+                processed_messages.record_effect(*key, changes)
+                effect_text = ', '.join(f"{bank_name} {delta:+,.4f}".rstrip('0').rstrip('.') for bank_name, delta in changes)
+                logger.error("❌ %s failed on message %s after changing balances (%s): %r",
+                             handler, message.message_id, effect_text, e)
+                try:
+                    await send_alert(message,
+                        f"⚠️ Transaction stopped halfway, check the balance!\n\n"
+                        f"Message: {message.message_id} ({handler})\n"
+                        f"Applied: {effect_text}\n"
+                        f"Error: {e!r}\n\n"
+                        f"It will not be retried: finish or undo it by hand and /load the corrected balance",
+                        context)
+                except Exception as alert_error:
+                    logger.error("Could not send reconciliation alert: %s", alert_error)
+                raise
+            finally:
+                ledger_journal.reset(token)
+                if parent is not None:
+                    parent.extend(changes)
+            processed_messages.record_effect(*key, changes)
+            return result
+        return wrapper
+    return decorator
+
+# ============================================================================
+# ADMISSION CONTROL
+# ============================================================================
+
+class AdmissionControl:
+    """Bounded in-flight work per class of photo transaction.
+
+    Each class - sale pre-scans, staff replies, P2P sells, internal
+    transfers - runs at most its limit of transactions at once. Transactions
+    that change balances are never dropped: over the limit they wait their
+    turn, in order. Once BACKLOG_NOTICE_AT of them are waiting, a single
+    "backlog N" notice goes to the alert topic, and the next one only after
+    the backlog has cleared.
+
+    Pre-scans only save the staff reply an OCR call. One that finds its class
+    full, or other transactions waiting, is deferred: the staff reply then
+    OCRs the receipt itself. While the backlog is at the notice level, new
+    pre-scans are shed before they are even queued.
+    """
+
+    def __init__(self, limits, notice_at):
+        self.limits = limits
+        self.notice_at = notice_at
+        self.in_flight = dict.fromkeys(limits, 0)
+        self.waiting = dict.fromkeys(limits, 0)
+        self.admitted = dict.fromkeys(limits, 0)
+        self.deferred = 0
+        self.shed = 0
+        self.notices = 0
+        self.peak_backlog = 0
+        self._slots = {}
+        self._noticed = False
+
+    @property
+    def backlog(self):
+        return sum(self.waiting.values())
+
+    @property
+    def overloaded(self):
+        return self.backlog >= self.notice_at
+
+    def defer_prescan(self):
+        """True if a pre-scan should be left to the staff reply rather than run now"""
+        if self.in_flight['prescan'] >= self.limits['prescan'] or self.backlog:
+            self.deferred += 1
+            return True
+        return False
+
+    def shed_prescan(self):
+        """True if a new pre-scan should not even be queued"""
+        if self.overloaded:
+            self.shed += 1
+            return True
+        return False
+
+    @asynccontextmanager
+    async def slot(self, kind, message=None, context=None):
+        semaphore = self._slots.get(kind)
+        if semaphore is None:
+            semaphore = self._slots[kind] = asyncio.Semaphore(max(1, self.limits[kind]))
+        if semaphore.locked():
+            self.waiting[kind] += 1
+            self.peak_backlog = max(self.peak_backlog, self.backlog)
+            try:
+                if self.overloaded and not self._noticed and message is not None:
+                    self._noticed = True
+                    self.notices += 1
+                    await send_alert(message, f"⏳ Backlog {self.backlog}: photo transactions are queued and will be "
+                                              f"processed in order. Receipt pre-scans are paused until it clears.", context)
+                await semaphore.acquire()
+            finally:
+                self.waiting[kind] -= 1
+        else:
+            await semaphore.acquire()
+        self.in_flight[kind] += 1
+        self.admitted[kind] += 1
+        try:
+            yield
+        finally:
+            self.in_flight[kind] -= 1
+            semaphore.release()
+            if self._noticed and not self.backlog:
+                self._noticed = False
+                logger.info("✅ Photo transaction backlog cleared")
+
+admission = AdmissionControl({
+    'prescan': ADMIT_PRESCAN,
+    'staff_reply': ADMIT_STAFF_REPLY,
+    'p2p': ADMIT_P2P,
+    'internal_transfer': ADMIT_INTERNAL_TRANSFER,
+}, BACKLOG_NOTICE_AT)
+
+# Seconds a job's handler may run once admitted (set by OcrJobWorker for pre-scans; None = no limit)
+job_timeout = contextvars.ContextVar('job_timeout', default=None)
+
+def admitted(kind):
+    """Run the decorated `(update, context, ...)` handler in an AdmissionControl slot of class `kind`
+
+    A deferred pre-scan returns None without running. A job_timeout only
+    starts once the slot is granted, so time spent waiting for it is not
+    held against the job.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            message = update.effective_message
+            if kind == 'prescan' and admission.defer_prescan():
+                logger.info("⏭️ Pre-scan of message %s deferred to the staff reply (backlog %s)",
+                            message.message_id if message else '?', admission.backlog)
+                return None
+            async with admission.slot(kind, message, context):
+                timeout = job_timeout.get()
+                if timeout is not None:
+                    return await asyncio.wait_for(func(update, context, *args, **kwargs), timeout)
+                return await func(update, context, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ============================================================================
+# BALANCE PARSING & FORMATTING
+# ============================================================================
+
+# Integer minor units per balance section: MMK and THB are kept in whole units,
+# USDT to 4 decimal places (the precision the balance message is rendered with)
+AMOUNT_SCALE = {'mmk_banks': 1, 'usdt_banks': 10000, 'thb_banks': 1}
+
+class Account:
+    """One balance row, with its amount held as integer minor units.
+
+    Supports the row-dict access the handlers have always used
+    (bank['amount'], bank['bank_name'], bank.get('prefix')), so
+    `bank['amount'] -= x` is rounded to the currency's minor unit on every
+    write instead of accumulating float drift across transactions.
+    """
+
+    __slots__ = ('bank_name', 'prefix', 'bank', 'key', 'scale', 'units')
+
+    FIELDS = ('bank_name', 'amount', 'prefix', 'bank')
+
+    def __init__(self, bank_name, amount=0, prefix='', bank='', scale=1):
+        self.bank_name = bank_name
+        self.prefix = sys.intern(prefix or '')
+        self.bank = bank or ''
+        # normalize_bank_name, inlined: balance parsing builds thousands of these
+        self.key = sys.intern(bank_name.replace(" ", "").lower()) if bank_name else ''
+        self.scale = scale
+        self.units = round(amount * scale)
+
+    @classmethod
+    def from_row(cls, row, scale):
+        """Build an Account from a plain {'bank_name', 'amount', 'prefix', 'bank'} dict"""
+        if isinstance(row, cls):
+            return row
+        return cls(row['bank_name'], row.get('amount', 0), row.get('prefix', ''), row.get('bank', ''), scale)
+
+    @property
+    def amount(self):
+        return self.units / self.scale
+
+    @amount.setter
+    def amount(self, value):
+        units = round(value * self.scale)
+        journal = ledger_journal.get()
+        if journal is not None and units != self.units:
+            journal.append((self.bank_name, (units - self.units) / self.scale))
+        self.units = units
+
+    def __getitem__(self, field):
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        setattr(self, field, value)
+
+    def __contains__(self, field):
+        return field in self.FIELDS
+
+    def get(self, field, default=None):
+        return getattr(self, field) if field in self.FIELDS else default
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return f"Account({self.bank_name!r}, {self.amount!r})"
+
+class Ledger(dict):
+    """Parsed balance with a normalized account-name index.
+
+    Behaves exactly like the {'mmk_banks': [...], 'usdt_banks': [...], 'thb_banks': [...]}
+    dict the handlers have always used, but also keeps
+    normalize_bank_name(bank_name) -> row for each section, so account lookups
+    are a dict hit instead of a banks_match scan over every row.
+
+    Rows are Account records (integer minor units, interned keys). The index is
+    built on load and kept up to date by add_account(); amounts are mutated in
+    place on the rows, so they never invalidate it.
+    """
+
+    SECTIONS = ('mmk_banks', 'usdt_banks', 'thb_banks')
+
+    def __init__(self, mmk_banks=None, usdt_banks=None, thb_banks=None):
+        super().__init__(
+            mmk_banks=[Account.from_row(row, AMOUNT_SCALE['mmk_banks']) for row in mmk_banks or []],
+            usdt_banks=[Account.from_row(row, AMOUNT_SCALE['usdt_banks']) for row in usdt_banks or []],
+            thb_banks=[Account.from_row(row, AMOUNT_SCALE['thb_banks']) for row in thb_banks or []]
+        )
+        self._index = {}
+        self.reindex()
+
+    def reindex(self):
+        """Rebuild the name index from the section lists"""
+        self._index = {section: {} for section in self.SECTIONS}
+        for section in self.SECTIONS:
+            for row in self[section]:
+                # First row wins, same as the old scan-and-break lookups
+                self._index[section].setdefault(row.key, row)
+
+    def find(self, section, bank_name):
+        """Get the row for bank_name in one section ('mmk_banks', 'usdt_banks', 'thb_banks')"""
+        if not bank_name:
+            return None
+        return self._index[section].get(normalize_bank_name(bank_name))
+
+    def find_any(self, bank_name):
+        """Get the row for bank_name from any currency section
 
-# Storage for media groups (bulk photos sent together by staff)
-# Format: {media_group_id: {'photos': [photo1, photo2], 'message': message_obj, 'original_text': text}}
-media_groups = {}
-media_group_locks = {}  # Track which media groups are being processed
+        A name in more than one section (e.g. San(KBZ) under MMK and THB)
+        resolves to the last one, THB before USDT before MMK, as the old
+        scan over all rows did.
+        """
+        if not bank_name:
+            return None
+        key = normalize_bank_name(bank_name)
+        for section in reversed(self.SECTIONS):
+            row = self._index[section].get(key)
+            if row is not None:
+                return row
+        return None
 
-# ============================================================================
-# BALANCE PARSING & FORMATTING
-# ============================================================================
+    def add_account(self, section, row):
+        """Append a new account row (Account or plain dict) to a section and index it"""
+        row = Account.from_row(row, AMOUNT_SCALE[section])
+        self[section].append(row)
+        self._index[section].setdefault(row.key, row)
+        return row
+
+    def snapshot(self):
+        """Capture {(section, key): (bank_name, units)} for later diffing
+
+        Keyed by section too: the same account name may appear in more than
+        one currency section (e.g. San(KBZ) in MMK and THB).
+        """
+        return {
+            (section, row.key): (row.bank_name, row.units)
+            for section in self.SECTIONS
+            for row in self[section]
+        }
+
+    def diff(self, snapshot):
+        """List (section, bank_name, delta_units) for accounts that changed since snapshot"""
+        changes = []
+        for section in self.SECTIONS:
+            for row in self[section]:
+                previous = snapshot.get((section, row.key))
+                before = previous[1] if previous else 0
+                if row.units != before:
+                    changes.append((section, row.bank_name, row.units - before))
+        return changes
+
+    def totals(self):
+        """Total per section in currency units, summed exactly over the integer minor units"""
+        return {
+            section: sum(row.units for row in self[section]) / AMOUNT_SCALE[section]
+            for section in self.SECTIONS
+        }
+
+    def staff_totals(self, section):
+        """Per-staff (prefix) totals for one section"""
+        units = {}
+        for row in self[section]:
+            units[row.prefix] = units.get(row.prefix, 0) + row.units
+        scale = AMOUNT_SCALE[section]
+        return {prefix: total / scale for prefix, total in units.items()}
+
+# One balance row: San(KBZ)-11044185, TZT (Binance)-(222.6), NDT(Binance)-6.96(52.96)
+# The prefix run stops at the first non-letter, so matching it greedily finds the
+# same rows as a lazy match followed by optional spaces, without the backtracking
+BALANCE_ROW_PATTERN = re.compile(r'([A-Za-z\s]+)\(([^)]+)\)\s*-\s*\(?([\d,]+(?:\.\d+)?)\)?(?:\([^)]+\))?')
+
+def parse_balance_rows(text, start, end, section):
+    """Accounts for every balance row in text[start:end], without slicing the text"""
+    scale = AMOUNT_SCALE[section]
+    rows = []
+    for prefix, bank_name, amount_str in BALANCE_ROW_PATTERN.findall(text, start, end):
+        prefix = prefix.strip()
+        bank_name = bank_name.strip()
+        try:
+            amount = float(amount_str.replace(',', ''))
+        except ValueError:
+            balance_log.warning("Could not parse %s amount for %s(%s): %s", section, prefix, bank_name, amount_str)
+            continue
+        rows.append(Account(f"{prefix}({bank_name})", amount, prefix, bank_name, scale))
+    return rows
 
 def parse_balance_message(message_text):
     """Parse new balance format with staff prefixes:
@@ -897,103 +2596,97 @@ def parse_balance_message(message_text):
     THB
     ACT(Bkk B) -13223
     
-    Also handles single-line format without line breaks
+    Also handles single-line format without line breaks, and the parts of a
+    multi-part balance (see render_balance_parts): those are collected until
+    every part of the snapshot has been seen, and None is returned until then.
     """
+    if BALANCE_PART_HEADER.search(message_text):
+        return parse_balance_parts(message_text)
+    
     try:
         text = message_text.strip()
         
-        # Remove "MMK" prefix if present at the start
-        if text.startswith('MMK'):
-            text = text[3:]
+        # Skip the "MMK" heading if present at the start
+        start = 3 if text.startswith('MMK') else 0
         
         # Find currency sections
-        usdt_start = text.find('USDT')
-        thb_start = text.find('THB')
+        usdt_start = text.find('USDT', start)
+        thb_start = text.find('THB', start)
         
         if usdt_start == -1:
-            logger.error("Missing USDT marker")
+            balance_log.error("Missing USDT marker")
             return None
         
-        # Determine section boundaries
-        mmk_section = text[:usdt_start]
-        
+        # Determine section boundaries; each section is scanned once, in place
         if thb_start != -1 and thb_start > usdt_start:
-            # THB section exists after USDT
-            usdt_section = text[usdt_start + 4:thb_start]
-            thb_section = text[thb_start + 3:]
+            usdt_end = thb_start
+            thb_rows = parse_balance_rows(text, thb_start + 3, len(text), 'thb_banks')
         else:
-            # No THB section
-            usdt_section = text[usdt_start + 4:]
-            thb_section = ""
-        
-        # Pattern matches: San(KBZ)-11044185 or TZT (Binance)-(222.6) or NDT (Wave) -2864900
-        # Updated to handle amounts with extra info like: NDT(Binance)-6.96(52.96)
-        bank_pattern = r'([A-Za-z\s]+?)\s*\(([^)]+)\)\s*-\s*\(?([\d,]+(?:\.\d+)?)\)?(?:\([^)]+\))?'
-        
-        # Parse MMK banks
-        banks = []
-        for match in re.finditer(bank_pattern, mmk_section):
-            prefix = match.group(1).strip()
-            bank_name = match.group(2).strip()
-            amount_str = match.group(3).replace(',', '')
-            
-            try:
-                amount = float(amount_str)
-                full_name = f"{prefix}({bank_name})"
-                banks.append({'bank_name': full_name, 'amount': amount, 'prefix': prefix, 'bank': bank_name})
-            except ValueError:
-                logger.warning(f"Could not parse amount for {prefix}({bank_name}): {amount_str}")
-                continue
-        
-        # Parse USDT banks
-        usdt_banks = []
-        for match in re.finditer(bank_pattern, usdt_section):
-            prefix = match.group(1).strip()
-            bank_name = match.group(2).strip()
-            amount_str = match.group(3).replace(',', '')
-            
-            try:
-                amount = float(amount_str)
-                full_name = f"{prefix}({bank_name})"
-                usdt_banks.append({'bank_name': full_name, 'amount': amount, 'prefix': prefix, 'bank': bank_name})
-            except ValueError:
-                logger.warning(f"Could not parse USDT amount for {prefix}({bank_name}): {amount_str}")
-                continue
-        
-        # Parse THB banks
-        thb_banks = []
-        if thb_section:
-            for match in re.finditer(bank_pattern, thb_section):
-                prefix = match.group(1).strip()
-                bank_name = match.group(2).strip()
-                amount_str = match.group(3).replace(',', '')
-                
-                try:
-                    amount = float(amount_str)
-                    full_name = f"{prefix}({bank_name})"
-                    thb_banks.append({'bank_name': full_name, 'amount': amount, 'prefix': prefix, 'bank': bank_name})
-                except ValueError:
-                    logger.warning(f"Could not parse THB amount for {prefix}({bank_name}): {amount_str}")
-                    continue
+            usdt_end = len(text)
+            thb_rows = []
+        banks = parse_balance_rows(text, start, usdt_start, 'mmk_banks')
+        usdt_banks = parse_balance_rows(text, usdt_start + 4, usdt_end, 'usdt_banks')
         
-        logger.info(f"Parsed {len(banks)} MMK banks, {len(usdt_banks)} USDT banks, {len(thb_banks)} THB banks")
+        balance_log.info("Parsed %s MMK banks, %s USDT banks, %s THB banks", len(banks), len(usdt_banks), len(thb_rows))
         
-        # Log parsed banks for debugging
-        if banks:
-            logger.info(f"MMK banks: {[b['bank_name'] for b in banks]}")
-        if usdt_banks:
-            logger.info(f"USDT banks: {[b['bank_name'] for b in usdt_banks]}")
-        if thb_banks:
-            logger.info(f"THB banks: {[b['bank_name'] for b in thb_banks]}")
+        # Full name lists only when debugging; they are long and built on every load
+        if balance_log.isEnabledFor(logging.DEBUG):
+            for label, rows in (('MMK', banks), ('USDT', usdt_banks), ('THB', thb_rows)):
+                if rows:
+                    balance_log.debug("%s banks: %s", label, [b.bank_name for b in rows])
         
-        return {'mmk_banks': banks, 'usdt_banks': usdt_banks, 'thb_banks': thb_banks}
-    
+        return Ledger(banks, usdt_banks, thb_rows)
+
     except Exception as e:
-        logger.error(f"Parse error: {e}")
+        balance_log.error("Parse error: %s", e)
 
-        logger.error(traceback.format_exc())
+        balance_log.error(traceback.format_exc())
         return None
 
+def format_units(units, section):
+    """Render integer minor units as a balance amount (whole MMK/THB with commas, 4dp USDT)"""
+    scale = AMOUNT_SCALE[section]
+    units = abs(units)
+    if scale == 1:
+        return f"{units:,}"
+    whole, frac = divmod(units, scale)
+    return f"{whole}.{frac:04d}"
+
+def format_balance_amount(row, section):
+    """Render a row's amount from its integer minor units"""
+    if isinstance(row, Account):
+        return format_units(row.units, section)
+    if AMOUNT_SCALE[section] == 1:
+        return format_units(int(row['amount']), section)
+    return format_units(round(row['amount'] * AMOUNT_SCALE[section]), section)
+
+def format_balance_delta(changes):
+    """Format Ledger.diff() output as one compact line:
+    San(KBZ) −235,000 / ACT(BNB Wallet) +100.0000
+
+    Uses the real minus sign (U+2212), never the '-' separator of the balance
+    format, so a delta line can never be mistaken for a balance by
+    parse_balance_message.
+    """
+    return " / ".join(
+        f"{bank_name} {'+' if delta > 0 else '−'}{format_units(delta, section)}"
+        for section, bank_name, delta in changes
+    )
+
+def render_balance_rows(rows, section):
+    """Balance lines for one section; same text as format_balance_amount, without a call per row"""
+    scale = AMOUNT_SCALE[section]
+    lines = []
+    for row in rows:
+        if not isinstance(row, Account):
+            lines.append(f"{row['bank_name']} -{format_balance_amount(row, section)}")
+        elif scale == 1:
+            lines.append(f"{row.bank_name} -{abs(row.units):,}")
+        else:
+            whole, frac = divmod(abs(row.units), scale)
+            lines.append(f"{row.bank_name} -{whole}.{frac:04d}")
+    return lines
+
 def format_balance_message(mmk_banks, usdt_banks, thb_banks=None):
     """Format balance with staff prefixes:
     San(Kpay P) -2639565
@@ -1006,40 +2699,948 @@ def format_balance_message(mmk_banks, usdt_banks, thb_banks=None):
     
     Note: The hyphen (-) is a separator, not a minus sign
     """
-    message = ""
-    for bank in mmk_banks:
-        # Format with hyphen separator
-        formatted = f"{abs(int(bank['amount'])):,}"
-        message += f"{bank['bank_name']} -{formatted}\n"
-    
-    message += "\nUSDT\n"
-    for bank in usdt_banks:
-        # Format USDT with 4 decimal places and hyphen separator
-        formatted = f"{abs(bank['amount']):.4f}"
-        message += f"{bank['bank_name']} -{formatted}\n"
+    lines = render_balance_rows(mmk_banks, 'mmk_banks')
+    
+    lines.append("")
+    lines.append("USDT")
+    lines.extend(render_balance_rows(usdt_banks, 'usdt_banks'))
     
     # Add THB section if there are THB banks
     if thb_banks:
-        message += "\nTHB\n"
-        for bank in thb_banks:
-            # Format THB with no decimal places (integer) and hyphen separator
-            formatted = f"{abs(int(bank['amount'])):,}"
-            message += f"{bank['bank_name']} -{formatted}\n"
+        lines.append("")
+        lines.append("THB")
+        lines.extend(render_balance_rows(thb_banks, 'thb_banks'))
+    
+    return "\n".join(lines).strip()
+
+# ============================================================================
+# MULTI-PART BALANCES
+# ============================================================================
+
+# A balance too long for one Telegram message is posted as several parts:
+#
+#   Balance part 2/3 #1f0c9a2e
+#   MMK
+#   San(Wave) -120,000
+#   ...
+#
+#   USDT
+#   San(Swift) -81.9900
+#
+# Each part repeats the header of every section it continues, so it parses on
+# its own; the snapshot id (a digest of the full balance) ties the parts together.
+BALANCE_PART_HEADER = re.compile(r'^Balance part (\d+)/(\d+) #([0-9a-f]{8})[ \t]*$', re.M)
+BALANCE_SECTION_HEADER = re.compile(r'^(MMK|USDT|THB)[ \t]*$', re.M)
+BALANCE_SECTION_NAMES = {'MMK': 'mmk_banks', 'USDT': 'usdt_banks', 'THB': 'thb_banks'}
+
+# Room kept in each part for its "Balance part n/m #id" line
+BALANCE_PART_HEADER_RESERVE = 40
+
+def render_balance_parts(balances, limit=TELEGRAM_MAX_MESSAGE_LENGTH):
+    """Balance message texts for posting: the usual single text when it fits in
+    one message, otherwise numbered parts of at most `limit` characters"""
+    text = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks'))
+    if len(text) <= limit:
+        return [text]
+    
+    snapshot_id = hashlib.blake2b(text.encode(), digest_size=4).hexdigest()
+    budget = limit - BALANCE_PART_HEADER_RESERVE
+    bodies = []
+    lines, size = [], 0
+    for header, section in (('MMK', 'mmk_banks'), ('USDT', 'usdt_banks'), ('THB', 'thb_banks')):
+        rows = balances.get(section) or []
+        if not rows and section != 'usdt_banks':
+            continue
+        # The section header is repeated at the top of every part the section spills into
+        opening = ([""] if lines else []) + [header]
+        pending = opening
+        for row in render_balance_rows(rows, section):
+            added = sum(len(line) + 1 for line in pending) + len(row) + 1
+            if lines and size + added > budget:
+                bodies.append(lines)
+                pending = [header]
+                lines, size = [], 0
+                added = len(header) + 1 + len(row) + 1
+            lines.extend(pending)
+            lines.append(row)
+            size += added
+            pending = []
+        if pending:
+            # A section without rows still gets its header, like the single-text format
+            lines.extend(pending)
+            size += sum(len(line) + 1 for line in pending)
+    bodies.append(lines)
+    
+    total = len(bodies)
+    return [
+        f"Balance part {index}/{total} #{snapshot_id}\n" + "\n".join(body)
+        for index, body in enumerate(bodies, 1)
+    ]
+
+class BalancePartAssembler:
+    """Collects the parts of multi-part balance snapshots until one is complete.
+
+    Parts are parsed as they arrive and kept per snapshot id; the snapshot is
+    handed out, and forgotten, when its last missing part comes in. Only the
+    most recent MAX_SNAPSHOTS incomplete snapshots are kept.
+    """
+
+    MAX_SNAPSHOTS = 8
+
+    def __init__(self):
+        self._snapshots = OrderedDict()  # snapshot id -> (total, {index: {section: [Account]}})
+        self.completed = 0
+
+    def add(self, snapshot_id, index, total, rows):
+        """Store one parsed part; return the full Ledger if this completes the snapshot"""
+        entry = self._snapshots.get(snapshot_id)
+        if entry is None or entry[0] != total:
+            entry = (total, {})
+            self._snapshots[snapshot_id] = entry
+        self._snapshots.move_to_end(snapshot_id)
+        entry[1][index] = rows
+        while len(self._snapshots) > self.MAX_SNAPSHOTS:
+            self._snapshots.popitem(last=False)
+        
+        if len(entry[1]) < total:
+            balance_log.info("🧩 Balance part %s/%s of #%s stored (%s/%s received)", index, total, snapshot_id, len(entry[1]), total)
+            return None
+        
+        del self._snapshots[snapshot_id]
+        self.completed += 1
+        parts = [entry[1][i] for i in range(1, total + 1)]
+        return Ledger(*(
+            [row for part in parts for row in part[section]]
+            for section in Ledger.SECTIONS
+        ))
+
+balance_parts = BalancePartAssembler()
+
+def parse_balance_parts(message_text):
+    """Parse every balance part in message_text into balance_parts; return a Ledger once one is complete"""
+    try:
+        headers = list(BALANCE_PART_HEADER.finditer(message_text))
+        ledger = None
+        for position, header in enumerate(headers):
+            index, total, snapshot_id = int(header.group(1)), int(header.group(2)), header.group(3)
+            if not 1 <= index <= total:
+                balance_log.warning("Ignoring balance part %s/%s of #%s", index, total, snapshot_id)
+                continue
+            end = headers[position + 1].start() if position + 1 < len(headers) else len(message_text)
+            rows = {section: [] for section in Ledger.SECTIONS}
+            sections = list(BALANCE_SECTION_HEADER.finditer(message_text, header.end(), end))
+            for number, section_header in enumerate(sections):
+                section = BALANCE_SECTION_NAMES[section_header.group(1)]
+                section_end = sections[number + 1].start() if number + 1 < len(sections) else end
+                rows[section].extend(parse_balance_rows(message_text, section_header.end(), section_end, section))
+            completed = balance_parts.add(snapshot_id, index, total, rows)
+            if completed is not None:
+                ledger = completed
+        
+        if ledger is not None:
+            balance_log.info("Parsed multi-part balance: %s MMK banks, %s USDT banks, %s THB banks",
+                             len(ledger['mmk_banks']), len(ledger['usdt_banks']), len(ledger['thb_banks']))
+        return ledger
+
+    except Exception as e:
+        balance_log.error("Parse error: %s", e)
+
+        balance_log.error(traceback.format_exc())
+        return None
+
+# ============================================================================
+# BALANCE PUBLISHING
+# ============================================================================
+
+class BalancePublisher:
+    """Coalesces balance posts to the auto-balance topic.
+
+    Transaction handlers call publish() after mutating the ledger. The first
+    update after a quiet period is posted straight away; updates arriving
+    within `interval` seconds of the last post only mark the ledger dirty and
+    are folded into one trailing post rendered from the latest state, so the
+    final balance always goes out. Updates that never got a post of their own
+    are counted in `suppressed`.
+
+    With live=True (BALANCE_LIVE_MESSAGE) the full balance is kept in a single
+    pinned message that is edited in place, and each post only adds a compact
+    delta line to the topic.
+    
+    A balance longer than one message goes out as numbered parts
+    (render_balance_parts); in live mode each part has its own pinned message.
+    """
+
+    def __init__(self, interval, live=False):
+        self.interval = interval
+        self.live = live
+        self.live_message_ids = None
+        self.dirty = False
+        self.last_published_at = 0.0
+        self.requested = 0
+        self.published = 0
+        self.last_text = None
+        self._last_ledger = None
+        self._last_snapshot = {}
+        self._bot = None
+        self._chat_data = None
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def suppressed(self):
+        return max(0, self.requested - self.published)
+
+    def _flush_pending(self):
+        task = self._flush_task
+        return task is not None and not task.done() and task is not asyncio.current_task()
+
+    async def publish(self, context, force=False):
+        """Mark the ledger dirty; post now if the window allows (or force=True), otherwise schedule"""
+        self._bot = context.bot
+        self._chat_data = context.chat_data
+        self.dirty = True
+        self.requested += 1
+        
+        if force:
+            await self.flush()
+            return
+        
+        if self._flush_pending():
+            # A trailing post is already due and will render the latest state
+            return
+        
+        wait = self.interval - (time.monotonic() - self.last_published_at)
+        if wait <= 0:
+            await self.flush()
+        else:
+            self._flush_task = asyncio.create_task(self._flush_later(wait))
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self):
+        """Post the current ledger if anything changed since the last post"""
+        async with self._lock:
+            if not self.dirty or self._chat_data is None:
+                return
+            balances = self._chat_data.get('balances')
+            if not balances:
+                self.dirty = False
+                return
+            
+            self.dirty = False
+            parts = render_balance_parts(balances)
+            text = "\n\n".join(parts)
+            if text == self.last_text:
+                # Nothing changed since the last post
+                return
+            save_ledger_snapshot(balances)
+            try:
+                with tracer.span('balance post', {'balance.parts': len(parts), 'balance.coalesced': self.suppressed}):
+                    if self.live:
+                        await self._post_live(balances, parts)
+                    else:
+                        for part in parts:
+                            await self._send(part)
+                self.last_text = text
+                balance_ingest.record(parts)
+                self._last_ledger = balances
+                self._last_snapshot = balances.snapshot()
+                self.last_published_at = time.monotonic()
+                self.published += 1
+                logger.info("📤 Balance posted (%s updates coalesced so far)", self.suppressed)
+            except Exception as e:
+                # Keep it dirty so the next window retries with the latest state
+                self.dirty = True
+                self.last_published_at = time.monotonic()
+                logger.error("Error posting balance: %s", e)
+        
+        # Changes made while we were posting still need a post of their own
+        if self.dirty and not self._flush_pending():
+            self._flush_task = asyncio.create_task(self._flush_later(self.interval))
+
+    async def _send(self, text):
+        if AUTO_BALANCE_TOPIC_ID:
+            return await outbound.send(
+                LANE_BALANCE, self._bot, 'send_message', wait=True,
+                chat_id=TARGET_GROUP_ID,
+                message_thread_id=AUTO_BALANCE_TOPIC_ID,
+                text=text
+            )
+        return await outbound.send(
+            LANE_BALANCE, self._bot, 'send_message', wait=True,
+            chat_id=TARGET_GROUP_ID,
+            text=text
+        )
+
+    async def _post_live(self, balances, parts):
+        """Edit the pinned balance message(s) in place and post a one-line delta.
+
+        The pinned messages always hold the full balance in the normal format,
+        so /load (or reposting them into the balance topic) still restores the
+        ledger through parse_balance_message.
+        """
+        if self.live_message_ids is None:
+            stored_ids = get_setting('live_balance_message_id')
+            self.live_message_ids = [int(i) for i in stored_ids.split(',') if i] if stored_ids else []
+        
+        message_ids = []
+        for index, part in enumerate(parts):
+            message_id = self.live_message_ids[index] if index < len(self.live_message_ids) else 0
+            if message_id and await self._edit_live(message_id, part):
+                message_ids.append(message_id)
+                continue
+            
+            # First post, or the pinned message was deleted: start a new one
+            sent = await self._send(part)
+            message_ids.append(sent.message_id)
+            try:
+                await outbound.send(
+                    LANE_BALANCE, self._bot, 'pin_chat_message', wait=True,
+                    chat_id=TARGET_GROUP_ID,
+                    message_id=sent.message_id,
+                    disable_notification=True
+                )
+            except Exception as e:
+                logger.warning("Could not pin live balance message: %s", e)
+            logger.info("📌 Live balance message %s/%s is now %s", index + 1, len(parts), sent.message_id)
+        
+        # The balance shrank to fewer parts: the leftover ones would only confuse a /load
+        for message_id in self.live_message_ids[len(parts):]:
+            try:
+                await outbound.send(
+                    LANE_BALANCE, self._bot, 'delete_message', wait=True,
+                    chat_id=TARGET_GROUP_ID,
+                    message_id=message_id
+                )
+            except Exception as e:
+                logger.warning("Could not delete old live balance message %s: %s", message_id, e)
+        
+        if message_ids != self.live_message_ids:
+            self.live_message_ids = message_ids
+            set_setting('live_balance_message_id', ','.join(str(i) for i in message_ids))
+        
+        # A freshly loaded ledger has nothing meaningful to diff against
+        if balances is self._last_ledger:
+            changes = balances.diff(self._last_snapshot)
+            if changes:
+                await self._send(format_balance_delta(changes))
+
+    async def _edit_live(self, message_id, text):
+        """Edit one pinned balance message; False if it has to be posted again"""
+        try:
+            await outbound.send(
+                LANE_BALANCE, self._bot, 'edit_message_text', wait=True,
+                chat_id=TARGET_GROUP_ID,
+                message_id=message_id,
+                text=text
+            )
+            return True
+        except Exception as e:
+            if 'not modified' in str(e).lower():
+                return True
+            logger.warning("Could not edit live balance message %s: %s", message_id, e)
+            return False
+
+    async def shutdown(self):
+        """Cancel the pending trailing post and publish the final state immediately"""
+        if self._flush_pending():
+            self._flush_task.cancel()
+        await self.flush()
+
+balance_publisher = BalancePublisher(BALANCE_PUBLISH_INTERVAL, live=bool(BALANCE_LIVE_MESSAGE))
+
+class BalanceIngest:
+    """Decides which balance-topic messages are new snapshots worth loading.
+
+    Balance texts are fingerprinted with whitespace collapsed, so the
+    single-line and multi-line forms of one balance match. A message is
+    skipped without parsing when it matches the ledger as last posted or
+    loaded, or when it matches an older balance the bot posted: reposting
+    that stale copy would roll back transactions applied since, so it is
+    reported and left for an explicit /load. Anything else is parsed,
+    diffed against the loaded ledger and loaded, under the ledger lock like
+    every other ledger write. (Telegram does not deliver a bot's own
+    messages to it, so the bot's posts never arrive here.)
+
+    The fingerprints of the current ledger are kept from when it was posted
+    or loaded, instead of rendering the ledger again for every message;
+    they are not used while a change is waiting to be posted.
+    """
+
+    HISTORY = 256
+
+    def __init__(self):
+        self._published = OrderedDict()  # fingerprint -> None, oldest first
+        self._current = frozenset()
+        self.skipped_current = 0
+        self.skipped_stale = 0
+        self.loaded = 0
+
+    @staticmethod
+    def fingerprint(text):
+        return hashlib.blake2b(' '.join(text.split()).encode(), digest_size=16).hexdigest()
+
+    def record(self, parts):
+        """Remember the balance parts the bot posted, which are now the current ledger"""
+        fingerprints = [self.fingerprint(part) for part in parts]
+        for fingerprint in fingerprints:
+            self._published[fingerprint] = None
+            self._published.move_to_end(fingerprint)
+        while len(self._published) > self.HISTORY:
+            self._published.popitem(last=False)
+        self._current = frozenset(fingerprints)
+
+    def loaded_ledger(self, balances, text=None):
+        """Make a newly loaded ledger (and the text it was loaded from) the current one"""
+        fingerprints = {self.fingerprint(part) for part in render_balance_parts(balances)}
+        if text:
+            fingerprints.add(self.fingerprint(text))
+        self._current = frozenset(fingerprints)
+
+    async def ingest(self, message, context):
+        """Load message.text as the ledger if it is a new external balance snapshot"""
+        async with ledger_lock:
+            self._ingest(message, context)
+    
+    def _ingest(self, message, context):
+        current = context.chat_data.get('balances')
+        fingerprint = self.fingerprint(message.text)
+        # The cached fingerprints describe the ledger until a change to it is waiting to be posted
+        if current and fingerprint in self._current and not balance_publisher.dirty:
+            self.skipped_current += 1
+            logger.info("⏭️ Balance message %s matches the loaded balance, skipping", message.message_id)
+            return
+        if current and fingerprint in self._published:
+            self.skipped_stale += 1
+            logger.warning("⚠️ Balance message %s repeats an older balance posted by the bot, "
+                           "not loading it over newer transactions (reply /load to it to force)", message.message_id)
+            return
+        
+        balances = parse_balance_message(message.text)
+        if not balances:
+            # Unparseable, or one part of a multi-part balance still waiting for the rest
+            return
+        
+        if current:
+            before = current.snapshot()
+            changes = balances.diff(before)
+            # Accounts missing from the new snapshot went to zero, as far as the ledger is concerned
+            after = balances.snapshot()
+            changes.extend(
+                (section, bank_name, -units)
+                for (section, key), (bank_name, units) in before.items()
+                if (section, key) not in after and units
+            )
+            if not changes:
+                # Same balances, written differently: keep the ledger, and its transaction history, as is
+                self._current |= {fingerprint}
+                self.skipped_current += 1
+                logger.info("⏭️ Balance message %s has no changes, skipping", message.message_id)
+                return
+            logger.info("🔄 Balance changed by message %s: %s", message.message_id, format_balance_delta(changes))
+        
+        context.chat_data['balances'] = balances
+        save_ledger_snapshot(balances)
+        self.loaded_ledger(balances, message.text)
+        self.loaded += 1
+        thb_count = len(balances.get('thb_banks', []))
+        logger.info("✅ Balance loaded: %s MMK banks, %s USDT banks, %s THB banks",
+                    len(balances['mmk_banks']), len(balances['usdt_banks']), thb_count)
+
+balance_ingest = BalanceIngest()
+
+def save_ledger_snapshot(balances):
+    """Keep a copy of the ledger in the settings table, restored by the startup warm-up"""
+    set_setting('ledger_snapshot', format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks')))
+
+def load_ledger_snapshot():
+    """The ledger saved by save_ledger_snapshot, or None"""
+    text = get_setting('ledger_snapshot')
+    return parse_balance_message(text) if text else None
+
+async def publish_balance(context, force=False):
+    """Queue the current ledger for posting to the auto-balance topic"""
+    await balance_publisher.publish(context, force=force)
+
+# ============================================================================
+# RECEIPT FINGERPRINTS
+# ============================================================================
+
+# The message, and handler context, of the update (or queued job) the current task is handling
+current_message = contextvars.ContextVar('current_message', default=None)
+current_context = contextvars.ContextVar('current_context', default=None)
+
+def receipt_digest(image_bytes):
+    """Content digest identifying byte-identical receipt images"""
+    return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+@functools.cache
+def pillow_image():
+    """PIL.Image, imported on first use, or None when Pillow is not installed"""
+    try:
+        from PIL import Image
+    except ImportError:  # duplicate receipt detection is disabled without Pillow
+        return None
+    return Image
+
+def receipt_dhash(image_bytes):
+    """256-bit difference hash of an image, or None if Pillow is missing or the image is unreadable
+
+    Robust to re-compression, resizing and light cropping: each bit is
+    whether a pixel of a 17x16 grayscale thumbnail is brighter than its
+    right-hand neighbour.
+    """
+    Image = pillow_image()
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.draft('L', (68, 64))  # JPEG: decode at reduced scale, much faster than a full decode
+            pixels = list(img.convert('L').resize((17, 16), Image.BILINEAR).getdata())
+    except Exception as e:
+        logger.warning("Could not fingerprint receipt image: %s", e)
+        return None
+    value = 0
+    for row in range(16):
+        offset = row * 17
+        for col in range(16):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+class BKTree:
+    """Metric tree over integer hashes for Hamming-distance range queries"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        """Add item under hash value; items with the same hash share a node"""
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = (value ^ node[0]).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Yield (distance, item) for every item within max_distance of value"""
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = (value ^ node[0]).bit_count()
+            if distance <= max_distance:
+                for item in node[1]:
+                    yield distance, item
+            # Triangle inequality: only children at distance d +- max_distance can hold matches
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+
+class ReceiptHashIndex:
+    """Recently seen receipts, by content digest and perceptual hash, with their OCR results.
+
+    A receipt whose bytes match an earlier, different Telegram file (the same
+    screenshot uploaded again) is a duplicate straight away. Receipts from
+    one banking app share a layout, so a small perceptual distance alone
+    does not mean the same receipt: a near match is only kept as a
+    candidate and reported once OCR reads the same amount-bearing answer
+    from both images (a re-cropped or re-compressed copy). OCR answers are
+    reused for byte-identical images only. Entries older than `window`
+    seconds are ignored and dropped on rebuild; the index lives in memory
+    and starts empty after a restart.
+    """
+
+    REBUILD_EVERY = 500
+    MAX_CANDIDATES = 16
+
+    def __init__(self, window, flag_distance):
+        self.window = window
+        self.flag_distance = flag_distance
+        self._tree = BKTree()
+        self._by_digest = {}
+        self._by_file = {}
+        self._added = 0
+        self.duplicates = 0
+        self.ocr_reused = 0
+
+    def _live(self, entry):
+        if entry is not None and entry['seen_at'] >= time.time() - self.window:
+            return entry
+        return None
+
+    def _add(self, entry):
+        self._by_digest[entry['digest']] = entry
+        if entry['file_unique_id']:
+            self._by_file[entry['file_unique_id']] = entry
+        if entry['hash'] is not None:
+            self._tree.add(entry['hash'], entry)
+        self._added += 1
+        if self._added >= self.REBUILD_EVERY:
+            self._rebuild()
+
+    def _rebuild(self):
+        live = [entry for entry in self._by_digest.values() if self._live(entry)]
+        self._tree = BKTree()
+        self._by_digest = {}
+        self._by_file = {}
+        for entry in live:
+            self._by_digest[entry['digest']] = entry
+            if entry['file_unique_id']:
+                self._by_file[entry['file_unique_id']] = entry
+            if entry['hash'] is not None:
+                self._tree.add(entry['hash'], entry)
+        self._added = 0
+
+    def _near(self, value, max_distance, file_unique_id):
+        """Live entries of other files within max_distance, nearest first"""
+        cutoff = time.time() - self.window
+        matches = [
+            (distance, -entry['seen_at'], id(entry), entry)
+            for distance, entry in self._tree.search(value, max_distance)
+            if entry['seen_at'] >= cutoff and entry['file_unique_id'] not in (None, file_unique_id)
+        ]
+        return [entry for *_, entry in sorted(matches)[:self.MAX_CANDIDATES]]
+
+    def seen(self, file_unique_id):
+        return file_unique_id in self._by_file
+
+    def observe(self, digest, value, file_unique_id, message_id):
+        """Record a downloaded receipt; return the earlier entry if it is the same image from another file
+
+        Only the first download of a Telegram file is checked, so fetching the
+        same photo again later in the flow is not a duplicate.
+        """
+        if file_unique_id in self._by_file:
+            return None
+        earlier = self._live(self._by_digest.get(digest))
+        if earlier is not None and earlier['file_unique_id'] in (None, file_unique_id):
+            earlier = None
+        near = []
+        if earlier is None and value is not None:
+            near = self._near(value, self.flag_distance, file_unique_id)
+        self._add({'digest': digest, 'hash': value, 'file_unique_id': file_unique_id,
+                   'message_id': message_id, 'seen_at': time.time(), 'ocr': {},
+                   'near': near, 'flagged': earlier is not None})
+        if earlier is not None:
+            self.duplicates += 1
+        return earlier
+
+    def cached_ocr(self, digest, prompt_digest):
+        """A stored OCR answer for this prompt on the same image, or None"""
+        entry = self._live(self._by_digest.get(digest))
+        if entry is None or prompt_digest not in entry['ocr']:
+            return None
+        self.ocr_reused += 1
+        return entry['ocr'][prompt_digest]
+
+    def store_ocr(self, digest, prompt_digest, result):
+        """Remember an OCR answer; return the near-match entry this answer confirms as the same receipt, if any"""
+        entry = self._live(self._by_digest.get(digest))
+        if entry is None:
+            entry = {'digest': digest, 'hash': None, 'file_unique_id': None, 'message_id': None,
+                     'seen_at': time.time(), 'ocr': {}, 'near': [], 'flagged': False}
+            self._add(entry)
+        entry['ocr'][prompt_digest] = result
+        if entry['flagged'] or not any(ch.isdigit() for ch in result or ''):
+            return None
+        for near in entry['near']:
+            if self._live(near) and near['ocr'].get(prompt_digest) == result:
+                entry['flagged'] = True
+                self.duplicates += 1
+                return near
+        return None
+
+receipt_index = ReceiptHashIndex(DUPLICATE_WINDOW_HOURS * 3600, DUPLICATE_HASH_DISTANCE)
+
+async def alert_duplicate_receipt(context, earlier, reason):
+    """Warn the alert topic that the receipt being handled was already seen"""
+    message = current_message.get()
+    message_id = message.message_id if message else None
+    age_minutes = (time.time() - earlier['seen_at']) / 60
+    logger.warning("⚠️ Receipt in message %s matches message %s (%s)",
+                   message_id or '?', earlier['message_id'], reason)
+    if context is None:
+        return
+    await send_status_message(
+        context,
+        f"⚠️ <b>Possible Duplicate Receipt</b>\n\n"
+        f"<b>Message ID:</b> {message_id or 'unknown'}\n"
+        f"<b>Looks like:</b> receipt in message {earlier['message_id'] or 'unknown'} "
+        f"({age_minutes:.0f} min ago)\n"
+        f"<b>Match:</b> {reason}\n\n"
+        f"Please check the receipt was not already used.",
+        parse_mode='HTML'
+    )
+
+# ============================================================================
+# PHOTO DOWNLOADS
+# ============================================================================
+
+class _DownloadSink:
+    """File-like target for File.download_to_memory that keeps the response bytes instead of copying them"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+        return len(data)
+
+    @property
+    def data(self):
+        # A single write (the HTTP client's whole response) is kept as is; bytes() does not copy bytes
+        if len(self._chunks) == 1:
+            return bytes(self._chunks[0])
+        return b''.join(self._chunks)
+
+class PhotoCache:
+    """Recently downloaded Telegram photos by file_unique_id, within a byte budget.
+
+    Concurrent requests for the same file share one download, and every
+    caller gets the same immutable bytes object, so a receipt read by the
+    album handler, the pre-scan and the staff reply is fetched once.
+    Least recently used photos are dropped once the cached bytes exceed
+    `budget`; a photo larger than the whole budget is returned but not kept.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self._photos = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._photos)
+
+    async def fetch(self, bot, photo) -> bytes:
+        key = photo.file_unique_id
+        data = self._photos.get(key)
+        if data is not None:
+            self._photos.move_to_end(key)
+            self.hits += 1
+            return data
+        
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The task doing the download was cancelled, not this one: fetch it ourselves
+                return await self.fetch(bot, photo)
+        
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            with tracer.span('telegram download', {'photo.file_unique_id': key}, SPAN_KIND_CLIENT) as span:
+                photo_file = await bot.get_file(photo.file_id)
+                sink = _DownloadSink()
+                await photo_file.download_to_memory(sink)
+                data = sink.data
+                span.set('photo.bytes', len(data))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Waiters see it; don't warn when nobody was waiting
+            raise
+        finally:
+            del self._inflight[key]
+        future.set_result(data)
+        self._store(key, data)
+        return data
+
+    def _store(self, key, data):
+        if len(data) > self.budget:
+            return
+        self._photos[key] = data
+        self.size += len(data)
+        while self.size > self.budget:
+            _, dropped = self._photos.popitem(last=False)
+            self.size -= len(dropped)
+
+photo_cache = PhotoCache(PHOTO_CACHE_MB * 1024 * 1024)
+
+DATA_URL_PREFIX = b"data:image/jpeg;base64,"
+
+class ReceiptBuffer:
+    """One receipt image on its way to OCR.
+
+    Wraps the downloaded bytes without copying them. The base64 data URL
+    the vision model needs is built once, on first use, by encoding the
+    image chunk by chunk straight into a buffer of the URL's exact size
+    after the prefix, then decoding that buffer to text; later prompts on
+    the same receipt reuse it. The buffer belongs to the call, so receipts
+    encoded at the same time (OCR runs in threads) never share one, and it
+    is freed as soon as the text exists.
+    """
+
+    CHUNK = 3 * 16384  # Whole base64 quanta, so chunks encode without padding
+
+    def __init__(self, data):
+        self.data = data
+        self._data_url = None
+        self._digest = None
+        receipt_buffers.track(self, len(data))
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = receipt_digest(self.data)
+        return self._digest
+
+    @property
+    def data_url(self):
+        if self._data_url is None:
+            size = len(DATA_URL_PREFIX) + 4 * ((len(self.data) + 2) // 3)
+            out = bytearray(size)
+            offset = len(DATA_URL_PREFIX)
+            out[:offset] = DATA_URL_PREFIX
+            source = memoryview(self.data)
+            for start in range(0, len(source), self.CHUNK):
+                encoded = binascii.b2a_base64(source[start:start + self.CHUNK], newline=False)
+                out[offset:offset + len(encoded)] = encoded
+                offset += len(encoded)
+            self._data_url = out.decode('ascii')
+            receipt_buffers.track(self, len(self._data_url))
+        return self._data_url
+
+class ReceiptBufferStats:
+    """Memory held by receipt images, and a byte budget for images in flight to the vision model
+
+    `live` counts the bytes (image plus data URL) of every ReceiptBuffer not
+    yet garbage collected, `in_flight` those of OCR requests running now.
+    A request waits while the budget is used up, which bounds the extra
+    copies the HTTP client makes when a whole media group is OCR'd at once.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.live = 0
+        self.peak_live = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waits = 0
+        self._condition = None
+
+    def track(self, buffer, size):
+        self.live += size
+        self.peak_live = max(self.peak_live, self.live)
+        weakref.finalize(buffer, self._untrack, size)
+
+    def _untrack(self, size):
+        self.live -= size
+
+    @asynccontextmanager
+    async def hold(self, size):
+        size = min(size, self.budget)  # A single image larger than the budget still runs, alone
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            if self.in_flight + size > self.budget:
+                self.waits += 1
+                await self._condition.wait_for(lambda: self.in_flight + size <= self.budget)
+            self.in_flight += size
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= size
+                self._condition.notify_all()
+
+receipt_buffers = ReceiptBufferStats(OCR_PAYLOAD_BUDGET_MB * 1024 * 1024)
+
+async def download_photo(context: ContextTypes.DEFAULT_TYPE, photo) -> bytes:
+    """Download a receipt photo (or take it from the cache) and check it against recently seen receipts"""
+    photo_bytes = await photo_cache.fetch(context.bot, photo)
+    
+    if not receipt_index.seen(photo.file_unique_id):
+        value = await asyncio.to_thread(receipt_dhash, photo_bytes) if pillow_image() is not None else None
+        message = current_message.get()
+        earlier = receipt_index.observe(receipt_digest(photo_bytes), value, photo.file_unique_id,
+                                        message.message_id if message else None)
+        if earlier:
+            await alert_duplicate_receipt(context, earlier, "identical image")
     
-    return message.strip()
+    return photo_bytes
 
 # ============================================================================
 # OCR FUNCTIONS
 # ============================================================================
 
-async def ocr_detect_mmk_bank_and_amount(image_base64, mmk_banks, user_prefix=None):
+OCR_MODEL = "gpt-4o"
+
+async def ocr_vision_request(prompt, receipt, max_tokens=300):
+    """Send one receipt image (a ReceiptBuffer) + prompt to the vision model and return the answer text.
+
+    The OpenAI client is synchronous, so the call runs in a worker thread to
+    keep the event loop free for other updates while OCR is in flight. An
+    answer already given for the same prompt on the same receipt image is
+    reused without calling the model.
+    """
+    digest = receipt.digest
+    prompt_digest = hashlib.blake2b(f"{max_tokens}:{prompt}".encode(), digest_size=16).hexdigest()
+    cached = receipt_index.cached_ocr(digest, prompt_digest)
+    if cached is not None:
+        ocr_log.info("♻️ Reusing OCR result for an already scanned receipt")
+        return cached
+    
+    with tracer.span('ocr', {'ocr.model': OCR_MODEL, 'ocr.image_bytes': len(receipt.data)}, SPAN_KIND_CLIENT) as span:
+        async with receipt_buffers.hold(len(receipt.data_url)):
+            response = await asyncio.to_thread(
+                openai_client().chat.completions.create,
+                model=OCR_MODEL,
+                messages=[{
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": receipt.data_url}}
+                    ]
+                }],
+                max_tokens=max_tokens
+            )
+        if response.usage is not None:
+            span.set('ocr.prompt_tokens', response.usage.prompt_tokens)
+            span.set('ocr.completion_tokens', response.usage.completion_tokens)
+    result = response.choices[0].message.content
+    near = receipt_index.store_ocr(digest, prompt_digest, result)
+    if near:
+        await alert_duplicate_receipt(current_context.get(), near, "near-identical image with the same OCR reading")
+    return result
+
+async def ocr_detect_mmk_bank_and_amount(receipt, mmk_banks, user_prefix=None):
     """Detect MMK bank and amount from receipt, optionally filtering by user prefix"""
     try:
         # Filter banks by user prefix if provided
         if user_prefix:
             filtered_banks = [b for b in mmk_banks if b.get('prefix') == user_prefix]
             if not filtered_banks:
-                logger.warning(f"No banks found for prefix '{user_prefix}'")
+                ocr_log.warning("No banks found for prefix '%s'", user_prefix)
                 filtered_banks = mmk_banks
         else:
             filtered_banks = mmk_banks
@@ -1083,19 +3684,9 @@ CRITICAL NOTES:
 3. Match the bank name EXACTLY as shown in the available banks list
 4. Wave, Wave M, and Wave Channel are THREE DIFFERENT accounts"""
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + image_base64}}
-                ]
-            }],
-            max_tokens=300
-        )
+        response = await ocr_vision_request(prompt, receipt, max_tokens=300)
         
-        result = response.choices[0].message.content.strip()
+        result = response.strip()
         result = re.sub(r'```json\s*|\s*```', '', result)
         
         json_start = result.find('{')
@@ -1114,17 +3705,17 @@ CRITICAL NOTES:
         return None
     
     except Exception as e:
-        logger.error(f"OCR error: {e}")
+        ocr_log.error("OCR error: %s", e)
         return None
 
-async def ocr_extract_usdt_amount(image_base64):
+async def ocr_extract_usdt_amount(receipt):
     """Extract USDT amount from receipt (legacy function for backward compatibility)"""
-    result = await ocr_extract_usdt_with_fee(image_base64)
+    result = await ocr_extract_usdt_with_fee(receipt)
     if result:
         return result['total_amount']
     return None
 
-async def ocr_extract_usdt_with_fee(image_base64):
+async def ocr_extract_usdt_with_fee(receipt):
     """Extract USDT amount, network fee, and bank type from STAFF receipt (for SELL transactions)
     
     This is used when STAFF sends USDT to customer. We need to know the TOTAL amount
@@ -1225,20 +3816,10 @@ CRITICAL RULES:
 - Always return amounts as positive numbers
 - bank_type must be "binance", "swift", or "wallet" (lowercase)"""
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + image_base64}}
-                ]
-            }],
-            max_tokens=300
-        )
+        response = await ocr_vision_request(prompt, receipt, max_tokens=300)
         
-        result = response.choices[0].message.content.strip()
-        logger.info(f"USDT OCR raw response: {result[:200]}...")
+        result = response.strip()
+        ocr_log.info("USDT OCR raw response: %.200s...", result)
         
         result = re.sub(r'```json\s*|\s*```', '', result)
         
@@ -1247,11 +3828,11 @@ CRITICAL RULES:
         if json_start != -1 and json_end != -1:
             result = result[json_start:json_end + 1]
         else:
-            logger.warning(f"No JSON found in USDT OCR response: {result}")
+            ocr_log.warning("No JSON found in USDT OCR response: %s", result)
             return None
         
         if not result or result == '':
-            logger.warning("Empty result after JSON extraction")
+            ocr_log.warning("Empty result after JSON extraction")
             return None
         
         data = json.loads(result)
@@ -1287,16 +3868,16 @@ CRITICAL RULES:
             'bank_type': bank_type
         }
         
-        logger.info(f"USDT OCR: {result_data}")
+        ocr_log.info("USDT OCR: %s", result_data)
         return result_data
     
     except Exception as e:
-        logger.error(f"USDT OCR error: {e}")
+        ocr_log.error("USDT OCR error: %s", e)
 
-        logger.error(traceback.format_exc())
+        ocr_log.error(traceback.format_exc())
         return None
 
-async def ocr_extract_usdt_received(image_base64):
+async def ocr_extract_usdt_received(receipt):
     """Extract USDT RECEIVED amount from customer's receipt (for BUY transactions)
     
     This function detects only the amount we will RECEIVE, not including network fee.
@@ -1404,20 +3985,10 @@ CRITICAL:
 - Always return amounts as positive numbers
 - bank_type must be "binance", "swift", or "wallet" (lowercase)"""
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + image_base64}}
-                ]
-            }],
-            max_tokens=300
-        )
+        response = await ocr_vision_request(prompt, receipt, max_tokens=300)
         
-        result = response.choices[0].message.content.strip()
-        logger.info(f"USDT Received OCR raw response: {result[:200]}...")
+        result = response.strip()
+        ocr_log.info("USDT Received OCR raw response: %.200s...", result)
         
         # Extract JSON from response
         result = re.sub(r'```json\s*|\s*```', '', result)
@@ -1427,11 +3998,11 @@ CRITICAL:
         if json_start != -1 and json_end != -1:
             result = result[json_start:json_end + 1]
         else:
-            logger.warning(f"No JSON found in USDT Received OCR response: {result}")
+            ocr_log.warning("No JSON found in USDT Received OCR response: %s", result)
             return None
         
         if not result or result == '':
-            logger.warning("Empty result after JSON extraction")
+            ocr_log.warning("Empty result after JSON extraction")
             return None
         
         data = json.loads(result)
@@ -1454,20 +4025,20 @@ CRITICAL:
             'bank_type': bank_type
         }
         
-        logger.info(f"USDT Received OCR: {result_data}")
+        ocr_log.info("USDT Received OCR: %s", result_data)
         return result_data
     
     except Exception as e:
-        logger.error(f"USDT Received OCR error: {e}")
+        ocr_log.error("USDT Received OCR error: %s", e)
 
-        logger.error(traceback.format_exc())
+        ocr_log.error(traceback.format_exc())
         return None
 
-async def ocr_match_mmk_receipt_to_banks(image_base64, mmk_banks_list):
+async def ocr_match_mmk_receipt_to_banks(receipt, mmk_banks_list):
     """Match MMK receipt to registered banks with confidence scores
     
     Args:
-        image_base64: Base64 encoded receipt image
+        receipt: ReceiptBuffer with the receipt image
         mmk_banks_list: List of dicts with 'bank_id', 'bank_name', 'account_number', 'account_holder'
     
     Returns:
@@ -1549,19 +4120,9 @@ IMPORTANT:
 - DO NOT use trailing commas
 - ONLY ONE bank should have high confidence (the matching one)"""
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + image_base64}}
-                ]
-            }],
-            max_tokens=400
-        )
+        response = await ocr_vision_request(prompt, receipt, max_tokens=400)
         
-        result = response.choices[0].message.content.strip()
+        result = response.strip()
         
         # Remove markdown code blocks
         result = re.sub(r'```json\s*|\s*```', '', result)
@@ -1584,7 +4145,7 @@ IMPORTANT:
         result = re.sub(r'(\{|,)\s*(\d+)\s*:', r'\1"\2":', result)
         
         # Log the cleaned JSON for debugging
-        logger.info(f"Cleaned JSON for parsing: {result[:200]}...")
+        ocr_log.info("Cleaned JSON for parsing: %.200s...", result)
         
         data = json.loads(result)
         
@@ -1601,22 +4162,22 @@ IMPORTANT:
         data['banks'] = banks_confidence
         
         # Log results
-        logger.info(f"OCR Amount: {data['amount']}")
+        ocr_log.info("OCR Amount: %s", data['amount'])
         for bank_id, confidence in banks_confidence.items():
-            logger.info(f"  Bank ID {bank_id}: {confidence}% confidence")
+            ocr_log.info("  Bank ID %s: %s%% confidence", bank_id, confidence)
         
         return data
     
     except Exception as e:
-        logger.error(f"OCR bank matching error: {e}")
-        logger.error(traceback.format_exc())
+        ocr_log.error("OCR bank matching error: %s", e)
+        ocr_log.error(traceback.format_exc())
         return None
 
-async def ocr_match_usdt_receipt_to_banks(image_base64, usdt_banks_list):
+async def ocr_match_usdt_receipt_to_banks(receipt, usdt_banks_list):
     """Match USDT receipt to registered USDT banks with confidence scores
     
     Args:
-        image_base64: Base64 encoded receipt image
+        receipt: ReceiptBuffer with the receipt image
         usdt_banks_list: List of dicts with 'bank_id', 'bank_name', 'wallet_address', 'network'
     
     Returns:
@@ -1702,19 +4263,9 @@ IMPORTANT:
 - ONLY ONE bank should have high confidence (the matching one)
 - For 0x addresses with low fee (~$0.5), match to BNB not ETH"""
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + image_base64}}
-                ]
-            }],
-            max_tokens=400
-        )
+        response = await ocr_vision_request(prompt, receipt, max_tokens=400)
         
-        result = response.choices[0].message.content.strip()
+        result = response.strip()
         
         # Remove markdown code blocks
         result = re.sub(r'```json\s*|\s*```', '', result)
@@ -1733,7 +4284,7 @@ IMPORTANT:
         # Fix unquoted numeric keys
         result = re.sub(r'(\{|,)\s*(\d+)\s*:', r'\1"\2":', result)
         
-        logger.info(f"Cleaned USDT OCR JSON: {result[:200]}...")
+        ocr_log.info("Cleaned USDT OCR JSON: %.200s...", result)
         
         data = json.loads(result)
         
@@ -1750,15 +4301,15 @@ IMPORTANT:
         data['banks'] = banks_confidence
         
         # Log results
-        logger.info(f"USDT OCR Amount: {data['amount']}")
+        ocr_log.info("USDT OCR Amount: %s", data['amount'])
         for bank_id, confidence in banks_confidence.items():
-            logger.info(f"  Bank ID {bank_id}: {confidence}% confidence")
+            ocr_log.info("  Bank ID %s: %s%% confidence", bank_id, confidence)
         
         return data
     
     except Exception as e:
-        logger.error(f"USDT OCR bank matching error: {e}")
-        logger.error(traceback.format_exc())
+        ocr_log.error("USDT OCR bank matching error: %s", e)
+        ocr_log.error(traceback.format_exc())
         return None
 
 # ============================================================================
@@ -1931,6 +4482,8 @@ def extract_transaction_info(text):
     
     return {'type': tx_type, 'usdt': usdt_amount, 'mmk': mmk_amount}
 
+@idempotent('buy')
+@admitted('staff_reply')
 async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE, tx_info: dict):
     """BUY: Customer buys USDT from us, we send MMK to customer
     
@@ -1979,9 +4532,8 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
         
         # Get photo and OCR as USDT receipt
         photo = message.photo[-1]
-        photo_file = await context.bot.get_file(photo.file_id)
-        photo_bytes = await photo_file.download_as_bytearray()
-        photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+        photo_bytes = await download_photo(context, photo)
+        photo_receipt = ReceiptBuffer(photo_bytes)
         
         # Get all registered USDT banks for matching
         registered_usdt_banks = get_all_usdt_bank_accounts()
@@ -2001,7 +4553,7 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
             })
         
         # OCR USDT receipt - match to registered banks
-        usdt_match_result = await ocr_match_usdt_receipt_to_banks(photo_base64, usdt_banks_for_ocr)
+        usdt_match_result = await ocr_match_usdt_receipt_to_banks(photo_receipt, usdt_banks_for_ocr)
         
         detected_usdt = tx_info['usdt']  # Default to message amount
         detected_usdt_bank = None
@@ -2057,7 +4609,7 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
         # No staff prefix required for sale message
         sale_message_id = message.message_id
         
-        pending_transactions[sale_message_id] = {
+        pending_transactions.put(sale_message_id, {
             'type': 'buy',
             'detected_usdt': detected_usdt,
             'detected_usdt_bank': detected_usdt_bank['bank_name'],
@@ -2065,7 +4617,7 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
             'expected_usdt': tx_info['usdt'],
             'sender_id': user_id,
             'sender_name': sender_name
-        }
+        }, media_group_id=message.media_group_id)
         
         # Save to database for persistence
         save_sale_receipt_ocr(
@@ -2104,12 +4656,11 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
         
         # Get photo and OCR as MMK receipt
         photo = message.photo[-1]
-        photo_file = await context.bot.get_file(photo.file_id)
-        photo_bytes = await photo_file.download_as_bytearray()
-        photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+        photo_bytes = await download_photo(context, photo)
+        photo_receipt = ReceiptBuffer(photo_bytes)
         
         # OCR MMK receipt - for BUY, staff sends MMK so we check staff's banks
-        result = await ocr_detect_mmk_bank_and_amount(photo_base64, balances['mmk_banks'], user_prefix)
+        result = await ocr_detect_mmk_bank_and_amount(photo_receipt, balances['mmk_banks'], user_prefix)
         
         if not result:
             await send_alert(message, "❌ Cannot read MMK receipt", context)
@@ -2144,9 +4695,8 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
         elif original_message.photo:
             # OCR the original USDT receipt - match to registered banks
             orig_photo = original_message.photo[-1]
-            orig_file = await context.bot.get_file(orig_photo.file_id)
-            orig_bytes = await orig_file.download_as_bytearray()
-            orig_base64 = base64.b64encode(orig_bytes).decode('utf-8')
+            orig_bytes = await download_photo(context, orig_photo)
+            orig_receipt = ReceiptBuffer(orig_bytes)
             
             # Get registered USDT banks
             registered_usdt_banks = get_all_usdt_bank_accounts()
@@ -2160,7 +4710,7 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
                         'network': bank['network']
                     })
                 
-                usdt_match_result = await ocr_match_usdt_receipt_to_banks(orig_base64, usdt_banks_for_ocr)
+                usdt_match_result = await ocr_match_usdt_receipt_to_banks(orig_receipt, usdt_banks_for_ocr)
                 if usdt_match_result and usdt_match_result['amount'] > 0:
                     detected_usdt = usdt_match_result['amount']
                     
@@ -2195,10 +4745,14 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
                 parse_mode='HTML'
             )
         
-        # Check if sufficient MMK balance
-        bank_found = False
-        for bank in balances['mmk_banks']:
-            if banks_match(bank['bank_name'], detected_bank['bank_name']):
+        async with ledger_lock:
+            # Re-read under the lock: a balance may have been loaded since
+            balances = context.chat_data['balances']
+            
+            # Check if sufficient MMK balance
+            bank_found = False
+            bank = balances.find('mmk_banks', detected_bank['bank_name'])
+            if bank:
                 bank_found = True
                 if bank['amount'] < total_mmk:
                     await send_alert(message, 
@@ -2208,44 +4762,30 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
                         context)
                     return
                 bank['amount'] -= total_mmk
-                logger.info(f"Reduced {total_mmk:,.0f} MMK from {bank['bank_name']}")
-                break
-        
-        if not bank_found:
-            await send_alert(message, f"❌ Bank not found: {detected_bank['bank_name']}", context)
-            return
-        
-        # Add USDT to the detected receiving bank (from customer's receipt)
-        # If no bank detected, fall back to default receiving account
-        receiving_usdt_account = detected_usdt_bank_name if detected_usdt_bank_name else get_receiving_usdt_account()
-        usdt_updated = False
-        
-        for bank in balances['usdt_banks']:
-            if banks_match(bank['bank_name'], receiving_usdt_account):
+                logger.info("Reduced %s MMK from %s", format(total_mmk, ',.0f'), bank['bank_name'])
+            
+            if not bank_found:
+                await send_alert(message, f"❌ Bank not found: {detected_bank['bank_name']}", context)
+                return
+            
+            # Add USDT to the detected receiving bank (from customer's receipt)
+            # If no bank detected, fall back to default receiving account
+            receiving_usdt_account = detected_usdt_bank_name if detected_usdt_bank_name else get_receiving_usdt_account()
+            usdt_updated = False
+            
+            bank = balances.find('usdt_banks', receiving_usdt_account)
+            if bank:
                 bank['amount'] += detected_usdt
                 usdt_updated = True
-                logger.info(f"Added {detected_usdt:.4f} USDT to {receiving_usdt_account}")
-                break
-        
-        if not usdt_updated:
-            await send_alert(message, f"⚠️ USDT account '{receiving_usdt_account}' not found in balance", context)
-        
-        # Send new balance
-        new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-        
-        if AUTO_BALANCE_TOPIC_ID:
-            await context.bot.send_message(
-                chat_id=TARGET_GROUP_ID,
-                message_thread_id=AUTO_BALANCE_TOPIC_ID,
-                text=new_balance
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=TARGET_GROUP_ID,
-                text=new_balance
-            )
+                logger.info("Added %.4f USDT to %s", detected_usdt, receiving_usdt_account)
+            
+            if not usdt_updated:
+                await send_alert(message, f"⚠️ USDT account '{receiving_usdt_account}' not found in balance", context)
+            
+            context.chat_data['balances'] = balances
         
-        context.chat_data['balances'] = balances
+        # Publish new balance (coalesced with other updates in the same window)
+        await publish_balance(context)
         
         # Send success message
         await send_status_message(
@@ -2254,7 +4794,10 @@ async def process_buy_transaction(update: Update, context: ContextTypes.DEFAULT_
             parse_mode='HTML'
         )
         
-async def ocr_detect_mmk_bank_multi(image_base64, mmk_banks):
+        # Sale is settled
+        pending_transactions.pop(original_message_id, original_message.media_group_id)
+        
+async def ocr_detect_mmk_bank_multi(receipt, mmk_banks):
     """Detect MMK bank and amount from receipt, matching against ALL registered MMK banks
     
     This function is used for SELL transactions where the receipt is from a customer
@@ -2287,19 +4830,9 @@ Extract:
 Return JSON:
 {{"amount": <integer>, "bank_number": <1-{len(mmk_banks)}>}}"""
 
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + image_base64}}
-                    ]
-                }],
-                max_tokens=300
-            )
+            response = await ocr_vision_request(prompt, receipt, max_tokens=300)
             
-            result = response.choices[0].message.content.strip()
+            result = response.strip()
             result = re.sub(r'```json\s*|\s*```', '', result)
             
             json_start = result.find('{')
@@ -2317,14 +4850,15 @@ Return JSON:
             return None
         
         # Use confidence-based matching with registered accounts
+        # Index the balance rows once instead of rescanning them per registered account
+        mmk_index = {}
+        for bank in mmk_banks:
+            mmk_index.setdefault(normalize_bank_name(bank['bank_name']), bank)
+        
         mmk_banks_with_ids = []
         for idx, acc in enumerate(registered_accounts):
             # Find matching bank in balances
-            matching_bank = None
-            for bank in mmk_banks:
-                if banks_match(bank['bank_name'], acc['bank_name']):
-                    matching_bank = bank
-                    break
+            matching_bank = mmk_index.get(normalize_bank_name(acc['bank_name']))
             
             if matching_bank:
                 mmk_banks_with_ids.append({
@@ -2336,11 +4870,11 @@ Return JSON:
                 })
         
         if not mmk_banks_with_ids:
-            logger.warning("No matching banks found between registered accounts and balance")
+            ocr_log.warning("No matching banks found between registered accounts and balance")
             return None
         
         # OCR with confidence matching
-        match_result = await ocr_match_mmk_receipt_to_banks(image_base64, mmk_banks_with_ids)
+        match_result = await ocr_match_mmk_receipt_to_banks(receipt, mmk_banks_with_ids)
         
         if not match_result:
             return None
@@ -2367,12 +4901,12 @@ Return JSON:
         return None
     
     except Exception as e:
-        logger.error(f"OCR multi-bank error: {e}")
-        logger.error(traceback.format_exc())
+        ocr_log.error("OCR multi-bank error: %s", e)
+        ocr_log.error(traceback.format_exc())
         return None
 
 
-async def ocr_detect_mmk_banks_multiple(image_base64_list, mmk_banks):
+async def ocr_detect_mmk_banks_multiple(receipts, mmk_banks):
     """Detect MMK banks and amounts from multiple receipts
     
     This function processes multiple receipt images and returns all detected
@@ -2380,7 +4914,7 @@ async def ocr_detect_mmk_banks_multiple(image_base64_list, mmk_banks):
     money to multiple banks.
     
     Args:
-        image_base64_list: List of base64 encoded images
+        receipts: List of ReceiptBuffer receipt images
         mmk_banks: List of MMK bank objects from balance
     
     Returns:
@@ -2395,17 +4929,18 @@ async def ocr_detect_mmk_banks_multiple(image_base64_list, mmk_banks):
     results = []
     total_amount = 0
     
-    for idx, image_base64 in enumerate(image_base64_list):
-        logger.info(f"Processing MMK receipt {idx + 1}/{len(image_base64_list)}")
+    for idx, receipt in enumerate(receipts):
+        ocr_log.info("Processing MMK receipt %s/%s", idx + 1, len(receipts))
         
-        result = await ocr_detect_mmk_bank_multi(image_base64, mmk_banks)
+        result = await ocr_detect_mmk_bank_multi(receipt, mmk_banks)
         
         if result and result['amount'] > 0:
             results.append(result)
             total_amount += result['amount']
-            logger.info(f"Receipt {idx + 1}: {result['amount']:,.0f} MMK from {result['bank']['bank_name']} (confidence: {result['confidence']}%)")
+            ocr_log.info("Receipt %s: %s MMK from %s (confidence: %s%%)",
+                         idx + 1, format(result['amount'], ',.0f'), result['bank']['bank_name'], result['confidence'])
         else:
-            logger.warning(f"Could not process receipt {idx + 1}")
+            ocr_log.warning("Could not process receipt %s", idx + 1)
     
     return {
         'total_amount': total_amount,
@@ -2413,6 +4948,8 @@ async def ocr_detect_mmk_banks_multiple(image_base64_list, mmk_banks):
     }
 
 
+@idempotent('sell')
+@admitted('staff_reply')
 async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE, tx_info: dict):
     """SELL: User sells USDT, we receive MMK (supports multiple receipts from media group)
     
@@ -2457,12 +4994,11 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
         
         # Get photo and OCR as MMK receipt - check against ALL registered banks (not staff-specific)
         photo = message.photo[-1]
-        photo_file = await context.bot.get_file(photo.file_id)
-        photo_bytes = await photo_file.download_as_bytearray()
-        photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+        photo_bytes = await download_photo(context, photo)
+        photo_receipt = ReceiptBuffer(photo_bytes)
         
         # OCR MMK receipt - match against ALL registered MMK banks
-        mmk_result = await ocr_detect_mmk_bank_multi(photo_base64, balances['mmk_banks'])
+        mmk_result = await ocr_detect_mmk_bank_multi(photo_receipt, balances['mmk_banks'])
         
         detected_mmk = 0
         detected_bank = None
@@ -2509,14 +5045,14 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
         # Store for later (no staff prefix required for sale message)
         sale_message_id = message.message_id
         
-        pending_transactions[sale_message_id] = {
+        pending_transactions.put(sale_message_id, {
             'type': 'sell',
             'detected_mmk': detected_mmk,
-            'detected_bank': detected_bank,
+            'detected_bank': detected_bank['bank_name'],
             'expected_usdt': tx_info['usdt'],
             'sender_id': user_id,
             'sender_name': sender_name
-        }
+        }, media_group_id=message.media_group_id)
         
         # Save to database for persistence
         save_sale_receipt_ocr(
@@ -2567,6 +5103,11 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
     media_group_id = original_message.media_group_id if original_message else None
     media_group_id_to_cleanup = None
     
+    # Bank specified in the staff reply (format: From San(Kpay P)); receipts are then only read for amounts
+    bank_match = re.search(r'From\s+([^(]+)\(([^)]+)\)', message.text or message.caption or "", re.IGNORECASE)
+    specified_bank_name = f"{bank_match.group(1).strip()}({bank_match.group(2).strip()})" if bank_match else None
+    specified_bank = balances.find('mmk_banks', specified_bank_name) if bank_match else None
+    
     # ============================================================================
     # CHECK FOR PRE-SCANNED OCR DATA
     # ============================================================================
@@ -2595,10 +5136,7 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
                 # Get bank from first record with bank info
                 if not detected_bank and ocr_record['detected_bank']:
                     # Find the bank object in balances
-                    for bank in balances['mmk_banks']:
-                        if banks_match(bank['bank_name'], ocr_record['detected_bank']):
-                            detected_bank = bank
-                            break
+                    detected_bank = balances.find('mmk_banks', ocr_record['detected_bank'])
                 
                 logger.info(f"Pre-scanned receipt: {ocr_record['detected_amount']:,.0f} MMK, bank={ocr_record['detected_bank']}")
         
@@ -2640,9 +5178,8 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
         if not photo_data_list:
             logger.info(f"Processing single photo from original message")
             user_photo = original_message.photo[-1]
-            user_file = await context.bot.get_file(user_photo.file_id)
-            user_bytes = await user_file.download_as_bytearray()
-            photo_data_list = [(original_message_id, bytes(user_bytes))]
+            user_bytes = await download_photo(context, user_photo)
+            photo_data_list = [(original_message_id, user_bytes)]
         
         # If staff specified a bank in text, only extract amount from receipts (don't detect bank)
         if specified_bank:
@@ -2656,12 +5193,12 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
                 if isinstance(data, str):
                     with open(data, 'rb') as f:
                         photo_bytes = f.read()
-                    user_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+                    user_receipt = ReceiptBuffer(photo_bytes)
                 else:
-                    user_base64 = base64.b64encode(data).decode('utf-8')
+                    user_receipt = ReceiptBuffer(data)
                 
                 # Use OCR to extract only amount (not bank detection)
-                user_result = await ocr_detect_mmk_bank_multi(user_base64, balances['mmk_banks'])
+                user_result = await ocr_detect_mmk_bank_multi(user_receipt, balances['mmk_banks'])
                 
                 if not user_result or not user_result['amount']:
                     logger.warning(f"Could not extract amount from MMK receipt {idx}")
@@ -2686,12 +5223,12 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
                 if isinstance(data, str):
                     with open(data, 'rb') as f:
                         photo_bytes = f.read()
-                    user_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+                    user_receipt = ReceiptBuffer(photo_bytes)
                 else:
-                    user_base64 = base64.b64encode(data).decode('utf-8')
+                    user_receipt = ReceiptBuffer(data)
                 
                 # Use multi-bank detection for SELL transactions (not staff-specific)
-                user_result = await ocr_detect_mmk_bank_multi(user_base64, balances['mmk_banks'])
+                user_result = await ocr_detect_mmk_bank_multi(user_receipt, balances['mmk_banks'])
                 
                 if not user_result or not user_result['amount']:
                     logger.warning(f"Could not process MMK receipt {idx}")
@@ -2714,36 +5251,23 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
     
     logger.info(f"Total MMK from {receipt_count} receipt(s): {total_detected_mmk:,.0f} MMK")
     
-    # Check if staff reply contains fee (format: fee-3039) and bank specification (format: From San(Kpay P))
+    # Check if staff reply contains fee (format: fee-3039); the bank specification was read above
     staff_reply_text = message.text or message.caption or ""
     mmk_fee = 0
-    specified_bank = None
     
     fee_match = re.search(r'fee\s*-\s*([\d,]+(?:\.\d+)?)', staff_reply_text, re.IGNORECASE)
     if fee_match:
         mmk_fee = float(fee_match.group(1).replace(',', ''))
         logger.info(f"Detected MMK fee in staff reply: {mmk_fee:,.0f} MMK")
     
-    # Check for bank specification in format: From San(Kpay P)
-    bank_match = re.search(r'From\s+([^(]+)\(([^)]+)\)', staff_reply_text, re.IGNORECASE)
-    if bank_match:
-        prefix = bank_match.group(1).strip()
-        bank_name = bank_match.group(2).strip()
-        specified_bank_name = f"{prefix}({bank_name})"
-        
-        # Find the matching bank in balances
-        for bank in balances['mmk_banks']:
-            if banks_match(bank['bank_name'], specified_bank_name):
-                specified_bank = bank
-                logger.info(f"Staff specified bank: {specified_bank_name} -> matched {bank['bank_name']}")
-                break
-        
-        if not specified_bank:
-            await send_alert(message, f"❌ Specified bank '{specified_bank_name}' not found in registered MMK banks", context)
-            if media_group_id_to_cleanup:
-                delete_media_group_photos(media_group_id_to_cleanup)
-            return
-    
+    if specified_bank:
+        logger.info("Staff specified bank: %s -> matched %s", specified_bank_name, specified_bank['bank_name'])
+    elif bank_match:
+        await send_alert(message, f"❌ Specified bank '{specified_bank_name}' not found in registered MMK banks", context)
+        if media_group_id_to_cleanup:
+            delete_media_group_photos(media_group_id_to_cleanup)
+        return
+
     # Add fee to detected MMK amount
     total_mmk = total_detected_mmk + mmk_fee
     
@@ -2767,11 +5291,10 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
     # OCR USDT RECEIPT (CURRENT MESSAGE)
     # ============================================================================
     staff_photo = message.photo[-1]
-    staff_file = await context.bot.get_file(staff_photo.file_id)
-    staff_bytes = await staff_file.download_as_bytearray()
-    staff_base64 = base64.b64encode(staff_bytes).decode('utf-8')
+    staff_bytes = await download_photo(context, staff_photo)
+    staff_receipt = ReceiptBuffer(staff_bytes)
     
-    usdt_result = await ocr_extract_usdt_with_fee(staff_base64)
+    usdt_result = await ocr_extract_usdt_with_fee(staff_receipt)
     
     if not usdt_result:
         await send_alert(message, "❌ Cannot read USDT receipt", context)
@@ -2787,22 +5310,25 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
     # ============================================================================
     # UPDATE BALANCES
     # ============================================================================
-    # Add MMK to detected bank
-    for bank in balances['mmk_banks']:
-        if banks_match(bank['bank_name'], detected_bank['bank_name']):
+    async with ledger_lock:
+        # Re-read under the lock: a balance may have been loaded since
+        balances = context.chat_data['balances']
+        
+        # Add MMK to detected bank
+        bank = balances.find('mmk_banks', detected_bank['bank_name'])
+        if bank:
             bank['amount'] += total_mmk
-            logger.info(f"Added {total_mmk:,.0f} MMK to {bank['bank_name']}")
-            break
-    
-    # Reduce USDT from staff's account
-    usdt_updated = False
-    bank_type_capitalized = bank_type.capitalize()
-    expected_bank_name = f"{user_prefix}({bank_type_capitalized})"
-    
-    logger.info(f"Looking for USDT bank: {expected_bank_name}")
-    
-    for bank in balances['usdt_banks']:
-        if banks_match(bank['bank_name'], expected_bank_name):
+            logger.info("Added %s MMK to %s", format(total_mmk, ',.0f'), bank['bank_name'])
+        
+        # Reduce USDT from staff's account
+        usdt_updated = False
+        bank_type_capitalized = bank_type.capitalize()
+        expected_bank_name = f"{user_prefix}({bank_type_capitalized})"
+        
+        logger.info("Looking for USDT bank: %s", expected_bank_name)
+        
+        bank = balances.find('usdt_banks', expected_bank_name)
+        if bank:
             if bank['amount'] < detected_usdt:
                 await send_alert(message, 
                     f"❌ Insufficient USDT balance!\n\n"
@@ -2814,28 +5340,15 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
                 return
             bank['amount'] -= detected_usdt
             usdt_updated = True
-            logger.info(f"Reduced {detected_usdt:.4f} USDT from {bank['bank_name']}")
-            break
-    
-    if not usdt_updated:
-        await send_alert(message, f"⚠️ USDT bank '{expected_bank_name}' not found", context)
-    
-    # Send new balance
-    new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-    
-    if AUTO_BALANCE_TOPIC_ID:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            message_thread_id=AUTO_BALANCE_TOPIC_ID,
-            text=new_balance
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            text=new_balance
-        )
+            logger.info("Reduced %.4f USDT from %s", detected_usdt, bank['bank_name'])
+        
+        if not usdt_updated:
+            await send_alert(message, f"⚠️ USDT bank '{expected_bank_name}' not found", context)
+        
+        context.chat_data['balances'] = balances
     
-    context.chat_data['balances'] = balances
+    # Publish new balance (coalesced with other updates in the same window)
+    await publish_balance(context)
     
     # Send success message
     mmk_display = f"{total_mmk:,.0f}"
@@ -2853,8 +5366,7 @@ async def process_sell_transaction(update: Update, context: ContextTypes.DEFAULT
     )
     
     # Clean up
-    if original_message_id in pending_transactions:
-        del pending_transactions[original_message_id]
+    pending_transactions.pop(original_message_id, original_message.media_group_id if original_message else None)
     if media_group_id_to_cleanup:
         delete_media_group_photos(media_group_id_to_cleanup)
 
@@ -2901,57 +5413,45 @@ async def process_coin_transfer(update: Update, context: ContextTypes.DEFAULT_TY
         
         logger.info(f"Coin transfer detected: {from_full_name} -> {to_full_name}, Sent: {sent_amount} USDT, Fee: {fee_amount} USDT, Received: {received_amount} USDT")
         
-        # Find source and destination banks in USDT banks
-        from_bank_obj = None
-        to_bank_obj = None
-        
-        for bank in balances['usdt_banks']:
-            if banks_match(bank['bank_name'], from_full_name):
-                from_bank_obj = bank
-            if banks_match(bank['bank_name'], to_full_name):
-                to_bank_obj = bank
-        
-        if not from_bank_obj:
-            await send_alert(message, f"❌ Source USDT account not found: {from_full_name}", context)
-            return
-        
-        if not to_bank_obj:
-            await send_alert(message, f"❌ Destination USDT account not found: {to_full_name}", context)
-            return
-        
-        # Check if sufficient balance in source account
-        if from_bank_obj['amount'] < sent_amount:
-            logger.error(f"Insufficient USDT balance! {from_full_name}: {from_bank_obj['amount']:.4f} USDT, Required: {sent_amount:.4f} USDT")
-            await send_alert(message, 
-                f"❌ Insufficient USDT balance!\n"
-                f"{from_full_name}: {from_bank_obj['amount']:.4f} USDT\n"
-                f"Required: {sent_amount:.4f} USDT\n"
-                f"Shortage: {sent_amount - from_bank_obj['amount']:.4f} USDT", 
-                context)
-            return
-        
-        # Process coin transfer
-        from_bank_obj['amount'] -= sent_amount
-        to_bank_obj['amount'] += received_amount
-        
-        logger.info(f"Coin transfer processed: -{sent_amount:.4f} from {from_full_name}, +{received_amount:.4f} to {to_full_name}")
-        
-        # Send new balance to auto balance topic
-        new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-        
-        if AUTO_BALANCE_TOPIC_ID:
-            await context.bot.send_message(
-                chat_id=TARGET_GROUP_ID,
-                message_thread_id=AUTO_BALANCE_TOPIC_ID,
-                text=new_balance
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=TARGET_GROUP_ID,
-                text=new_balance
-            )
+        async with ledger_lock:
+            # Re-read under the lock: a balance may have been loaded since
+            balances = context.chat_data['balances']
+            
+            # Find source and destination banks in USDT banks
+            from_bank_obj = balances.find('usdt_banks', from_full_name)
+            to_bank_obj = balances.find('usdt_banks', to_full_name)
+            
+            if not from_bank_obj:
+                await send_alert(message, f"❌ Source USDT account not found: {from_full_name}", context)
+                return
+            
+            if not to_bank_obj:
+                await send_alert(message, f"❌ Destination USDT account not found: {to_full_name}", context)
+                return
+            
+            # Check if sufficient balance in source account
+            if from_bank_obj['amount'] < sent_amount:
+                logger.error("Insufficient USDT balance! %s: %.4f USDT, Required: %.4f USDT",
+                             from_full_name, from_bank_obj['amount'], sent_amount)
+                await send_alert(message, 
+                    f"❌ Insufficient USDT balance!\n"
+                    f"{from_full_name}: {from_bank_obj['amount']:.4f} USDT\n"
+                    f"Required: {sent_amount:.4f} USDT\n"
+                    f"Shortage: {sent_amount - from_bank_obj['amount']:.4f} USDT", 
+                    context)
+                return
+            
+            # Process coin transfer
+            from_bank_obj['amount'] -= sent_amount
+            to_bank_obj['amount'] += received_amount
+            
+            logger.info("Coin transfer processed: -%.4f from %s, +%.4f to %s",
+                        sent_amount, from_full_name, received_amount, to_full_name)
+            
+            context.chat_data['balances'] = balances
         
-        context.chat_data['balances'] = balances
+        # Publish new balance (coalesced with other updates in the same window)
+        await publish_balance(context)
         
         # Send success message to alert topic
         await send_status_message(
@@ -2965,11 +5465,12 @@ async def process_coin_transfer(update: Update, context: ContextTypes.DEFAULT_TY
     
     return False
 
+@idempotent('internal_transfer')
 async def process_internal_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Process internal bank transfers in Accounts Matter topic
     Format: San(Wave Channel) to NDT (Wave)
     
-    Supports multiple receipts (media groups) - collects photos in memory and processes together.
+    Supports multiple receipts (media groups) - collects photos in a queued job and processes together.
     """
     message = update.message
     balances = context.chat_data.get('balances')
@@ -3010,48 +5511,19 @@ async def process_internal_transfer(update: Update, context: ContextTypes.DEFAUL
     
     # Check if this is a media group (multiple receipts)
     if message.media_group_id:
-        # Store in context for collecting photos
-        if 'internal_transfer_media_groups' not in context.chat_data:
-            context.chat_data['internal_transfer_media_groups'] = {}
-        
-        # Initialize or check if already processing
-        if message.media_group_id not in context.chat_data['internal_transfer_media_groups']:
-            context.chat_data['internal_transfer_media_groups'][message.media_group_id] = {
-                'photos': [message.photo[-1]],
+        # Persist the group and process it once all photos are in (8 seconds);
+        # later photos of the album are added to the queued job
+        job_key = album_job_key('internal_transfer_album', message)
+        photo_count = append_ocr_job_photo(job_key, message.photo[-1].to_dict())
+        if photo_count is None:
+            enqueue_ocr_job('internal_transfer_album', job_key, {
+                'update': update.to_dict(),
                 'from_full_name': from_full_name,
                 'to_full_name': to_full_name,
-                'message': message,
-                'update': update
-            }
-            logger.info(f"   📷 Internal transfer media group detected, stored first photo")
-            
-            # Schedule delayed processing
-            async def process_internal_transfer_delayed():
-                await asyncio.sleep(8.0)  # Wait 8 seconds for all photos
-                
-                mg_data = context.chat_data.get('internal_transfer_media_groups', {}).get(message.media_group_id)
-                if not mg_data:
-                    return
-                
-                photos = mg_data['photos']
-                logger.info(f"   🔄 Processing internal transfer with {len(photos)} receipts")
-                
-                await process_internal_transfer_with_photos(
-                    update, context, 
-                    mg_data['from_full_name'], 
-                    mg_data['to_full_name'], 
-                    photos
-                )
-                
-                # Clean up
-                if message.media_group_id in context.chat_data.get('internal_transfer_media_groups', {}):
-                    del context.chat_data['internal_transfer_media_groups'][message.media_group_id]
-            
-            asyncio.create_task(process_internal_transfer_delayed())
+                'photos': [message.photo[-1].to_dict()]
+            }, delay=8.0, max_attempts=3)
+            logger.info("   📷 Internal transfer media group detected, queued with first photo")
         else:
-            # Add photo to existing group
-            context.chat_data['internal_transfer_media_groups'][message.media_group_id]['photos'].append(message.photo[-1])
-            photo_count = len(context.chat_data['internal_transfer_media_groups'][message.media_group_id]['photos'])
             logger.info(f"   📷 Added photo to internal transfer group (total: {photo_count})")
         return
     
@@ -3059,6 +5531,8 @@ async def process_internal_transfer(update: Update, context: ContextTypes.DEFAUL
     await process_internal_transfer_with_photos(update, context, from_full_name, to_full_name, [message.photo[-1]])
 
 
+@idempotent('internal_transfer_photos')
+@admitted('internal_transfer')
 async def process_internal_transfer_with_photos(update: Update, context: ContextTypes.DEFAULT_TYPE, 
                                                   from_full_name: str, to_full_name: str, photos: list):
     """Process internal transfer with photos collected in memory
@@ -3089,9 +5563,8 @@ async def process_internal_transfer_with_photos(update: Update, context: Context
         logger.info(f"Processing internal transfer receipt {idx}/{len(photos)}")
         
         try:
-            photo_file = await context.bot.get_file(photo.file_id)
-            photo_bytes = await photo_file.download_as_bytearray()
-            photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+            photo_bytes = await download_photo(context, photo)
+            photo_receipt = ReceiptBuffer(photo_bytes)
             
             if is_usdt_transfer:
                 # For USDT transfers
@@ -3099,7 +5572,7 @@ async def process_internal_transfer_with_photos(update: Update, context: Context
                 to_is_binance = 'binance' in to_full_name.lower()
                 
                 if from_is_swift_wallet or to_is_binance:
-                    usdt_result = await ocr_extract_usdt_with_fee(photo_base64)
+                    usdt_result = await ocr_extract_usdt_with_fee(photo_receipt)
                     if usdt_result:
                         if from_is_swift_wallet:
                             amount = usdt_result['total_amount']
@@ -3114,19 +5587,9 @@ async def process_internal_transfer_with_photos(update: Update, context: Context
 Return JSON: {"amount": <number>}
 Note: Return the amount as a positive number, ignore any minus signs."""
 
-                    response = client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=[{
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + photo_base64}}
-                            ]
-                        }],
-                        max_tokens=200
-                    )
+                    response = await ocr_vision_request(prompt, photo_receipt, max_tokens=200)
                     
-                    result = response.choices[0].message.content.strip()
+                    result = response.strip()
                     result = re.sub(r'```json\s*|\s*```', '', result)
                     json_start = result.find('{')
                     json_end = result.rfind('}')
@@ -3143,19 +5606,9 @@ Note: Return the amount as a positive number, ignore any minus signs."""
 Return JSON: {"amount": <number>}
 Note: Return the amount as a positive number, ignore any minus signs."""
 
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[{
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + photo_base64}}
-                        ]
-                    }],
-                    max_tokens=200
-                )
+                response = await ocr_vision_request(prompt, photo_receipt, max_tokens=200)
                 
-                result = response.choices[0].message.content.strip()
+                result = response.strip()
                 result = re.sub(r'```json\s*|\s*```', '', result)
                 json_start = result.find('{')
                 json_end = result.rfind('}')
@@ -3177,56 +5630,40 @@ Note: Return the amount as a positive number, ignore any minus signs."""
     
     logger.info(f"Internal transfer: Total {total_amount:,.2f} from {receipt_count} receipt(s)")
     
-    # Find source and destination banks
-    from_bank_obj = None
-    to_bank_obj = None
-    
-    all_banks = balances['mmk_banks'] + balances['usdt_banks'] + balances.get('thb_banks', [])
-    
-    for bank in all_banks:
-        if banks_match(bank['bank_name'], from_full_name):
-            from_bank_obj = bank
-        if banks_match(bank['bank_name'], to_full_name):
-            to_bank_obj = bank
-    
-    if not from_bank_obj:
-        await send_alert(message, f"❌ Source bank not found: {from_full_name}", context)
-        return
-    
-    if not to_bank_obj:
-        await send_alert(message, f"❌ Destination bank not found: {to_full_name}", context)
-        return
-    
-    # Check if sufficient balance
-    if from_bank_obj['amount'] < total_amount:
-        await send_alert(message, 
-            f"❌ Insufficient balance for transfer!\n\n"
-            f"{from_full_name}: {from_bank_obj['amount']:,.2f}\n"
-            f"Required: {total_amount:,.2f}\n"
-            f"Shortage: {total_amount - from_bank_obj['amount']:,.2f}", 
-            context)
-        return
-    
-    # Process transfer
-    from_bank_obj['amount'] -= total_amount
-    to_bank_obj['amount'] += total_amount
-    
-    # Send new balance
-    new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-    
-    if AUTO_BALANCE_TOPIC_ID:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            message_thread_id=AUTO_BALANCE_TOPIC_ID,
-            text=new_balance
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            text=new_balance
-        )
+    async with ledger_lock:
+        # Re-read under the lock: a balance may have been loaded since
+        balances = context.chat_data['balances']
+        
+        # Find source and destination banks
+        from_bank_obj = balances.find_any(from_full_name)
+        to_bank_obj = balances.find_any(to_full_name)
+        
+        if not from_bank_obj:
+            await send_alert(message, f"❌ Source bank not found: {from_full_name}", context)
+            return
+        
+        if not to_bank_obj:
+            await send_alert(message, f"❌ Destination bank not found: {to_full_name}", context)
+            return
+        
+        # Check if sufficient balance
+        if from_bank_obj['amount'] < total_amount:
+            await send_alert(message, 
+                f"❌ Insufficient balance for transfer!\n\n"
+                f"{from_full_name}: {from_bank_obj['amount']:,.2f}\n"
+                f"Required: {total_amount:,.2f}\n"
+                f"Shortage: {total_amount - from_bank_obj['amount']:,.2f}", 
+                context)
+            return
+        
+        # Process transfer
+        from_bank_obj['amount'] -= total_amount
+        to_bank_obj['amount'] += total_amount
+        
+        context.chat_data['balances'] = balances
     
-    context.chat_data['balances'] = balances
+    # Publish new balance (coalesced with other updates in the same window)
+    await publish_balance(context)
     
     # Determine currency type
     currency = "MMK"
@@ -3253,30 +5690,12 @@ Note: Return the amount as a positive number, ignore any minus signs."""
 # MESSAGE HANDLERS
 # ============================================================================
 
-async def process_media_group_delayed(update: Update, context: ContextTypes.DEFAULT_TYPE, media_group_id: str):
-    """Process a media group after a short delay to ensure all photos are collected"""
-    
-    # Check if already being processed
-    if media_group_id in media_group_locks:
-        logger.info(f"Media group {media_group_id} is already being processed, skipping")
-        return
-    
-    # Mark as being processed
-    media_group_locks[media_group_id] = True
-    
-    # Wait for all photos to arrive
-    await asyncio.sleep(1.5)  # Wait 1.5 seconds for all photos to arrive
-    
-    if media_group_id not in media_groups:
-        logger.warning(f"Media group {media_group_id} not found")
-        if media_group_id in media_group_locks:
-            del media_group_locks[media_group_id]
-        return
-    
-    group_data = media_groups[media_group_id]
-    photos = group_data['photos']
-    message = group_data['message']
-    original_text = group_data['original_text']
+@idempotent('staff_album')
+@admitted('staff_reply')
+async def process_media_group(update: Update, context: ContextTypes.DEFAULT_TYPE, media_group_id: str,
+                              photos: list, original_text: str):
+    """Process a staff media group once all of its photos have been collected"""
+    message = update.message
     
     logger.info(f"Processing media group {media_group_id} with {len(photos)} photos")
     
@@ -3291,21 +5710,11 @@ async def process_media_group_delayed(update: Update, context: ContextTypes.DEFA
         except Exception as e:
             logger.error(f"Error processing staff P2P sell: {e}")
             logger.error(traceback.format_exc())
-        finally:
-            # Clean up media group
-            if media_group_id in media_groups:
-                del media_groups[media_group_id]
-            if media_group_id in media_group_locks:
-                del media_group_locks[media_group_id]
         return
     
     # Check if transaction type is valid (Buy or Sell)
     if not tx_info['type']:
         logger.info(f"❌ Original message is not a Buy/Sell transaction")
-        if media_group_id in media_groups:
-            del media_groups[media_group_id]
-        if media_group_id in media_group_locks:
-            del media_group_locks[media_group_id]
         return
     
     # Allow transactions with 0 or missing amounts - will use OCR to detect
@@ -3326,12 +5735,6 @@ async def process_media_group_delayed(update: Update, context: ContextTypes.DEFA
         logger.error(f"Error processing media group: {e}")
 
         logger.error(traceback.format_exc())
-    finally:
-        # Clean up media group
-        if media_group_id in media_groups:
-            del media_groups[media_group_id]
-        if media_group_id in media_group_locks:
-            del media_group_locks[media_group_id]
 
 async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE, tx_info: dict, photos: list, message):
     """Process BUY transaction with multiple photos sent as media group
@@ -3370,12 +5773,11 @@ async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEF
         for idx, photo in enumerate(photos, 1):
             logger.info(f"Processing USDT receipt {idx}/{len(photos)}")
             
-            photo_file = await context.bot.get_file(photo.file_id)
-            photo_bytes = await photo_file.download_as_bytearray()
-            photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+            photo_bytes = await download_photo(context, photo)
+            photo_receipt = ReceiptBuffer(photo_bytes)
             
             # OCR USDT receipt - detect RECEIVED amount only (no bank check needed for BUY)
-            usdt_result = await ocr_extract_usdt_received(photo_base64)
+            usdt_result = await ocr_extract_usdt_received(photo_receipt)
             
             if usdt_result and usdt_result['received_amount'] > 0:
                 detected_usdt = usdt_result['received_amount']
@@ -3406,7 +5808,7 @@ async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEF
         # Store for later (no staff prefix required for sale message)
         sale_message_id = message.message_id
         
-        pending_transactions[sale_message_id] = {
+        pending_transactions.put(sale_message_id, {
             'type': 'buy',
             'detected_usdt': total_detected_usdt,
             'expected_mmk': tx_info['mmk'],
@@ -3414,7 +5816,7 @@ async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEF
             'sender_id': user_id,
             'sender_name': sender_name,
             'receipt_count': len(photos)
-        }
+        }, media_group_id=message.media_group_id)
         
         # Send notification
         await send_status_message(
@@ -3459,11 +5861,10 @@ async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEF
         for idx, photo in enumerate(photos, 1):
             logger.info(f"Processing MMK receipt {idx}/{len(photos)}")
             
-            photo_file = await context.bot.get_file(photo.file_id)
-            photo_bytes = await photo_file.download_as_bytearray()
-            photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+            photo_bytes = await download_photo(context, photo)
+            photo_receipt = ReceiptBuffer(photo_bytes)
             
-            result = await ocr_detect_mmk_bank_and_amount(photo_base64, balances['mmk_banks'], user_prefix)
+            result = await ocr_detect_mmk_bank_and_amount(photo_receipt, balances['mmk_banks'], user_prefix)
             
             if result and result['amount']:
                 total_detected_mmk += result['amount']
@@ -3494,11 +5895,10 @@ async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEF
         elif original_message.photo:
             # OCR the original USDT receipt - detect RECEIVED amount
             orig_photo = original_message.photo[-1]
-            orig_file = await context.bot.get_file(orig_photo.file_id)
-            orig_bytes = await orig_file.download_as_bytearray()
-            orig_base64 = base64.b64encode(orig_bytes).decode('utf-8')
+            orig_bytes = await download_photo(context, orig_photo)
+            orig_receipt = ReceiptBuffer(orig_bytes)
             
-            usdt_result = await ocr_extract_usdt_received(orig_base64)
+            usdt_result = await ocr_extract_usdt_received(orig_receipt)
             if usdt_result and usdt_result['received_amount'] > 0:
                 detected_usdt = usdt_result['received_amount']
                 logger.info(f"Detected USDT RECEIVED from original receipt: {detected_usdt:.4f}")
@@ -3515,27 +5915,7 @@ async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEF
                 parse_mode='HTML'
             )
         
-        # Check if sufficient MMK balance
-        bank_found = False
-        for bank in balances['mmk_banks']:
-            if banks_match(bank['bank_name'], detected_bank['bank_name']):
-                bank_found = True
-                if bank['amount'] < total_mmk:
-                    await send_alert(message, 
-                        f"❌ Insufficient MMK balance!\n\n"
-                        f"{bank['bank_name']}: {bank['amount']:,.0f} MMK\n"
-                        f"Required: {total_mmk:,.0f} MMK", 
-                        context)
-                    return
-                bank['amount'] -= total_mmk
-                logger.info(f"Reduced {total_mmk:,.0f} MMK from {bank['bank_name']}")
-                break
-        
-        if not bank_found:
-            await send_alert(message, f"❌ Bank not found: {detected_bank['bank_name']}", context)
-            return
-        
-        # Add USDT to the detected receiving bank (from customer's receipt)
+        # Detect the receiving USDT bank (from customer's receipt) before touching balances
         # First check if we have stored OCR data with detected bank
         detected_usdt_bank_name = None
         if stored_ocr and stored_ocr[0].get('detected_bank'):
@@ -3557,11 +5937,10 @@ async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEF
                     })
                 
                 orig_photo = original_message.photo[-1]
-                orig_file = await context.bot.get_file(orig_photo.file_id)
-                orig_bytes = await orig_file.download_as_bytearray()
-                orig_base64 = base64.b64encode(orig_bytes).decode('utf-8')
+                orig_bytes = await download_photo(context, orig_photo)
+                orig_receipt = ReceiptBuffer(orig_bytes)
                 
-                usdt_match_result = await ocr_match_usdt_receipt_to_banks(orig_base64, usdt_banks_for_ocr)
+                usdt_match_result = await ocr_match_usdt_receipt_to_banks(orig_receipt, usdt_banks_for_ocr)
                 if usdt_match_result:
                     # Find the bank with highest confidence
                     banks_confidence = usdt_match_result.get('banks', {})
@@ -3580,47 +5959,58 @@ async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEF
                                 logger.info(f"Detected USDT bank from original receipt: {detected_usdt_bank_name}")
                                 break
         
-        # Use detected bank or fall back to first available USDT bank
-        receiving_usdt_account = detected_usdt_bank_name
-        if not receiving_usdt_account:
-            # Find first available USDT bank as fallback
-            for bank in balances['usdt_banks']:
-                receiving_usdt_account = bank['bank_name']
-                logger.info(f"No USDT bank detected, using first available: {receiving_usdt_account}")
-                break
-        
-        if not receiving_usdt_account:
-            await send_alert(message, "❌ No USDT banks available in balance", context)
-            return
-        
-        usdt_updated = False
-        
-        for bank in balances['usdt_banks']:
-            if banks_match(bank['bank_name'], receiving_usdt_account):
+        async with ledger_lock:
+            # Re-read under the lock: a balance may have been loaded since
+            balances = context.chat_data['balances']
+            
+            # Check if sufficient MMK balance
+            bank_found = False
+            bank = balances.find('mmk_banks', detected_bank['bank_name'])
+            if bank:
+                bank_found = True
+                if bank['amount'] < total_mmk:
+                    await send_alert(message, 
+                        f"❌ Insufficient MMK balance!\n\n"
+                        f"{bank['bank_name']}: {bank['amount']:,.0f} MMK\n"
+                        f"Required: {total_mmk:,.0f} MMK", 
+                        context)
+                    return
+                bank['amount'] -= total_mmk
+                logger.info("Reduced %s MMK from %s", format(total_mmk, ',.0f'), bank['bank_name'])
+            
+            if not bank_found:
+                await send_alert(message, f"❌ Bank not found: {detected_bank['bank_name']}", context)
+                return
+            
+            # Add USDT to the detected receiving bank
+            # Use detected bank or fall back to first available USDT bank
+            receiving_usdt_account = detected_usdt_bank_name
+            if not receiving_usdt_account:
+                # Find first available USDT bank as fallback
+                for bank in balances['usdt_banks']:
+                    receiving_usdt_account = bank['bank_name']
+                    logger.info("No USDT bank detected, using first available: %s", receiving_usdt_account)
+                    break
+            
+            if not receiving_usdt_account:
+                await send_alert(message, "❌ No USDT banks available in balance", context)
+                return
+            
+            usdt_updated = False
+            
+            bank = balances.find('usdt_banks', receiving_usdt_account)
+            if bank:
                 bank['amount'] += detected_usdt
                 usdt_updated = True
-                logger.info(f"Added {detected_usdt:.4f} USDT to {receiving_usdt_account}")
-                break
-        
-        if not usdt_updated:
-            await send_alert(message, f"⚠️ USDT account '{receiving_usdt_account}' not found", context)
-        
-        # Send new balance
-        new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-        
-        if AUTO_BALANCE_TOPIC_ID:
-            await context.bot.send_message(
-                chat_id=TARGET_GROUP_ID,
-                message_thread_id=AUTO_BALANCE_TOPIC_ID,
-                text=new_balance
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=TARGET_GROUP_ID,
-                text=new_balance
-            )
+                logger.info("Added %.4f USDT to %s", detected_usdt, receiving_usdt_account)
+            
+            if not usdt_updated:
+                await send_alert(message, f"⚠️ USDT account '{receiving_usdt_account}' not found", context)
+            
+            context.chat_data['balances'] = balances
         
-        context.chat_data['balances'] = balances
+        # Publish new balance (coalesced with other updates in the same window)
+        await publish_balance(context)
         
         # Send success message
         await send_status_message(
@@ -3629,6 +6019,9 @@ async def process_buy_transaction_bulk(update: Update, context: ContextTypes.DEF
             parse_mode='HTML'
         )
         
+        # Sale is settled
+        pending_transactions.pop(original_message_id, original_message.media_group_id)
+        
 async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE, tx_info: dict, photos: list, message):
     """Process SELL transaction with multiple photos sent as media group
     
@@ -3674,12 +6067,11 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
         for idx, photo in enumerate(photos, 1):
             logger.info(f"Processing MMK receipt {idx}/{len(photos)}")
             
-            photo_file = await context.bot.get_file(photo.file_id)
-            photo_bytes = await photo_file.download_as_bytearray()
-            photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+            photo_bytes = await download_photo(context, photo)
+            photo_receipt = ReceiptBuffer(photo_bytes)
             
             # OCR as MMK receipt - use multi-bank detection (not staff-specific)
-            mmk_result = await ocr_detect_mmk_bank_multi(photo_base64, balances['mmk_banks'])
+            mmk_result = await ocr_detect_mmk_bank_multi(photo_receipt, balances['mmk_banks'])
             
             if not mmk_result or not mmk_result['amount']:
                 logger.warning(f"Could not process MMK receipt {idx}")
@@ -3744,17 +6136,17 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
         # Store the OCR results for later use (no staff prefix required)
         sale_message_id = message.message_id
         
-        pending_transactions[sale_message_id] = {
+        pending_transactions.put(sale_message_id, {
             'type': 'sell',
             'mmk_amount': total_mmk,
             'mmk_receipts': total_detected_mmk,
             'mmk_fee': mmk_fee,
-            'mmk_bank': detected_bank,
+            'mmk_bank': detected_bank['bank_name'],
             'mmk_receipt_count': mmk_receipt_count,
             'expected_usdt': tx_info['usdt'],
             'sender_id': user_id,
             'sender_name': sender_name
-        }
+        }, media_group_id=message.media_group_id)
         
         # Send notification to alert topic
         await send_status_message(
@@ -3790,6 +6182,12 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
         original_message_id = original_message.message_id
         media_group_id_to_cleanup = None
         
+        # Bank specified in the staff reply (format: From San(Kpay P)); receipts are then only read for amounts
+        staff_text = message.text or message.caption or ""
+        bank_match = re.search(r'From\s+([^(]+)\(([^)]+)\)', staff_text, re.IGNORECASE)
+        specified_bank_name = f"{bank_match.group(1).strip()}({bank_match.group(2).strip()})" if bank_match else None
+        specified_bank = balances.find('mmk_banks', specified_bank_name) if bank_match else None
+
         # Check if we have stored OCR data for the original message
         stored_ocr_data = get_sale_receipt_ocr(original_message_id)
         
@@ -3806,10 +6204,7 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
                     total_detected_mmk += ocr_record['detected_amount']
                     mmk_receipt_count += 1
                     if not detected_bank and ocr_record['detected_bank']:
-                        for bank in balances['mmk_banks']:
-                            if banks_match(bank['bank_name'], ocr_record['detected_bank']):
-                                detected_bank = bank
-                                break
+                        detected_bank = balances.find('mmk_banks', ocr_record['detected_bank'])
             
             # Clean up stored OCR data
             delete_sale_receipt_ocr(original_message_id)
@@ -3835,9 +6230,8 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
             
             if not mmk_photo_data_list:
                 user_photo = original_message.photo[-1]
-                user_file = await context.bot.get_file(user_photo.file_id)
-                user_bytes = await user_file.download_as_bytearray()
-                mmk_photo_data_list = [(original_message_id, bytes(user_bytes))]
+                user_bytes = await download_photo(context, user_photo)
+                mmk_photo_data_list = [(original_message_id, user_bytes)]
             
             # If staff specified a bank in text, only extract amount from receipts (don't detect bank)
             if specified_bank:
@@ -3850,11 +6244,11 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
                     if isinstance(data, str):
                         with open(data, 'rb') as f:
                             photo_bytes = f.read()
-                        user_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+                        user_receipt = ReceiptBuffer(photo_bytes)
                     else:
-                        user_base64 = base64.b64encode(data).decode('utf-8')
+                        user_receipt = ReceiptBuffer(data)
                     
-                    mmk_result = await ocr_detect_mmk_bank_multi(user_base64, balances['mmk_banks'])
+                    mmk_result = await ocr_detect_mmk_bank_multi(user_receipt, balances['mmk_banks'])
                     
                     if mmk_result and mmk_result['amount']:
                         total_detected_mmk += mmk_result['amount']
@@ -3871,11 +6265,11 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
                     if isinstance(data, str):
                         with open(data, 'rb') as f:
                             photo_bytes = f.read()
-                        user_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+                        user_receipt = ReceiptBuffer(photo_bytes)
                     else:
-                        user_base64 = base64.b64encode(data).decode('utf-8')
+                        user_receipt = ReceiptBuffer(data)
                     
-                    mmk_result = await ocr_detect_mmk_bank_and_amount(user_base64, balances['mmk_banks'], user_prefix)
+                    mmk_result = await ocr_detect_mmk_bank_and_amount(user_receipt, balances['mmk_banks'], user_prefix)
                     
                     if mmk_result and mmk_result['amount']:
                         total_detected_mmk += mmk_result['amount']
@@ -3892,33 +6286,19 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
                 delete_media_group_photos(media_group_id_to_cleanup)
             return
         
-        # Check for MMK fee in staff reply and bank specification
-        staff_text = message.text or message.caption or ""
+        # Check for MMK fee in staff reply; the bank specification was read above
         fee_match = re.search(r'fee\s*-\s*([\d,]+(?:\.\d+)?)', staff_text, re.IGNORECASE)
         if fee_match:
             mmk_fee = float(fee_match.group(1).replace(',', ''))
         
-        # Check for bank specification in format: From San(Kpay P)
-        specified_bank = None
-        bank_match = re.search(r'From\s+([^(]+)\(([^)]+)\)', staff_text, re.IGNORECASE)
-        if bank_match:
-            prefix = bank_match.group(1).strip()
-            bank_name = bank_match.group(2).strip()
-            specified_bank_name = f"{prefix}({bank_name})"
-            
-            # Find the matching bank in balances
-            for bank in balances['mmk_banks']:
-                if banks_match(bank['bank_name'], specified_bank_name):
-                    specified_bank = bank
-                    logger.info(f"Staff specified bank: {specified_bank_name} -> matched {bank['bank_name']}")
-                    break
-            
-            if not specified_bank:
-                await send_alert(message, f"❌ Specified bank '{specified_bank_name}' not found in registered MMK banks", context)
-                if media_group_id_to_cleanup:
-                    delete_media_group_photos(media_group_id_to_cleanup)
-                return
-        
+        if specified_bank:
+            logger.info("Staff specified bank: %s -> matched %s", specified_bank_name, specified_bank['bank_name'])
+        elif bank_match:
+            await send_alert(message, f"❌ Specified bank '{specified_bank_name}' not found in registered MMK banks", context)
+            if media_group_id_to_cleanup:
+                delete_media_group_photos(media_group_id_to_cleanup)
+            return
+
         # Now process USDT receipts (the photos in current message)
         total_detected_usdt = 0
         detected_bank_type = None
@@ -3926,11 +6306,10 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
         for idx, photo in enumerate(photos, 1):
             logger.info(f"Processing USDT receipt {idx}/{len(photos)}")
             
-            photo_file = await context.bot.get_file(photo.file_id)
-            photo_bytes = await photo_file.download_as_bytearray()
-            photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+            photo_bytes = await download_photo(context, photo)
+            photo_receipt = ReceiptBuffer(photo_bytes)
             
-            usdt_result = await ocr_extract_usdt_with_fee(photo_base64)
+            usdt_result = await ocr_extract_usdt_with_fee(photo_receipt)
             
             if not usdt_result:
                 logger.warning(f"Could not process USDT receipt {idx}")
@@ -3954,20 +6333,23 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
         if not detected_bank_type:
             detected_bank_type = 'swift'
         
-        # Update MMK balance
-        for bank in balances['mmk_banks']:
-            if banks_match(bank['bank_name'], detected_bank['bank_name']):
+        async with ledger_lock:
+            # Re-read under the lock: a balance may have been loaded since
+            balances = context.chat_data['balances']
+            
+            # Update MMK balance
+            bank = balances.find('mmk_banks', detected_bank['bank_name'])
+            if bank:
                 bank['amount'] += total_mmk
-                logger.info(f"Added {total_mmk:,.0f} MMK to {bank['bank_name']}")
-                break
-        
-        # Update USDT balance
-        usdt_updated = False
-        bank_type_capitalized = detected_bank_type.capitalize()
-        expected_bank_name = f"{user_prefix}({bank_type_capitalized})"
-        
-        for bank in balances['usdt_banks']:
-            if banks_match(bank['bank_name'], expected_bank_name):
+                logger.info("Added %s MMK to %s", format(total_mmk, ',.0f'), bank['bank_name'])
+            
+            # Update USDT balance
+            usdt_updated = False
+            bank_type_capitalized = detected_bank_type.capitalize()
+            expected_bank_name = f"{user_prefix}({bank_type_capitalized})"
+            
+            bank = balances.find('usdt_banks', expected_bank_name)
+            if bank:
                 if bank['amount'] < total_detected_usdt:
                     await send_alert(message, 
                         f"❌ Insufficient USDT balance!\n\n"
@@ -3979,28 +6361,15 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
                     return
                 bank['amount'] -= total_detected_usdt
                 usdt_updated = True
-                logger.info(f"Reduced {total_detected_usdt:.4f} USDT from {bank['bank_name']}")
-                break
-        
-        if not usdt_updated:
-            await send_alert(message, f"⚠️ USDT bank '{expected_bank_name}' not found", context)
-        
-        # Send new balance
-        new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-        
-        if AUTO_BALANCE_TOPIC_ID:
-            await context.bot.send_message(
-                chat_id=TARGET_GROUP_ID,
-                message_thread_id=AUTO_BALANCE_TOPIC_ID,
-                text=new_balance
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=TARGET_GROUP_ID,
-                text=new_balance
-            )
+                logger.info("Reduced %.4f USDT from %s", total_detected_usdt, bank['bank_name'])
+            
+            if not usdt_updated:
+                await send_alert(message, f"⚠️ USDT bank '{expected_bank_name}' not found", context)
+            
+            context.chat_data['balances'] = balances
         
-        context.chat_data['balances'] = balances
+        # Publish new balance (coalesced with other updates in the same window)
+        await publish_balance(context)
         
         # Send success message
         bank_source = " (specified in text)" if specified_bank else ""
@@ -4010,8 +6379,12 @@ async def process_sell_transaction_bulk(update: Update, context: ContextTypes.DE
             f"✅ Sell: +{total_mmk:,.0f} MMK ({detected_bank['bank_name']}{bank_source}) | -{total_detected_usdt:.4f} USDT",
             parse_mode='HTML'
         )
+        
+        # Sale is settled
+        pending_transactions.pop(original_message_id, original_message.media_group_id)
 
 
+@idempotent('p2p_sell_breakdown')
 async def process_p2p_sell_with_breakdown(update: Update, context: ContextTypes.DEFAULT_TYPE, tx_info: dict):
     """P2P SELL with bank breakdown specified in message (no OCR needed)
     
@@ -4047,68 +6420,53 @@ async def process_p2p_sell_with_breakdown(update: Update, context: ContextTypes.
         await send_alert(message, "❌ No bank breakdown found in message", context)
         return
     
-    # Add MMK to specified banks
-    banks_updated = []
-    total_mmk = 0
-    
-    for breakdown in bank_breakdown:
-        amount = breakdown['amount']
-        bank_name = breakdown['bank_name']
-        total_mmk += amount
+    async with ledger_lock:
+        # Re-read under the lock: a balance may have been loaded since
+        balances = context.chat_data['balances']
+        
+        # Add MMK to specified banks
+        banks_updated = []
+        total_mmk = 0
         
-        # Find matching bank in balances
-        bank_found = False
-        for bank in balances['mmk_banks']:
-            if banks_match(bank['bank_name'], bank_name):
+        for breakdown in bank_breakdown:
+            amount = breakdown['amount']
+            bank_name = breakdown['bank_name']
+            total_mmk += amount
+            
+            # Find matching bank in balances
+            bank_found = False
+            bank = balances.find('mmk_banks', bank_name)
+            if bank:
                 bank['amount'] += amount
                 banks_updated.append((bank['bank_name'], amount))
-                logger.info(f"P2P Sell (breakdown): Added {amount:,.0f} MMK to {bank['bank_name']}")
+                logger.info("P2P Sell (breakdown): Added %s MMK to %s", format(amount, ',.0f'), bank['bank_name'])
                 bank_found = True
-                break
-        
-        if not bank_found:
-            await send_alert(message, f"❌ Bank not found: {bank_name}", context)
-            return
-    
-    # Verify total MMK matches message
-    if abs(total_mmk - tx_info['mmk']) > 1000:
-        await send_status_message(
-            context,
-            f"⚠️ <b>MMK Amount Mismatch Warning</b>\n\n"
-            f"<b>Transaction:</b> P2P Sell\n"
-            f"<b>Staff:</b> {user_prefix}\n"
-            f"<b>Expected (from message):</b> {tx_info['mmk']:,.0f} MMK\n"
-            f"<b>Total from breakdown:</b> {total_mmk:,.0f} MMK\n"
-            f"<b>Difference:</b> {abs(total_mmk - tx_info['mmk']):,.0f} MMK",
-            parse_mode='HTML'
-        )
-    
-    # Reduce USDT from staff's Binance account (USDT + fee)
-    total_usdt = tx_info['total_usdt']
-    usdt_updated = False
-    usdt_bank_name = None
-    
-    # First, try to find staff's Binance account specifically
-    for bank in balances['usdt_banks']:
-        if bank.get('prefix') == user_prefix and 'binance' in bank.get('bank', '').lower():
-            if bank['amount'] < total_usdt:
-                await send_alert(message,
-                    f"❌ Insufficient USDT balance!\n\n"
-                    f"{bank['bank_name']}: {bank['amount']:.4f} USDT\n"
-                    f"Required: {total_usdt:.4f} USDT (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})\n"
-                    f"Shortage: {total_usdt - bank['amount']:.4f} USDT",
-                    context)
+            
+            if not bank_found:
+                await send_alert(message, f"❌ Bank not found: {bank_name}", context)
                 return
-            bank['amount'] -= total_usdt
-            usdt_updated = True
-            usdt_bank_name = bank['bank_name']
-            logger.info(f"P2P Sell (breakdown): Reduced {total_usdt:.4f} USDT from {bank['bank_name']} (Binance)")
-            break
-    
-    # Fallback: if no Binance account found for staff, use any USDT bank with matching prefix
-    if not usdt_updated:
+        
+        # Verify total MMK matches message
+        if abs(total_mmk - tx_info['mmk']) > 1000:
+            await send_status_message(
+                context,
+                f"⚠️ <b>MMK Amount Mismatch Warning</b>\n\n"
+                f"<b>Transaction:</b> P2P Sell\n"
+                f"<b>Staff:</b> {user_prefix}\n"
+                f"<b>Expected (from message):</b> {tx_info['mmk']:,.0f} MMK\n"
+                f"<b>Total from breakdown:</b> {total_mmk:,.0f} MMK\n"
+                f"<b>Difference:</b> {abs(total_mmk - tx_info['mmk']):,.0f} MMK",
+                parse_mode='HTML'
+            )
+        
+        # Reduce USDT from staff's Binance account (USDT + fee)
+        total_usdt = tx_info['total_usdt']
+        usdt_updated = False
+        usdt_bank_name = None
+        
+        # First, try to find staff's Binance account specifically
         for bank in balances['usdt_banks']:
-            if bank.get('prefix') == user_prefix:
+            if bank.get('prefix') == user_prefix and 'binance' in bank.get('bank', '').lower():
                 if bank['amount'] < total_usdt:
                     await send_alert(message,
                         f"❌ Insufficient USDT balance!\n\n"
@@ -4120,29 +6478,36 @@ async def process_p2p_sell_with_breakdown(update: Update, context: ContextTypes.
                 bank['amount'] -= total_usdt
                 usdt_updated = True
                 usdt_bank_name = bank['bank_name']
-                logger.info(f"P2P Sell (breakdown): Reduced {total_usdt:.4f} USDT from {bank['bank_name']} (fallback)")
-                break
-    
-    if not usdt_updated:
-        await send_alert(message, f"❌ No USDT bank found for prefix '{user_prefix}'. For P2P sell, Binance account is preferred.", context)
-        return
-    
-    # Send new balance
-    new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-    
-    if AUTO_BALANCE_TOPIC_ID:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            message_thread_id=AUTO_BALANCE_TOPIC_ID,
-            text=new_balance
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            text=new_balance
-        )
+                logger.info("P2P Sell (breakdown): Reduced %.4f USDT from %s (Binance)", total_usdt, bank['bank_name'])
+                break
+        
+        # Fallback: if no Binance account found for staff, use any USDT bank with matching prefix
+        if not usdt_updated:
+            for bank in balances['usdt_banks']:
+                if bank.get('prefix') == user_prefix:
+                    if bank['amount'] < total_usdt:
+                        await send_alert(message,
+                            f"❌ Insufficient USDT balance!\n\n"
+                            f"{bank['bank_name']}: {bank['amount']:.4f} USDT\n"
+                            f"Required: {total_usdt:.4f} USDT (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})\n"
+                            f"Shortage: {total_usdt - bank['amount']:.4f} USDT",
+                            context)
+                        return
+                    bank['amount'] -= total_usdt
+                    usdt_updated = True
+                    usdt_bank_name = bank['bank_name']
+                    logger.info("P2P Sell (breakdown): Reduced %.4f USDT from %s (fallback)",
+                                total_usdt, bank['bank_name'])
+                    break
+        
+        if not usdt_updated:
+            await send_alert(message, f"❌ No USDT bank found for prefix '{user_prefix}'. For P2P sell, Binance account is preferred.", context)
+            return
+        
+        context.chat_data['balances'] = balances
     
-    context.chat_data['balances'] = balances
+    # Publish new balance (coalesced with other updates in the same window)
+    await publish_balance(context)
     
     # Build MMK summary for multiple banks
     if len(banks_updated) == 1:
@@ -4164,6 +6529,7 @@ async def process_p2p_sell_with_breakdown(update: Update, context: ContextTypes.
     )
 
 
+@idempotent('staff_p2p_sell')
 async def process_staff_p2p_sell(update: Update, context: ContextTypes.DEFAULT_TYPE, tx_info: dict):
     """Staff P2P SELL with direct bank transfer (no OCR needed)
     
@@ -4194,23 +6560,26 @@ async def process_staff_p2p_sell(update: Update, context: ContextTypes.DEFAULT_T
     mmk_amount = tx_info['mmk']
     usdt_amount = tx_info['usdt']
     
-    # Find and update destination MMK bank (add MMK)
-    mmk_updated = False
-    for bank in balances['mmk_banks']:
-        if banks_match(bank['bank_name'], dest_bank_name):
+    async with ledger_lock:
+        # Re-read under the lock: a balance may have been loaded since
+        balances = context.chat_data['balances']
+        
+        # Find and update destination MMK bank (add MMK)
+        mmk_updated = False
+        bank = balances.find('mmk_banks', dest_bank_name)
+        if bank:
             bank['amount'] += mmk_amount
             mmk_updated = True
-            logger.info(f"Staff P2P Sell: Added {mmk_amount:,.0f} MMK to {bank['bank_name']}")
-            break
-    
-    if not mmk_updated:
-        await send_alert(message, f"❌ Destination MMK bank '{dest_bank_name}' not found", context)
-        return
-    
-    # Find and update source USDT bank (subtract USDT)
-    usdt_updated = False
-    for bank in balances['usdt_banks']:
-        if banks_match(bank['bank_name'], src_bank_name):
+            logger.info("Staff P2P Sell: Added %s MMK to %s", format(mmk_amount, ',.0f'), bank['bank_name'])
+        
+        if not mmk_updated:
+            await send_alert(message, f"❌ Destination MMK bank '{dest_bank_name}' not found", context)
+            return
+        
+        # Find and update source USDT bank (subtract USDT)
+        usdt_updated = False
+        bank = balances.find('usdt_banks', src_bank_name)
+        if bank:
             if bank['amount'] < usdt_amount:
                 await send_alert(message, 
                     f"❌ Insufficient USDT in {bank['bank_name']}: "
@@ -4221,29 +6590,16 @@ async def process_staff_p2p_sell(update: Update, context: ContextTypes.DEFAULT_T
                 return
             bank['amount'] -= usdt_amount
             usdt_updated = True
-            logger.info(f"Staff P2P Sell: Reduced {usdt_amount:.4f} USDT from {bank['bank_name']}")
-            break
-    
-    if not usdt_updated:
-        await send_alert(message, f"❌ Source USDT bank '{src_bank_name}' not found", context)
-        return
-    
-    # Send new balance
-    new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-    
-    if AUTO_BALANCE_TOPIC_ID:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            message_thread_id=AUTO_BALANCE_TOPIC_ID,
-            text=new_balance
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            text=new_balance
-        )
+            logger.info("Staff P2P Sell: Reduced %.4f USDT from %s", usdt_amount, bank['bank_name'])
+        
+        if not usdt_updated:
+            await send_alert(message, f"❌ Source USDT bank '{src_bank_name}' not found", context)
+            return
+        
+        context.chat_data['balances'] = balances
     
-    context.chat_data['balances'] = balances
+    # Publish new balance (coalesced with other updates in the same window)
+    await publish_balance(context)
     
     # Send success message
     await send_status_message(
@@ -4255,6 +6611,8 @@ async def process_staff_p2p_sell(update: Update, context: ContextTypes.DEFAULT_T
     )
 
 
+@idempotent('p2p_sell_photos')
+@admitted('p2p')
 async def process_p2p_sell_with_photos(update: Update, context: ContextTypes.DEFAULT_TYPE, tx_info: dict, photos: list):
     """P2P SELL with photos already collected in memory
     
@@ -4295,12 +6653,11 @@ async def process_p2p_sell_with_photos(update: Update, context: ContextTypes.DEF
         logger.info(f"P2P Sell: Processing MMK receipt {idx}/{len(photos)}")
         
         try:
-            photo_file = await context.bot.get_file(photo.file_id)
-            photo_bytes = await photo_file.download_as_bytearray()
-            photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+            photo_bytes = await download_photo(context, photo)
+            photo_receipt = ReceiptBuffer(photo_bytes)
             
             # Use STAFF-SPECIFIC bank detection for P2P sell (staff's banks)
-            result = await ocr_detect_mmk_bank_and_amount(photo_base64, balances['mmk_banks'], user_prefix)
+            result = await ocr_detect_mmk_bank_and_amount(photo_receipt, balances['mmk_banks'], user_prefix)
             
             if result and result['amount'] and result['bank']:
                 receipt_mmk = result['amount']
@@ -4339,44 +6696,28 @@ async def process_p2p_sell_with_photos(update: Update, context: ContextTypes.DEF
         )
         logger.warning(f"MMK amount mismatch! Expected: {tx_info['mmk']:,.0f} MMK, Detected: {total_detected_mmk:,.0f} MMK - Processing with detected amount")
     
-    # Add MMK to detected bank(s) - supports multiple banks
-    banks_updated = []
-    for detected_bank, receipt_amount in detected_banks:
-        for bank in balances['mmk_banks']:
-            if banks_match(bank['bank_name'], detected_bank['bank_name']):
+    async with ledger_lock:
+        # Re-read under the lock: a balance may have been loaded since
+        balances = context.chat_data['balances']
+        
+        # Add MMK to detected bank(s) - supports multiple banks
+        banks_updated = []
+        for detected_bank, receipt_amount in detected_banks:
+            bank = balances.find('mmk_banks', detected_bank['bank_name'])
+            if bank:
                 bank['amount'] += receipt_amount
                 banks_updated.append((bank['bank_name'], receipt_amount))
-                logger.info(f"Added {receipt_amount:,.0f} MMK to {bank['bank_name']}")
-                break
-    
-    # Reduce USDT from staff's Binance account (USDT + fee)
-    # For P2P sell, always use Binance as the USDT bank
-    total_usdt = tx_info['total_usdt']  # This includes the fee
-    usdt_updated = False
-    usdt_bank_name = None
-    
-    # First, try to find staff's Binance account specifically
-    for bank in balances['usdt_banks']:
-        if bank.get('prefix') == user_prefix and 'binance' in bank.get('bank', '').lower():
-            # Check if sufficient USDT balance
-            if bank['amount'] < total_usdt:
-                await send_alert(message,
-                    f"❌ Insufficient USDT balance!\n\n"
-                    f"{bank['bank_name']}: {bank['amount']:.4f} USDT\n"
-                    f"Required: {total_usdt:.4f} USDT (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})\n"
-                    f"Shortage: {total_usdt - bank['amount']:.4f} USDT",
-                    context)
-                return
-            bank['amount'] -= total_usdt
-            usdt_updated = True
-            usdt_bank_name = bank['bank_name']
-            logger.info(f"P2P Sell (Media Group): Reduced {total_usdt:.4f} USDT from {bank['bank_name']} (Binance) (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})")
-            break
-    
-    # Fallback: if no Binance account found for staff, use any USDT bank with matching prefix
-    if not usdt_updated:
+                logger.info("Added %s MMK to %s", format(receipt_amount, ',.0f'), bank['bank_name'])
+        
+        # Reduce USDT from staff's Binance account (USDT + fee)
+        # For P2P sell, always use Binance as the USDT bank
+        total_usdt = tx_info['total_usdt']  # This includes the fee
+        usdt_updated = False
+        usdt_bank_name = None
+        
+        # First, try to find staff's Binance account specifically
         for bank in balances['usdt_banks']:
-            if bank.get('prefix') == user_prefix:
+            if bank.get('prefix') == user_prefix and 'binance' in bank.get('bank', '').lower():
                 # Check if sufficient USDT balance
                 if bank['amount'] < total_usdt:
                     await send_alert(message,
@@ -4389,29 +6730,38 @@ async def process_p2p_sell_with_photos(update: Update, context: ContextTypes.DEF
                 bank['amount'] -= total_usdt
                 usdt_updated = True
                 usdt_bank_name = bank['bank_name']
-                logger.info(f"P2P Sell (Media Group): Reduced {total_usdt:.4f} USDT from {bank['bank_name']} (fallback) (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})")
+                logger.info("P2P Sell (Media Group): Reduced %.4f USDT from %s (Binance) (USDT: %.4f + Fee: %.4f)",
+                            total_usdt, bank['bank_name'], tx_info['usdt'], tx_info['fee'])
                 break
+        
+        # Fallback: if no Binance account found for staff, use any USDT bank with matching prefix
+        if not usdt_updated:
+            for bank in balances['usdt_banks']:
+                if bank.get('prefix') == user_prefix:
+                    # Check if sufficient USDT balance
+                    if bank['amount'] < total_usdt:
+                        await send_alert(message,
+                            f"❌ Insufficient USDT balance!\n\n"
+                            f"{bank['bank_name']}: {bank['amount']:.4f} USDT\n"
+                            f"Required: {total_usdt:.4f} USDT (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})\n"
+                            f"Shortage: {total_usdt - bank['amount']:.4f} USDT",
+                            context)
+                        return
+                    bank['amount'] -= total_usdt
+                    usdt_updated = True
+                    usdt_bank_name = bank['bank_name']
+                    logger.info("P2P Sell (Media Group): Reduced %.4f USDT from %s (fallback) (USDT: %.4f + Fee: %.4f)",
+                                total_usdt, bank['bank_name'], tx_info['usdt'], tx_info['fee'])
+                    break
+        
+        if not usdt_updated:
+            await send_alert(message, f"❌ No USDT bank found for prefix '{user_prefix}'. For P2P sell, Binance account is preferred.", context)
+            return
+        
+        context.chat_data['balances'] = balances
     
-    if not usdt_updated:
-        await send_alert(message, f"❌ No USDT bank found for prefix '{user_prefix}'. For P2P sell, Binance account is preferred.", context)
-        return
-    
-    # Send new balance
-    new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-    
-    if AUTO_BALANCE_TOPIC_ID:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            message_thread_id=AUTO_BALANCE_TOPIC_ID,
-            text=new_balance
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            text=new_balance
-        )
-    
-    context.chat_data['balances'] = balances
+    # Publish new balance (coalesced with other updates in the same window)
+    await publish_balance(context)
     
     # Build MMK summary for multiple banks
     if len(banks_updated) == 1:
@@ -4434,6 +6784,8 @@ async def process_p2p_sell_with_photos(update: Update, context: ContextTypes.DEF
     )
 
 
+@idempotent('p2p_sell')
+@admitted('p2p')
 async def process_p2p_sell_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE, tx_info: dict):
     """P2P SELL: Staff sells USDT to another exchange (not to customer)
     Format: sell 13000000/3222.6=4034.00981 fee-6.44
@@ -4484,15 +6836,13 @@ async def process_p2p_sell_transaction(update: Update, context: ContextTypes.DEF
         else:
             # Just process the current photo
             photo = message.photo[-1]
-            photo_file = await context.bot.get_file(photo.file_id)
-            photo_bytes = await photo_file.download_as_bytearray()
-            photos_to_process = [(message.message_id, bytes(photo_bytes))]
+            photo_bytes = await download_photo(context, photo)
+            photos_to_process = [(message.message_id, photo_bytes)]
     else:
         # Single photo
         photo = message.photo[-1]
-        photo_file = await context.bot.get_file(photo.file_id)
-        photo_bytes = await photo_file.download_as_bytearray()
-        photos_to_process = [(message.message_id, bytes(photo_bytes))]
+        photo_bytes = await download_photo(context, photo)
+        photos_to_process = [(message.message_id, photo_bytes)]
     
     # Process all receipts - use STAFF-SPECIFIC bank detection for P2P sell
     total_detected_mmk = 0
@@ -4507,12 +6857,12 @@ async def process_p2p_sell_transaction(update: Update, context: ContextTypes.DEF
         if isinstance(data, str):
             with open(data, 'rb') as f:
                 photo_bytes = f.read()
-            photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+            photo_receipt = ReceiptBuffer(photo_bytes)
         else:
-            photo_base64 = base64.b64encode(data).decode('utf-8')
+            photo_receipt = ReceiptBuffer(data)
         
         # Use STAFF-SPECIFIC bank detection for P2P sell (staff's banks)
-        result = await ocr_detect_mmk_bank_and_amount(photo_base64, balances['mmk_banks'], user_prefix)
+        result = await ocr_detect_mmk_bank_and_amount(photo_receipt, balances['mmk_banks'], user_prefix)
         
         if result and result['amount'] and result['bank']:
             receipt_mmk = result['amount']
@@ -4550,44 +6900,28 @@ async def process_p2p_sell_transaction(update: Update, context: ContextTypes.DEF
         )
         logger.warning(f"MMK amount mismatch! Expected: {tx_info['mmk']:,.0f} MMK, Detected: {total_detected_mmk:,.0f} MMK - Processing with detected amount")
     
-    # Add MMK to detected bank(s) - supports multiple banks
-    banks_updated = []
-    for detected_bank, receipt_amount in detected_banks:
-        for bank in balances['mmk_banks']:
-            if banks_match(bank['bank_name'], detected_bank['bank_name']):
+    async with ledger_lock:
+        # Re-read under the lock: a balance may have been loaded since
+        balances = context.chat_data['balances']
+        
+        # Add MMK to detected bank(s) - supports multiple banks
+        banks_updated = []
+        for detected_bank, receipt_amount in detected_banks:
+            bank = balances.find('mmk_banks', detected_bank['bank_name'])
+            if bank:
                 bank['amount'] += receipt_amount
                 banks_updated.append((bank['bank_name'], receipt_amount))
-                logger.info(f"Added {receipt_amount:,.0f} MMK to {bank['bank_name']}")
-                break
-    
-    # Reduce USDT from staff's Binance account (USDT + fee)
-    # For P2P sell, always use Binance as the USDT bank
-    total_usdt = tx_info['total_usdt']  # This includes the fee
-    usdt_updated = False
-    usdt_bank_name = None
-    
-    # First, try to find staff's Binance account specifically
-    for bank in balances['usdt_banks']:
-        if bank.get('prefix') == user_prefix and 'binance' in bank.get('bank', '').lower():
-            # Check if sufficient USDT balance
-            if bank['amount'] < total_usdt:
-                await send_alert(message,
-                    f"❌ Insufficient USDT balance!\n\n"
-                    f"{bank['bank_name']}: {bank['amount']:.4f} USDT\n"
-                    f"Required: {total_usdt:.4f} USDT (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})\n"
-                    f"Shortage: {total_usdt - bank['amount']:.4f} USDT",
-                    context)
-                return
-            bank['amount'] -= total_usdt
-            usdt_updated = True
-            usdt_bank_name = bank['bank_name']
-            logger.info(f"P2P Sell: Reduced {total_usdt:.4f} USDT from {bank['bank_name']} (Binance) (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})")
-            break
-    
-    # Fallback: if no Binance account found for staff, use any USDT bank with matching prefix
-    if not usdt_updated:
+                logger.info("Added %s MMK to %s", format(receipt_amount, ',.0f'), bank['bank_name'])
+        
+        # Reduce USDT from staff's Binance account (USDT + fee)
+        # For P2P sell, always use Binance as the USDT bank
+        total_usdt = tx_info['total_usdt']  # This includes the fee
+        usdt_updated = False
+        usdt_bank_name = None
+        
+        # First, try to find staff's Binance account specifically
         for bank in balances['usdt_banks']:
-            if bank.get('prefix') == user_prefix:
+            if bank.get('prefix') == user_prefix and 'binance' in bank.get('bank', '').lower():
                 # Check if sufficient USDT balance
                 if bank['amount'] < total_usdt:
                     await send_alert(message,
@@ -4600,30 +6934,38 @@ async def process_p2p_sell_transaction(update: Update, context: ContextTypes.DEF
                 bank['amount'] -= total_usdt
                 usdt_updated = True
                 usdt_bank_name = bank['bank_name']
-                logger.info(f"P2P Sell: Reduced {total_usdt:.4f} USDT from {bank['bank_name']} (fallback) (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})")
+                logger.info("P2P Sell: Reduced %.4f USDT from %s (Binance) (USDT: %.4f + Fee: %.4f)",
+                            total_usdt, bank['bank_name'], tx_info['usdt'], tx_info['fee'])
                 break
+        
+        # Fallback: if no Binance account found for staff, use any USDT bank with matching prefix
+        if not usdt_updated:
+            for bank in balances['usdt_banks']:
+                if bank.get('prefix') == user_prefix:
+                    # Check if sufficient USDT balance
+                    if bank['amount'] < total_usdt:
+                        await send_alert(message,
+                            f"❌ Insufficient USDT balance!\n\n"
+                            f"{bank['bank_name']}: {bank['amount']:.4f} USDT\n"
+                            f"Required: {total_usdt:.4f} USDT (USDT: {tx_info['usdt']:.4f} + Fee: {tx_info['fee']:.4f})\n"
+                            f"Shortage: {total_usdt - bank['amount']:.4f} USDT",
+                            context)
+                        return
+                    bank['amount'] -= total_usdt
+                    usdt_updated = True
+                    usdt_bank_name = bank['bank_name']
+                    logger.info("P2P Sell: Reduced %.4f USDT from %s (fallback) (USDT: %.4f + Fee: %.4f)",
+                                total_usdt, bank['bank_name'], tx_info['usdt'], tx_info['fee'])
+                    break
+        
+        if not usdt_updated:
+            await send_alert(message, f"❌ No USDT bank found for prefix '{user_prefix}'. For P2P sell, Binance account is preferred.", context)
+            return
+        
+        context.chat_data['balances'] = balances
     
-    if not usdt_updated:
-        await send_alert(message, f"❌ No USDT bank found for prefix '{user_prefix}'. For P2P sell, Binance account is preferred.", context)
-        return
-    
-    # Send new balance
-    new_balance = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-    
-    # Send to auto balance topic if configured, otherwise to main chat
-    if AUTO_BALANCE_TOPIC_ID:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            message_thread_id=AUTO_BALANCE_TOPIC_ID,
-            text=new_balance
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=TARGET_GROUP_ID,
-            text=new_balance
-        )
-    
-    context.chat_data['balances'] = balances
+    # Publish new balance (coalesced with other updates in the same window)
+    await publish_balance(context)
     
     # Build MMK summary for multiple banks
     if len(banks_updated) == 1:
@@ -4656,6 +6998,18 @@ async def process_p2p_sell_transaction(update: Update, context: ContextTypes.DEF
 # IMMEDIATE SALE RECEIPT OCR PROCESSING
 # ============================================================================
 
+async def read_media_group_photo(context: ContextTypes.DEFAULT_TYPE, file_path: str, photo=None) -> bytes:
+    """Read a stored media group photo
+    
+    An OCR worker on another node has no copy of the file on its disk; it
+    downloads the photo from Telegram instead when `photo` is given.
+    """
+    if photo is not None and not os.path.exists(file_path):
+        return await download_photo(context, photo)
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+@admitted('prescan')
 async def process_sale_receipt_immediate(update: Update, context: ContextTypes.DEFAULT_TYPE, tx_info: dict):
     """Process sale receipt immediately when sale message arrives (before staff reply)
     
@@ -4692,9 +7046,8 @@ async def process_sale_receipt_immediate(update: Update, context: ContextTypes.D
     if transaction_type == 'sell':
         # Sell: Customer sends MMK receipt, we need to detect MMK amount and bank
         photo = message.photo[-1]
-        photo_file = await context.bot.get_file(photo.file_id)
-        photo_bytes = await photo_file.download_as_bytearray()
-        photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+        photo_bytes = await download_photo(context, photo)
+        photo_receipt = ReceiptBuffer(photo_bytes)
         
         # Use confidence-based bank matching for sell transactions
         mmk_banks_with_ids = []
@@ -4717,7 +7070,7 @@ async def process_sale_receipt_immediate(update: Update, context: ContextTypes.D
                 })
         
         # OCR with confidence matching
-        ocr_result = await ocr_match_mmk_receipt_to_banks(photo_base64, mmk_banks_with_ids)
+        ocr_result = await ocr_match_mmk_receipt_to_banks(photo_receipt, mmk_banks_with_ids)
         
         if ocr_result:
             detected_amount = ocr_result.get('amount', 0)
@@ -4789,12 +7142,11 @@ async def process_sale_receipt_immediate(update: Update, context: ContextTypes.D
     elif transaction_type == 'buy':
         # Buy: Customer sends USDT receipt, we need to detect USDT amount
         photo = message.photo[-1]
-        photo_file = await context.bot.get_file(photo.file_id)
-        photo_bytes = await photo_file.download_as_bytearray()
-        photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+        photo_bytes = await download_photo(context, photo)
+        photo_receipt = ReceiptBuffer(photo_bytes)
         
         # OCR USDT receipt
-        usdt_result = await ocr_extract_usdt_with_fee(photo_base64)
+        usdt_result = await ocr_extract_usdt_with_fee(photo_receipt)
         
         if usdt_result:
             detected_usdt = usdt_result.get('total_amount', 0)
@@ -4844,16 +7196,15 @@ async def process_sale_receipt_immediate(update: Update, context: ContextTypes.D
                 parse_mode='HTML'
             )
 
+@admitted('prescan')
 async def process_sale_media_group_immediate(update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                                              media_group_id: str, tx_info: dict):
+                                              media_group_id: str, tx_info: dict, photos_by_message: dict = None):
     """Process multiple sale receipts (media group) immediately
     
-    Called after a short delay to ensure all photos in the media group are collected
+    Runs from the job queue a short delay after the first photo, so all photos in the media group are collected.
+    photos_by_message maps message_id -> PhotoSize, used to download photos this process has no copy of.
     """
     
-    # Wait for all photos to arrive
-    await asyncio.sleep(1.5)
-    
     balances = context.chat_data.get('balances')
     if not balances:
         logger.warning("Balance not loaded - cannot process sale media group immediately")
@@ -4898,11 +7249,10 @@ async def process_sale_media_group_immediate(update: Update, context: ContextTyp
         
         for idx, (msg_id, file_path) in enumerate(stored_photos):
             try:
-                with open(file_path, 'rb') as f:
-                    photo_bytes = f.read()
-                photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+                photo_bytes = await read_media_group_photo(context, file_path, (photos_by_message or {}).get(msg_id))
+                photo_receipt = ReceiptBuffer(photo_bytes)
                 
-                ocr_result = await ocr_match_mmk_receipt_to_banks(photo_base64, mmk_banks_with_ids)
+                ocr_result = await ocr_match_mmk_receipt_to_banks(photo_receipt, mmk_banks_with_ids)
                 
                 if ocr_result:
                     receipt_amount = ocr_result.get('amount', 0)
@@ -4972,11 +7322,10 @@ async def process_sale_media_group_immediate(update: Update, context: ContextTyp
         # Buy: OCR all USDT receipts
         for idx, (msg_id, file_path) in enumerate(stored_photos):
             try:
-                with open(file_path, 'rb') as f:
-                    photo_bytes = f.read()
-                photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+                photo_bytes = await read_media_group_photo(context, file_path, (photos_by_message or {}).get(msg_id))
+                photo_receipt = ReceiptBuffer(photo_bytes)
                 
-                usdt_result = await ocr_extract_usdt_with_fee(photo_base64)
+                usdt_result = await ocr_extract_usdt_with_fee(photo_receipt)
                 
                 if usdt_result:
                     receipt_usdt = usdt_result.get('total_amount', 0)
@@ -5030,31 +7379,27 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Log ALL messages received in target group (for debugging)
     if message.chat.id == TARGET_GROUP_ID:
         msg_type = "text" if message.text else ("photo" if message.photo else "other")
-        logger.info(f"🔍 Received {msg_type} message - Chat: {message.chat.id}, Thread: {message.message_thread_id}, User: {message.from_user.id} (@{message.from_user.username})")
+        update_log.info("🔍 Received %s message - Chat: %s, Thread: %s, User: %s (@%s)", msg_type, message.chat.id, message.message_thread_id, message.from_user.id, message.from_user.username)
     
     if message.chat.id != TARGET_GROUP_ID:
         return
     
+    current_message.set(message)
+    current_context.set(context)
+    
     # Auto-load balance from auto balance topic (if configured)
     if AUTO_BALANCE_TOPIC_ID and message.message_thread_id == AUTO_BALANCE_TOPIC_ID:
         if message.text and 'USDT' in message.text:
-            balances = parse_balance_message(message.text)
-            if balances:
-                context.chat_data['balances'] = balances
-                thb_count = len(balances.get('thb_banks', []))
-                logger.info(f"✅ Balance loaded: {len(balances['mmk_banks'])} MMK banks, {len(balances['usdt_banks'])} USDT banks, {thb_count} THB banks")
+            await balance_ingest.ingest(message, context)
         return
     
     # Handle internal transfers in Accounts Matter topic
     if ACCOUNTS_MATTER_TOPIC_ID and message.message_thread_id == ACCOUNTS_MATTER_TOPIC_ID:
         # Check if this is an additional photo in an existing internal transfer media group
         if message.photo and message.media_group_id:
-            internal_transfer_groups = context.chat_data.get('internal_transfer_media_groups', {})
-            if message.media_group_id in internal_transfer_groups:
-                # Add this photo to the collection in memory
-                internal_transfer_groups[message.media_group_id]['photos'].append(message.photo[-1])
-                photo_count = len(internal_transfer_groups[message.media_group_id]['photos'])
-                logger.info(f"   📷 Added photo to internal transfer group (total: {photo_count})")
+            photo_count = append_ocr_job_photo(album_job_key('internal_transfer_album', message), message.photo[-1].to_dict())
+            if photo_count is not None:
+                update_log.info("   📷 Added photo to internal transfer group (total: %s)", photo_count)
                 return
         
         await process_internal_transfer(update, context)
@@ -5100,10 +7445,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 location_description = f"Message in main chat"
     
     if is_valid_location:
-        logger.info(f"📝 {location_description} from user {message.from_user.id} (@{message.from_user.username})")
+        update_log.info("📝 %s from user %s (@%s)", location_description, message.from_user.id, message.from_user.username)
     else:
         expected = f"topic {USDT_TRANSFERS_TOPIC_ID}" if (USDT_TRANSFERS_TOPIC_ID and USDT_TRANSFERS_TOPIC_ID > 1) else "main chat/topic 1"
-        logger.info(f"   ⏭️ Skipping: Wrong location (thread: {current_thread_id}, expected: {expected})")
+        update_log.info("   ⏭️ Skipping: Wrong location (thread: %s, expected: %s)", current_thread_id, expected)
         return
     
     # Log message details
@@ -5111,7 +7456,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     is_reply = bool(message.reply_to_message)
     message_text = (message.text or message.caption or "")[:50]
     
-    logger.info(f"   Has photo: {has_photo}, Is reply: {is_reply}, Text: '{message_text}...'")
+    update_log.info("   Has photo: %s, Is reply: %s, Text: '%s...'", has_photo, is_reply, message_text)
     
     # ============================================================================
     # IMMEDIATE SALE RECEIPT OCR - Process sale messages when they arrive
@@ -5124,7 +7469,24 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Check if this is a Buy/Sell transaction (not P2P sell which has 'fee')
         if tx_info_check.get('type') in ['buy', 'sell'] and 'fee' not in sale_message_text.lower():
-            logger.info(f"   📥 Sale message detected - triggering immediate OCR")
+            update_log.info("   📥 Sale message detected - triggering immediate OCR")
+            # Waits for the staff reply that settles it (/pending; the reply resumes its trace)
+            user_id = message.from_user.id
+            pending_transactions.put(message.message_id, {
+                'type': tx_info_check['type'],
+                'expected_usdt': tx_info_check.get('usdt') or 0,
+                'mmk_amount': tx_info_check.get('mmk') or 0,
+                'sender_id': user_id,
+                'sender_name': message.from_user.username or message.from_user.first_name or str(user_id)
+            }, media_group_id=message.media_group_id)
+            span = current_span.get()
+            if span is not None:
+                span.set('transaction.role', 'sale')
+                span.set('transaction.type', tx_info_check['type'])
+            # Under a backlog the staff reply OCRs the receipt instead; album photos are still saved for it
+            shed = admission.shed_prescan()
+            if shed:
+                update_log.info("   ⏭️ Pre-scan shed (backlog %s), leaving OCR to the staff reply", admission.backlog)
             
             if message.media_group_id:
                 # Media group - save photo and schedule delayed OCR for all photos
@@ -5133,24 +7495,33 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # Download and save photo to disk
                 try:
                     photo = message.photo[-1]
-                    photo_file = await context.bot.get_file(photo.file_id)
-                    photo_bytes = await photo_file.download_as_bytearray()
+                    photo_bytes = await download_photo(context, photo)
                     
                     # Save to disk and database
-                    file_path = save_media_group_photo(media_group_id, message.message_id, bytes(photo_bytes))
-                    logger.info(f"   💾 Saved media group photo: {file_path}")
+                    file_path = save_media_group_photo(media_group_id, message.message_id, photo_bytes, photo)
+                    update_log.info("   💾 Saved media group photo: %s", file_path)
                     
                     # Check if this is the first photo in the group (has caption)
-                    if sale_message_text:
-                        # Schedule delayed OCR processing for the entire media group
-                        asyncio.create_task(process_sale_media_group_immediate(update, context, media_group_id, tx_info_check))
-                        logger.info(f"   ⏰ Scheduled immediate OCR for media group {media_group_id}")
+                    if sale_message_text and not shed:
+                        # Queue OCR for the entire media group once the other photos are saved;
+                        # the job reads the album's photos when it runs
+                        enqueue_ocr_job('sale_album_prescan', album_job_key('sale_album_prescan', message), {
+                            'update': update.to_dict(),
+                            'media_group_id': media_group_id,
+                            'tx_info': tx_info_check,
+                            'balance_text': balance_snapshot(context)
+                        }, delay=1.5)
                     
                 except Exception as e:
-                    logger.error(f"   ❌ Failed to save media group photo: {e}")
-            else:
-                # Single photo - process immediately
-                await process_sale_receipt_immediate(update, context, tx_info_check)
+                    update_log.error("   ❌ Failed to save media group photo: %s", e)
+            elif not shed:
+                # Single photo - queue for immediate OCR
+                enqueue_ocr_job('sale_prescan', f"sale_prescan:{message.chat_id}:{message.message_id}", {
+                    'update': update.to_dict(),
+                    'tx_info': tx_info_check,
+                    'balance_text': balance_snapshot(context)
+                })
+                ocr_job_worker.notify()
             
             # Don't return here - continue to allow staff to reply later
     
@@ -5168,15 +7539,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Download and save photo to disk
             try:
                 photo = message.photo[-1]
-                photo_file = await context.bot.get_file(photo.file_id)
-                photo_bytes = await photo_file.download_as_bytearray()
+                photo_bytes = await download_photo(context, photo)
                 
                 # Save to disk and database
-                file_path = save_media_group_photo(media_group_id, message.message_id, bytes(photo_bytes))
-                logger.info(f"   💾 Saved media group photo: {file_path}")
+                # OCR workers on other nodes download the photo themselves, using the recorded PhotoSize
+                file_path = save_media_group_photo(media_group_id, message.message_id, photo_bytes, photo)
+                update_log.info("   💾 Saved media group photo: %s", file_path)
                 
             except Exception as e:
-                logger.error(f"   ❌ Failed to save media group photo: {e}")
+                update_log.error("   ❌ Failed to save media group photo: %s", e)
     
     # Check if this is a P2P sell (photo with "fee" in message text)
     # P2P sell can be either direct post OR a reply, but must have "fee" in the message
@@ -5189,19 +7560,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if current_message_text.strip().lower().startswith('p2p sell'):
         tx_info = extract_transaction_info(current_message_text)
         if tx_info.get('type') == 'staff_p2p_sell':
-            logger.info(f"   🔄 Processing Staff P2P SELL transaction: {tx_info['usdt']} USDT -> +{tx_info['mmk']:,.0f} MMK")
+            update_log.info("   🔄 Processing Staff P2P SELL transaction: %s USDT -> +%s MMK",
+                            tx_info['usdt'], format(tx_info['mmk'], ',.0f'))
             await process_staff_p2p_sell(update, context, tx_info)
             return
     
     if 'fee' in current_message_text.lower():
-        logger.info(f"   🔍 Detected P2P sell format (fee in message)")
+        update_log.info("   🔍 Detected P2P sell format (fee in message)")
         tx_info = extract_transaction_info(current_message_text)
         
         if tx_info.get('type') == 'p2p_sell':
             # Check if bank breakdown is provided (no OCR needed)
             if tx_info.get('bank_breakdown'):
-                logger.info(f"   📋 P2P Sell with bank breakdown - no OCR needed")
-                logger.info(f"   🔄 Processing P2P SELL transaction: {tx_info['usdt']} USDT + {tx_info['fee']} fee = {tx_info['mmk']:,.0f} MMK")
+                update_log.info("   📋 P2P Sell with bank breakdown - no OCR needed")
+                update_log.info("   🔄 Processing P2P SELL transaction: %s USDT + %s fee = %s MMK",
+                                tx_info['usdt'], tx_info['fee'], format(tx_info['mmk'], ',.0f'))
                 await process_p2p_sell_with_breakdown(update, context, tx_info)
                 return
             
@@ -5209,48 +7582,20 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if has_photo:
                 # Check if this is a media group
                 if message.media_group_id:
-                    logger.info(f"   📸 P2P Sell media group detected: {message.media_group_id}")
-                    
-                    # Store the media group info in context for collecting photos
-                    if 'p2p_sell_media_groups' not in context.chat_data:
-                        context.chat_data['p2p_sell_media_groups'] = {}
+                    update_log.info("   📸 P2P Sell media group detected: %s", message.media_group_id)
                     
-                    # Initialize media group data with first photo
-                    context.chat_data['p2p_sell_media_groups'][message.media_group_id] = {
+                    # Queue the sell to run once all photos have arrived (8 seconds);
+                    # later photos of the album are added to the queued job
+                    enqueue_ocr_job('p2p_sell_album', album_job_key('p2p_sell_album', message), {
+                        'update': update.to_dict(),
                         'tx_info': tx_info,
-                        'photos': [message.photo[-1]],  # Store photo objects in memory
-                        'update': update,
-                        'message': message
-                    }
-                    logger.info(f"   📷 Stored first photo in memory")
-                    
-                    # Schedule delayed processing to wait for all photos
-                    async def process_p2p_sell_delayed():
-                        await asyncio.sleep(8.0)  # Wait 8 seconds for all photos to arrive
-                        
-                        # Get collected photos from context
-                        mg_data = context.chat_data.get('p2p_sell_media_groups', {}).get(message.media_group_id)
-                        if not mg_data:
-                            logger.warning(f"   ⚠️ Media group data not found for {message.media_group_id}")
-                            return
-                        
-                        photos = mg_data['photos']
-                        tx = mg_data['tx_info']
-                        logger.info(f"   🔄 Processing P2P SELL transaction (delayed): {tx['usdt']} USDT + {tx['fee']} fee = {tx['mmk']:,.0f} MMK")
-                        logger.info(f"   📷 Collected {len(photos)} photos in memory")
-                        
-                        # Process all photos
-                        await process_p2p_sell_with_photos(update, context, tx, photos)
-                        
-                        # Clean up
-                        if message.media_group_id in context.chat_data.get('p2p_sell_media_groups', {}):
-                            del context.chat_data['p2p_sell_media_groups'][message.media_group_id]
-                    
-                    asyncio.create_task(process_p2p_sell_delayed())
+                        'photos': [message.photo[-1].to_dict()]
+                    }, delay=8.0, max_attempts=3)
                     return
                 else:
                     # Single photo - process immediately
-                    logger.info(f"   🔄 Processing P2P SELL transaction: {tx_info['usdt']} USDT + {tx_info['fee']} fee = {tx_info['mmk']:,.0f} MMK")
+                    update_log.info("   🔄 Processing P2P SELL transaction: %s USDT + %s fee = %s MMK",
+                                    tx_info['usdt'], tx_info['fee'], format(tx_info['mmk'], ',.0f'))
                     await process_p2p_sell_transaction(update, context, tx_info)
                     return
             else:
@@ -5260,26 +7605,20 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Handle additional photos in P2P sell media group (photos without caption)
     if has_photo and message.media_group_id:
-        p2p_sell_groups = context.chat_data.get('p2p_sell_media_groups', {})
-        if message.media_group_id in p2p_sell_groups:
-            # Add this photo to the collection in memory
-            p2p_sell_groups[message.media_group_id]['photos'].append(message.photo[-1])
-            photo_count = len(p2p_sell_groups[message.media_group_id]['photos'])
-            logger.info(f"   📷 Added photo to P2P sell group (total: {photo_count})")
+        photo_count = append_ocr_job_photo(album_job_key('p2p_sell_album', message), message.photo[-1].to_dict())
+        if photo_count is not None:
+            update_log.info("   📷 Added photo to P2P sell group (total: %s)", photo_count)
             return
         
         # Handle additional photos in internal transfer media group (photos without caption)
-        internal_transfer_groups = context.chat_data.get('internal_transfer_media_groups', {})
-        if message.media_group_id in internal_transfer_groups:
-            # Add this photo to the collection in memory
-            internal_transfer_groups[message.media_group_id]['photos'].append(message.photo[-1])
-            photo_count = len(internal_transfer_groups[message.media_group_id]['photos'])
-            logger.info(f"   📷 Added photo to internal transfer group (total: {photo_count})")
+        photo_count = append_ocr_job_photo(album_job_key('internal_transfer_album', message), message.photo[-1].to_dict())
+        if photo_count is not None:
+            update_log.info("   📷 Added photo to internal transfer group (total: %s)", photo_count)
             return
     
     # Regular Buy/Sell transactions require a reply
     if not message.reply_to_message or not message.photo:
-        logger.info(f"   ⏭️ Skipping: Not a photo reply")
+        update_log.info("   ⏭️ Skipping: Not a photo reply")
         return
     
     # If the original message is part of a media group and not in database, 
@@ -5290,19 +7629,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if not stored_photos:
             # Media group not in database - try to fetch adjacent messages
-            logger.info(f"   📥 Fetching media group {original_media_group_id} photos...")
+            update_log.info("   📥 Fetching media group %s photos...", original_media_group_id)
             original_msg_id = message.reply_to_message.message_id
             chat_id = message.reply_to_message.chat.id
             
             # Store the original message's photo first
             try:
                 orig_photo = message.reply_to_message.photo[-1]
-                orig_file = await context.bot.get_file(orig_photo.file_id)
-                orig_bytes = await orig_file.download_as_bytearray()
-                save_media_group_photo(original_media_group_id, original_msg_id, bytes(orig_bytes))
-                logger.info(f"   💾 Saved original photo (msg {original_msg_id})")
+                orig_bytes = await download_photo(context, orig_photo)
+                save_media_group_photo(original_media_group_id, original_msg_id, orig_bytes)
+                update_log.info("   💾 Saved original photo (msg %s)", original_msg_id)
             except Exception as e:
-                logger.error(f"   ❌ Failed to save original photo: {e}")
+                update_log.error("   ❌ Failed to save original photo: %s", e)
             
             # Try to fetch adjacent messages (forward direction)
             for offset in range(1, 10):
@@ -5315,10 +7653,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     )
                     if forwarded.photo:
                         # Download and save
-                        fwd_file = await context.bot.get_file(forwarded.photo[-1].file_id)
-                        fwd_bytes = await fwd_file.download_as_bytearray()
-                        save_media_group_photo(original_media_group_id, msg_id, bytes(fwd_bytes))
-                        logger.info(f"   💾 Saved adjacent photo (msg {msg_id})")
+                        fwd_bytes = await download_photo(context, forwarded.photo[-1])
+                        save_media_group_photo(original_media_group_id, msg_id, fwd_bytes)
+                        update_log.info("   💾 Saved adjacent photo (msg %s)", msg_id)
                         await context.bot.delete_message(chat_id=chat_id, message_id=forwarded.message_id)
                     else:
                         await context.bot.delete_message(chat_id=chat_id, message_id=forwarded.message_id)
@@ -5338,10 +7675,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         message_id=msg_id
                     )
                     if forwarded.photo:
-                        fwd_file = await context.bot.get_file(forwarded.photo[-1].file_id)
-                        fwd_bytes = await fwd_file.download_as_bytearray()
-                        save_media_group_photo(original_media_group_id, msg_id, bytes(fwd_bytes))
-                        logger.info(f"   💾 Saved adjacent photo (msg {msg_id})")
+                        fwd_bytes = await download_photo(context, forwarded.photo[-1])
+                        save_media_group_photo(original_media_group_id, msg_id, fwd_bytes)
+                        update_log.info("   💾 Saved adjacent photo (msg %s)", msg_id)
                         await context.bot.delete_message(chat_id=chat_id, message_id=forwarded.message_id)
                     else:
                         await context.bot.delete_message(chat_id=chat_id, message_id=forwarded.message_id)
@@ -5351,12 +7687,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             # Check how many photos we collected
             stored_photos = get_media_group_photos(original_media_group_id)
-            logger.info(f"   📦 Collected {len(stored_photos)} photos for media group {original_media_group_id}")
+            update_log.info("   📦 Collected %s photos for media group %s", len(stored_photos), original_media_group_id)
     
     # Check if staff is sending multiple photos as a media group (USDT receipts)
     # This must be checked BEFORE the text check, because only the first photo has caption
     if message.media_group_id:
-        logger.info(f"   📸 Staff media group detected: {message.media_group_id}")
+        update_log.info("   📸 Staff media group detected: %s", message.media_group_id)
         
         # Check for staff P2P sell format first (no OCR needed even with photos)
         staff_text = message.text or message.caption or ""
@@ -5367,43 +7703,41 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if text_to_check and text_to_check.strip().lower().startswith('p2p sell'):
                 tx_info = extract_transaction_info(text_to_check)
                 if tx_info.get('type') == 'staff_p2p_sell':
-                    logger.info(f"   🔄 Processing Staff P2P SELL transaction (with photos): {tx_info['usdt']} USDT -> +{tx_info['mmk']:,.0f} MMK")
+                    update_log.info("   🔄 Processing Staff P2P SELL transaction (with photos): %s USDT -> +%s MMK",
+                                    tx_info['usdt'], format(tx_info['mmk'], ',.0f'))
                     await process_staff_p2p_sell(update, context, tx_info)
                     return
         
-        # Initialize media group storage if not exists
-        if message.media_group_id not in media_groups:
-            # Get original_text from the first photo's caption or reply message
-            original_text = message.reply_to_message.text or message.reply_to_message.caption
-            staff_text = message.text or message.caption or ""
-            
-            # If original has no text but staff caption has transaction info, use that
-            if not original_text and staff_text:
-                tx_info_check = extract_transaction_info(staff_text)
-                if tx_info_check.get('type'):
-                    original_text = staff_text
-                    logger.info(f"   📝 Using staff reply text as transaction info")
-            
-            if not original_text:
-                logger.info(f"   ⏭️ Skipping media group: No transaction text found")
-                return
-            
-            media_groups[message.media_group_id] = {
-                'photos': [],
-                'message': message,
-                'original_text': original_text
-            }
-            logger.info(f"   📦 Created new media group storage")
+        # Add this photo to the group's queued job, if the group already has one
+        job_key = album_job_key('staff_album', message)
+        photo_count = append_ocr_job_photo(job_key, message.photo[-1].to_dict())
+        if photo_count is not None:
+            update_log.info("   ➕ Added photo to media group. Total photos: %s", photo_count)
+            return
+        
+        # First photo of the group - get original_text from the reply message or the caption
+        original_text = message.reply_to_message.text or message.reply_to_message.caption
+        staff_text = message.text or message.caption or ""
+        
+        # If original has no text but staff caption has transaction info, use that
+        if not original_text and staff_text:
+            tx_info_check = extract_transaction_info(staff_text)
+            if tx_info_check.get('type'):
+                original_text = staff_text
+                update_log.info("   📝 Using staff reply text as transaction info")
         
-        # Add this photo to the group
-        media_groups[message.media_group_id]['photos'].append(message.photo[-1])
-        photo_count = len(media_groups[message.media_group_id]['photos'])
-        logger.info(f"   ➕ Added photo to media group. Total photos: {photo_count}")
+        if not original_text:
+            update_log.info("   ⏭️ Skipping media group: No transaction text found")
+            return
         
-        # Only schedule processing once (from the first photo)
-        if photo_count == 1:
-            logger.info(f"   ⏰ Scheduling media group processing for {message.media_group_id}")
-            asyncio.create_task(process_media_group_delayed(update, context, message.media_group_id))
+        # Process once the rest of the photos have arrived (1.5 seconds)
+        update_log.info("   ⏰ Scheduling media group processing for %s", message.media_group_id)
+        enqueue_ocr_job('staff_album', job_key, {
+            'update': update.to_dict(),
+            'media_group_id': message.media_group_id,
+            'original_text': original_text,
+            'photos': [message.photo[-1].to_dict()]
+        }, delay=1.5, max_attempts=3)
         
         return
     
@@ -5418,38 +7752,308 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             tx_info_check = extract_transaction_info(staff_text)
             if tx_info_check.get('type'):
                 original_text = staff_text
-                logger.info(f"   📝 Using staff reply text as transaction info")
+                update_log.info("   📝 Using staff reply text as transaction info")
     
     if not original_text:
-        logger.info(f"   ⏭️ Skipping: Original message has no text")
+        update_log.info("   ⏭️ Skipping: Original message has no text")
         return
     
-    logger.info(f"   Original message: '{original_text[:80]}...'")
+    update_log.info("   Original message: '%.80s...'", original_text)
     
     # Extract transaction info from original text
     tx_info = extract_transaction_info(original_text)
     
     # Check if transaction type is valid (Buy or Sell)
     if not tx_info['type']:
-        logger.info(f"   ⏭️ Skipping: Not a Buy/Sell transaction message")
+        update_log.info("   ⏭️ Skipping: Not a Buy/Sell transaction message")
         return
     
     # Allow transactions with 0 or missing amounts - will use OCR to detect
     if tx_info.get('usdt') is None or tx_info.get('mmk') is None or tx_info.get('usdt') == 0 or tx_info.get('mmk') == 0:
-        logger.warning(f"   ⚠️ Transaction has invalid amounts (USDT: {tx_info.get('usdt')}, MMK: {tx_info.get('mmk')}) - Will use OCR to detect amounts")
+        update_log.warning("   ⚠️ Transaction has invalid amounts (USDT: %s, MMK: %s) - Will use OCR to detect amounts",
+                           tx_info.get('usdt'), tx_info.get('mmk'))
         # Set to 0 if None to avoid errors
         if tx_info.get('usdt') is None:
             tx_info['usdt'] = 0
         if tx_info.get('mmk') is None:
             tx_info['mmk'] = 0
     
-    logger.info(f"   🔄 Processing {tx_info['type'].upper()} transaction: {tx_info['usdt']} USDT = {tx_info['mmk']:,.0f} MMK")
+    update_log.info("   🔄 Processing %s transaction: %s USDT = %s MMK",
+                    tx_info['type'].upper(), tx_info['usdt'], format(tx_info['mmk'], ',.0f'))
     
     if tx_info['type'] == 'buy':
         await process_buy_transaction(update, context, tx_info)
     elif tx_info['type'] == 'sell':
         await process_sell_transaction(update, context, tx_info)
 
+# ============================================================================
+# OCR JOB WORKER
+# ============================================================================
+
+def album_job_key(kind, message):
+    """Dedupe key shared by every photo of a media group"""
+    return f"{kind}:{message.chat_id}:{message.media_group_id}"
+
+def _job_context(application, payload):
+    """Rebuild the update and handler context a job was queued from"""
+    from telegram import Update
+    update = Update.de_json(payload['update'], application.bot)
+    context = application.context_types.context.from_update(update, application)
+    if update.effective_message:
+        correlation_id.set(transaction_key(update.effective_message))
+    current_message.set(update.message)
+    current_context.set(context)
+    return update, context
+
+def _job_photos(application, payload):
+    from telegram import PhotoSize
+    return [PhotoSize.de_json(photo, application.bot) for photo in payload['photos']]
+
+def balance_snapshot(context):
+    """Current balance message text, queued with pre-scans for OCR workers in other processes"""
+    balances = context.chat_data.get('balances')
+    if not balances:
+        return None
+    return format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks'))
+
+def _prescan_context(application, payload):
+    update, context = _job_context(application, payload)
+    if OCR_WORKER_PROCESS and payload.get('balance_text'):
+        # Worker processes see no balance posts; use the balance as it was when the sale arrived
+        context.chat_data['balances'] = parse_balance_message(payload['balance_text'])
+    if not context.chat_data.get('balances'):
+        # Retried with backoff - after a restart the balance arrives with the next balance post
+        raise RuntimeError("balance not loaded")
+    return update, context
+
+async def run_sale_prescan_job(application, payload):
+    update, context = _prescan_context(application, payload)
+    await process_sale_receipt_immediate(update, context, payload['tx_info'])
+
+async def run_sale_album_prescan_job(application, payload):
+    from telegram import PhotoSize
+    update, context = _prescan_context(application, payload)
+    # The album as saved by now, not as it was when the job was queued after its first photo
+    photos = {entry['message_id']: entry['photo'] for entry in payload.get('photos', [])}
+    photos.update(get_media_group_telegram_photos(payload['media_group_id']))
+    photos_by_message = {message_id: PhotoSize.de_json(photo, application.bot) for message_id, photo in photos.items()}
+    await process_sale_media_group_immediate(update, context, payload['media_group_id'], payload['tx_info'],
+                                             photos_by_message)
+
+def _ledger_job_context(application, payload):
+    update, context = _job_context(application, payload)
+    if not context.chat_data.get('balances'):
+        # The handler would only alert and return; retried with backoff until a balance is loaded
+        raise RuntimeError("balance not loaded")
+    return update, context
+
+def transaction_chain(application, update):
+    """Hold the update chain of the transaction `update` belongs to
+
+    Jobs that change balances run in it, after the updates of their
+    transaction that arrived before them and before the ones that follow.
+    """
+    processor = application.update_processor
+    if isinstance(processor, UpdateChains):
+        return processor.chain(processor.serialization_key(update))
+    return nullcontext()
+
+async def run_p2p_sell_album_job(application, payload):
+    update, context = _ledger_job_context(application, payload)
+    photos = _job_photos(application, payload)
+    tx = payload['tx_info']
+    logger.info("   🔄 Processing P2P SELL transaction (delayed): %s USDT + %s fee = %s MMK",
+                tx['usdt'], tx['fee'], format(tx['mmk'], ',.0f'))
+    logger.info("   📷 Collected %s photos", len(photos))
+    async with transaction_chain(application, update):
+        await process_p2p_sell_with_photos(update, context, tx, photos)
+
+async def run_internal_transfer_album_job(application, payload):
+    update, context = _ledger_job_context(application, payload)
+    photos = _job_photos(application, payload)
+    logger.info("   🔄 Processing internal transfer with %s receipts", len(photos))
+    async with transaction_chain(application, update):
+        await process_internal_transfer_with_photos(
+            update, context,
+            payload['from_full_name'],
+            payload['to_full_name'],
+            photos
+        )
+
+async def run_staff_album_job(application, payload):
+    update, context = _ledger_job_context(application, payload)
+    photos = _job_photos(application, payload)
+    async with transaction_chain(application, update):
+        await process_media_group(update, context, payload['media_group_id'], photos, payload['original_text'])
+
+OCR_JOB_HANDLERS = {
+    'sale_prescan': run_sale_prescan_job,
+    'sale_album_prescan': run_sale_album_prescan_job,
+    'p2p_sell_album': run_p2p_sell_album_job,
+    'internal_transfer_album': run_internal_transfer_album_job,
+    'staff_album': run_staff_album_job,
+}
+# Pure OCR jobs (results go to sale_receipt_ocr) that `--worker` processes can take;
+# the other kinds change balances and always run in the bot process
+OCR_PRESCAN_KINDS = ('sale_prescan', 'sale_album_prescan')
+
+class OcrJobWorker:
+    """Runs jobs from the ocr_jobs table.
+
+    `concurrency` loops each claim one due job at a time under a lease. A job
+    that raises is requeued with exponential backoff until its attempts run
+    out; a job whose process died mid-run is claimed again once its lease
+    expires. Completion only counts while the lease is still held, so a job
+    taken over by another worker is finished exactly once.
+
+    The lease is renewed in the background while a job runs, including while
+    it waits for its transaction's chain or an admission slot. Pre-scans are
+    cut off lease_seconds after they are admitted. Jobs that change balances
+    are not: cancelled halfway they would leave a transaction half applied,
+    so they run to the end.
+    """
+
+    POLL_INTERVAL = 1.0
+    RETRY_BASE_DELAY = 5.0
+
+    def __init__(self, concurrency, lease_seconds, kinds=None):
+        self.concurrency = max(1, concurrency)
+        self.lease_seconds = lease_seconds
+        self.kinds = kinds
+        self.owner = f"{os.getpid()}-{int(time.time())}"
+        self.application = None
+        self._tasks = []
+        self._stopping = False
+        self._wakeup = None
+        self.running = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self, application):
+        if self._tasks:
+            return
+        self.application = application
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        cleanup_old_ocr_jobs()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        db_url = os.getenv('DATABASE_URL')
+        if db_url and db_url.startswith('postgres'):
+            self._tasks.append(asyncio.create_task(asyncio.to_thread(self._listen, db_url, asyncio.get_running_loop())))
+        kinds = ', '.join(self.kinds) if self.kinds else 'all kinds'
+        logger.info("🧵 OCR job worker %s started (%s loops, %s)", self.owner, self.concurrency, kinds)
+
+    def notify(self):
+        """Wake idle loops now instead of at the next poll, for jobs that are due immediately"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self, timeout=30):
+        """Let running jobs finish; jobs still running after `timeout` are picked up again after restart"""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        self._tasks = []
+        logger.info("🧵 OCR job worker stopped: %s done, %s retried, %s failed, %s left to lease expiry",
+                    self.completed, self.retried, self.failed, len(pending))
+
+    def _listen(self, db_url, loop):
+        """Wake the loops on NOTIFY from enqueue_ocr_job, so jobs queued by other processes start without polling delay"""
+        while not self._stopping:
+            try:
+                import psycopg
+                with psycopg.connect(db_url, autocommit=True) as conn:
+                    conn.execute('LISTEN ocr_jobs')
+                    while not self._stopping:
+                        for _ in conn.notifies(timeout=1.0, stop_after=1):
+                            loop.call_soon_threadsafe(self.notify)
+            except Exception as e:
+                logger.warning("OCR job listener disconnected (%s), reconnecting", e)
+                time.sleep(5)
+
+    async def _run(self):
+        # Jobs left over from before a restart need the ledger the warm-up restores
+        await warmup.wait()
+        while not self._stopping:
+            try:
+                job = await asyncio.to_thread(claim_ocr_job, self.owner, self.lease_seconds, self.kinds)
+            except Exception as e:
+                logger.error("Error claiming OCR job: %s", e)
+                job = None
+            
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            await self._execute(job)
+
+    async def _keep_lease(self, job):
+        """Renew the lease of a running job until cancelled"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await asyncio.to_thread(renew_ocr_job_lease, job['id'], self.owner, self.lease_seconds)
+            except Exception as e:
+                logger.warning("Could not renew lease of job %s: %s", job['dedupe_key'], e)
+                continue
+            if not renewed:
+                logger.warning("Job %s lease was lost while it ran", job['dedupe_key'])
+                return
+
+    async def _execute(self, job):
+        handler = OCR_JOB_HANDLERS.get(job['kind'])
+        self.running += 1
+        started = time.monotonic()
+        span = tracer.new_span(f"job {job['kind']}", job['payload'].get('trace'), SPAN_KIND_CONSUMER,
+                               {'job.attempt': job['attempts']}) if tracer.enabled else None
+        try:
+            if handler is None:
+                raise ValueError(f"unknown job kind '{job['kind']}'")
+            keepalive = asyncio.create_task(self._keep_lease(job))
+            token = job_timeout.set(self.lease_seconds if job['kind'] in OCR_PRESCAN_KINDS else None)
+            try:
+                with tracer.activate(span) if span else NO_SPAN:
+                    # In a copy of the worker's context: the correlation id, message and handler
+                    # context the job sets must not carry over to the next job this task runs
+                    await asyncio.create_task(handler(self.application, job['payload']),
+                                              context=contextvars.copy_context())
+            finally:
+                job_timeout.reset(token)
+                keepalive.cancel()
+        except Exception as e:
+            delay = self.RETRY_BASE_DELAY * 2 ** (job['attempts'] - 1)
+            error = f"{type(e).__name__}: {e}"
+            state = await asyncio.to_thread(fail_ocr_job, job['id'], self.owner, error, delay)
+            if state == 'failed':
+                self.failed += 1
+                logger.error("❌ Job %s failed after %s attempt(s): %s", job['dedupe_key'], job['attempts'], error)
+                logger.error(traceback.format_exc())
+            elif state == 'queued':
+                self.retried += 1
+                logger.warning("⚠️ Job %s attempt %s failed (%s), retrying in %.0fs",
+                               job['dedupe_key'], job['attempts'], error, delay)
+            else:
+                logger.warning("Job %s lease was lost while it ran", job['dedupe_key'])
+        else:
+            if await asyncio.to_thread(complete_ocr_job, job['id'], self.owner):
+                self.completed += 1
+                logger.info("✅ Job %s done in %.1fs", job['dedupe_key'], time.monotonic() - started)
+            else:
+                logger.warning("Job %s finished after its lease was lost", job['dedupe_key'])
+        finally:
+            self.running -= 1
+
+ocr_job_worker = OcrJobWorker(OCR_JOB_WORKERS, OCR_JOB_LEASE_SECONDS)
+
 # ============================================================================
 # COMMANDS
 # ============================================================================
@@ -5467,6 +8071,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "<b>Commands:</b>\n"
         "/start - Status and help\n"
         "/balance - Show current balance\n"
+        "/post_balance - Post balance to the balance topic now\n"
+        "/pending - List sales still waiting for a staff reply\n"
         "/load - Load balance from message\n"
         "/set_user - Set user prefix (reply to user's message)\n"
         "/list_users - List all user-prefix mappings\n"
@@ -5485,6 +8091,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/edit_usdt_bank - Edit existing USDT wallet\n"
         "/remove_usdt_bank - Remove USDT wallet\n\n"
         "<b>System:</b>\n"
+        "/stats - Show runtime counters\n"
         "/test - Test connection and configuration",
         parse_mode='HTML'
     )
@@ -5497,8 +8104,113 @@ async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_command_response(context, "❌ No balance loaded")
         return
     
-    msg = format_balance_message(balances['mmk_banks'], balances['usdt_banks'], balances.get('thb_banks', []))
-    await send_command_response(context, f"📊 <b>Balance:</b>\n\n<pre>{msg}</pre>", parse_mode='HTML')
+    totals = balances.totals()
+    totals_line = f"<b>Total:</b> {totals['mmk_banks']:,.0f} MMK | {totals['usdt_banks']:,.4f} USDT"
+    if balances.get('thb_banks'):
+        totals_line += f" | {totals['thb_banks']:,.0f} THB"
+    # Leave room for the title, the <pre> tags and the totals line
+    parts = render_balance_parts(balances, limit=TELEGRAM_MAX_MESSAGE_LENGTH - 300)
+    for number, part in enumerate(parts, 1):
+        title = "📊 <b>Balance:</b>\n\n" if number == 1 else ""
+        footer = f"\n{totals_line}" if number == len(parts) else ""
+        await send_command_response(context, f"{title}<pre>{part}</pre>{footer}", parse_mode='HTML')
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show runtime counters: update chains, balance posts, the outbound queue, OCR jobs and pending sales"""
+    lines = ["📈 <b>Runtime Stats</b>\n"]
+    
+    processor = context.application.update_processor
+    if isinstance(processor, UpdateChains):
+        stats = processor.stats()
+        lines.append("<b>Updates:</b>")
+        lines.append(f"Processed: {stats['processed']}")
+        lines.append(f"Active chains: {stats['active_chains']} ({stats['queued']} queued)")
+        lines.append(f"Max chain depth: {stats['max_depth']}")
+        for key, depth in stats['busiest']:
+            lines.append(f"  <code>{key}</code>: {depth}")
+        lines.append("")
+    
+    lines.append(f"<b>Startup:</b> {startup.summary()}")
+    lines.append(f"<b>Warm-up:</b> {warmup.summary()}")
+    lines.append(f"<b>Logging:</b> {log_pipeline.summary()}")
+    lines.append(f"<b>Tracing:</b> {tracer.summary()}")
+    lines.append("")
+    lines.append("<b>Balance posts:</b>")
+    lines.append(f"Posted: {balance_publisher.published}, coalesced: {balance_publisher.suppressed}")
+    lines.append(f"Multi-part balances assembled: {balance_parts.completed}")
+    lines.append(f"Loaded from topic: {balance_ingest.loaded}, skipped: {balance_ingest.skipped_current} unchanged, "
+                 f"{balance_ingest.skipped_stale} stale")
+    lines.append("")
+    lines.append("<b>Outbound:</b>")
+    lines.append(f"Sent: {outbound.sent}, merged: {outbound.merged}, flood retries: {outbound.retried}, failed: {outbound.failed}")
+    lines.append(f"Queued: {outbound.depth}")
+    lines.append("")
+    
+    lines.append("<b>Admission:</b>")
+    lines.append("In flight: " + ", ".join(f"{kind} {admission.in_flight[kind]}/{limit}" for kind, limit in admission.limits.items()))
+    lines.append(f"Backlog: {admission.backlog} (peak {admission.peak_backlog}), notices: {admission.notices}")
+    lines.append(f"Pre-scans deferred: {admission.deferred}, shed: {admission.shed}")
+    lines.append("")
+    
+    jobs = get_ocr_job_counts()
+    lines.append("<b>OCR jobs:</b>")
+    lines.append(f"Queued: {jobs['queued']}, running: {jobs['running']}, done: {jobs['done']}, failed: {jobs['failed']}")
+    if jobs['oldest_due_age']:
+        lines.append(f"Oldest waiting: {jobs['oldest_due_age']:.0f}s")
+    lines.append(f"This worker: {ocr_job_worker.completed} done, {ocr_job_worker.retried} retried, {ocr_job_worker.failed} failed")
+    lines.append("")
+    lines.append("<b>Pending sales:</b>")
+    lines.append(f"Open: {len(pending_transactions)}, expired: {pending_transactions.expired}, evicted: {pending_transactions.evicted}")
+    lines.append(f"Replayed messages skipped: {processed_messages.replays}")
+    lines.append(f"Duplicate receipts flagged: {receipt_index.duplicates}, OCR answers reused: {receipt_index.ocr_reused}")
+    lines.append(f"Photo cache: {len(photo_cache)} photos, {photo_cache.size / 1048576:.1f} MB, "
+                 f"{photo_cache.hits} hits, {photo_cache.misses} downloads, {photo_cache.coalesced} shared")
+    lines.append(f"Receipt buffers: {receipt_buffers.live / 1048576:.1f} MB live (peak {receipt_buffers.peak_live / 1048576:.1f}), "
+                 f"OCR in flight {receipt_buffers.in_flight / 1048576:.1f} MB (peak {receipt_buffers.peak_in_flight / 1048576:.1f}, "
+                 f"{receipt_buffers.waits} waits)")
+    
+    await send_command_response(context, "\n".join(lines), parse_mode='HTML')
+
+async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List sale messages still waiting for a staff reply: /pending [minutes] (default 30)"""
+    minutes = 30
+    if context.args:
+        try:
+            minutes = max(0, int(context.args[0]))
+        except ValueError:
+            await send_command_response(context, "Usage: /pending [minutes]")
+            return
+    
+    entries = pending_transactions.older_than(minutes * 60)
+    if not entries:
+        await send_command_response(context, f"✅ No unmatched sales older than {minutes} min")
+        return
+    
+    now = time.time()
+    lines = [f"⏳ <b>Unmatched sales older than {minutes} min:</b> {len(entries)}\n"]
+    for entry in entries[:30]:
+        age = int((now - entry['created_at']) // 60)
+        age_text = f"{age // 60}h {age % 60}m" if age >= 60 else f"{age}m"
+        if entry['type'] == 'buy':
+            amount = f"{entry.get('expected_usdt', 0):.4f} USDT"
+        else:
+            amount = f"{entry.get('detected_mmk', entry.get('mmk_amount', 0)):,.0f} MMK"
+        lines.append(f"• <code>{entry['message_id']}</code> {entry['type'].upper()} {amount} "
+                     f"by @{entry.get('sender_name', '?')} - {age_text} ago")
+    if len(entries) > 30:
+        lines.append(f"... and {len(entries) - 30} more")
+    
+    await send_command_response(context, "\n".join(lines), parse_mode='HTML')
+
+async def post_balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Post the current balance to the balance topic immediately, skipping the coalescing window"""
+    balances = context.chat_data.get('balances')
+    
+    if not balances:
+        await send_command_response(context, "❌ No balance loaded")
+        return
+    
+    await publish_balance(context, force=True)
 
 async def load_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Load balance from replied message"""
@@ -5509,7 +8221,10 @@ async def load_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     balances = parse_balance_message(update.message.reply_to_message.text)
     
     if balances:
-        context.chat_data['balances'] = balances
+        async with ledger_lock:
+            context.chat_data['balances'] = balances
+            save_ledger_snapshot(balances)
+            balance_ingest.loaded_ledger(balances, update.message.reply_to_message.text)
         thb_count = len(balances.get('thb_banks', []))
         thb_info = f"\nTHB Banks: {thb_count}" if thb_count > 0 else ""
         await send_command_response(
@@ -5519,6 +8234,8 @@ async def load_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"USDT Banks: {len(balances['usdt_banks'])}"
             f"{thb_info}"
         )
+    elif BALANCE_PART_HEADER.search(update.message.reply_to_message.text):
+        await send_command_response(context, "🧩 Balance part stored. Reply /load to the remaining parts")
     else:
         await send_command_response(context, "❌ Could not parse balance")
 
@@ -6289,6 +9006,485 @@ async def remove_usdt_bank_command(update: Update, context: ContextTypes.DEFAULT
             parse_mode='HTML'
         )
 
+# ============================================================================
+# WEBHOOK / HEALTH HTTP SERVER
+# ============================================================================
+
+class WebhookServer:
+    """Minimal asyncio HTTP/1.1 server for Telegram webhooks and health checks.
+
+    POST WEBHOOK_PATH verifies the secret token header, decodes the update and
+    puts it on the application's update queue. GET /health reports liveness,
+    with 503 until the startup warm-up is done.
+    While draining for shutdown, webhook posts get 503 so Telegram keeps the
+    update and redelivers it to the next instance instead of losing it.
+    """
+
+    MAX_BODY_BYTES = 1024 * 1024
+
+    def __init__(self, application, port, accept_updates):
+        self.application = application
+        self.port = port
+        self.accept_updates = accept_updates
+        self.draining = False
+        self.received = 0
+        self.rejected = 0
+        self.started_at = time.monotonic()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, host='0.0.0.0', port=self.port)
+        logger.info(f"🌐 HTTP server listening on port {self.port}" + (f" (webhook at {WEBHOOK_PATH})" if self.accept_updates else ""))
+
+    async def stop(self):
+        self.draining = True
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        status, body = 500, b'{"ok": false}'
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            
+            length = int(headers.get('content-length') or 0)
+            if length > self.MAX_BODY_BYTES:
+                status, body = 413, b'{"ok": false}'
+            else:
+                payload = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b''
+                status, body = await self._route(method, path.split('?', 1)[0], headers, payload)
+        except Exception as e:
+            logger.warning("Bad HTTP request: %s", e)
+            status, body = 400, b'{"ok": false}'
+        
+        reason = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+                  413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}.get(status, 'OK')
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, headers, payload):
+        if method == 'GET' and path in ('/', '/health'):
+            ok = warmup.ready and not self.draining
+            health = {
+                'ok': ok,
+                'ready': warmup.ready,
+                'mode': BOT_MODE,
+                'uptime_seconds': round(time.monotonic() - self.started_at),
+                'updates_received': self.received
+            }
+            return (200 if ok else 503), json.dumps(health).encode()
+        
+        if not (self.accept_updates and method == 'POST' and path == WEBHOOK_PATH):
+            return 404, b'{"ok": false}'
+        
+        if not hmac.compare_digest(
+            headers.get('x-telegram-bot-api-secret-token', '').encode(), WEBHOOK_SECRET.encode()
+        ):
+            self.rejected += 1
+            logger.warning("Rejected webhook request with a bad secret token")
+            return 403, b'{"ok": false}'
+        
+        if self.draining:
+            return 503, b'{"ok": false}'
+        
+        from telegram import Update
+        update = Update.de_json(json.loads(payload), self.application.bot)
+        await self.application.update_queue.put(update)
+        self.received += 1
+        return 200, b'{"ok": true}'
+
+async def run_webhook(app):
+    """Run the application fed by the built-in webhook server until SIGINT/SIGTERM.
+
+    Telegram keeps undelivered webhook updates while the bot restarts, so with
+    DROP_PENDING_UPDATES=0 they are replayed once the new instance is up.
+    Switching back to polling needs no manual step: start_polling deletes the
+    webhook before the first getUpdates.
+    """
+    from telegram import Update
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    server = WebhookServer(app, PORT or 8443, accept_updates=True)
+    await app.initialize()
+    await on_start(app)
+    await app.start()
+    await server.start()
+    try:
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=bool(DROP_PENDING_UPDATES)
+        )
+        logger.info("🔗 Webhook set to %s", WEBHOOK_URL + WEBHOOK_PATH)
+        await stop_event.wait()
+    finally:
+        logger.info("🛑 Shutting down webhook mode")
+        # Stop taking updates first; Telegram retries anything we refuse
+        await server.stop()
+        await app.stop()
+        await on_stop(app)
+        await app.shutdown()
+
+# ============================================================================
+# STARTUP
+# ============================================================================
+
+class StartupClock:
+    """Boot milestones, in seconds from the start of the bot module import.
+
+    Logs how long the import took, when the warm-up finished and updates
+    started being handled (checked against STARTUP_TARGET_SECONDS) and when
+    the first update had been handled - on a restart with queued updates,
+    the time users waited.
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.imported = None
+        self.ready = None
+        self.first_update = None
+
+    def mark_imported(self):
+        self.imported = time.perf_counter() - self.started
+
+    def mark_ready(self):
+        if self.ready is not None:
+            return
+        self.ready = time.perf_counter() - self.started
+        message = (f"⏱️ Ready {self.ready:.2f}s after start "
+                   f"(import {self.imported * 1000:.0f} ms, target {STARTUP_TARGET_SECONDS}s)")
+        if self.ready > STARTUP_TARGET_SECONDS:
+            logger.warning(message + " - over target")
+        else:
+            logger.info(message)
+
+    def mark_first_update(self):
+        if self.first_update is not None:
+            return
+        self.first_update = time.perf_counter() - self.started
+        logger.info("⏱️ First update handled %.2fs after start", self.first_update)
+
+    def summary(self):
+        parts = [f"import {self.imported * 1000:.0f} ms" if self.imported is not None else "import -"]
+        parts.append(f"ready {self.ready:.2f}s" if self.ready is not None else "not ready")
+        if self.first_update is not None:
+            parts.append(f"first update {self.first_update:.2f}s")
+        return ", ".join(parts)
+
+startup = StartupClock(IMPORT_STARTED)
+
+class WarmUp:
+    """Pays the cold costs of a restart before the first update does.
+
+    Opens the database connection the handlers use and reads the user, bank
+    and wallet registries through it, restores the ledger saved by the last
+    balance change (save_ledger_snapshot), and connects to the OpenAI API as
+    set by OCR_WARMUP. Telegram is already connected by then: initialize()
+    calls getMe, and file downloads use the same connection pool.
+
+    Updates and OCR jobs wait in wait() until the warm-up is done, for at
+    most WARMUP_TIMEOUT_SECONDS. A step that fails is logged and skipped, so
+    a warm-up problem delays the bot but never keeps it down.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.steps = {}  # step -> milliseconds
+        self.failed = []
+        self.duration = None
+        self.held = 0
+        self.timed_out = 0
+        self._done = asyncio.Event()
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    async def wait(self):
+        """Return once the warm-up is done, or after the timeout"""
+        if self._done.is_set():
+            return
+        self.held += 1
+        try:
+            await asyncio.wait_for(self._done.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            logger.warning("⚠️ Warm-up still running after %ss, handling the update anyway", self.timeout)
+
+    async def run(self, application, ledger=True):
+        started = time.perf_counter()
+        steps = []
+        if OCR_WARMUP:
+            # First, so its thread is connecting while the database steps run on the loop
+            steps.append(self._step('ocr', self._warm_ocr))
+        steps.append(self._step('database', self._warm_database))
+        if ledger:
+            steps.append(self._step('ledger', self._restore_ledger, application))
+        try:
+            await asyncio.gather(*steps)
+        finally:
+            self.duration = time.perf_counter() - started
+            self._done.set()
+        logger.info("🔥 Warm-up done: %s", self.summary())
+        startup.mark_ready()
+
+    async def _step(self, name, step, *args):
+        started = time.perf_counter()
+        try:
+            await step(*args)
+        except Exception as e:
+            self.failed.append(name)
+            logger.warning("⚠️ Warm-up step %s failed: %s: %s", name, type(e).__name__, str(e)[:200])
+        finally:
+            self.steps[name] = (time.perf_counter() - started) * 1000
+
+    async def _warm_ocr(self):
+        from openai import APIStatusError
+        
+        # Builds the client (importing openai) off the loop, then opens its TLS connection
+        client = await asyncio.to_thread(openai_client)
+        probe = client.with_options(max_retries=0, timeout=10.0)
+        try:
+            await asyncio.to_thread(probe.models.retrieve, OCR_MODEL)
+        except APIStatusError as e:
+            # The server answered, so the connection is open; OpenAI-compatible servers may not serve /models
+            logger.info("🔥 OCR API connected (model lookup answered %s)", e.status_code)
+        if OCR_WARMUP >= 2:
+            await asyncio.to_thread(
+                probe.chat.completions.create,
+                model=OCR_MODEL,
+                messages=[{"role": "user", "content": "ping"}],
+                max_tokens=1
+            )
+
+    async def _warm_database(self):
+        # Handlers query from the event loop thread, so this opens the connection they will use
+        users = get_all_user_prefixes()
+        mmk_accounts = get_all_mmk_bank_accounts()
+        usdt_accounts = get_all_usdt_bank_accounts()
+        get_receiving_usdt_account()
+        logger.info("🔥 Registries read: %s users, %s MMK accounts, %s USDT wallets",
+                    len(users), len(mmk_accounts), len(usdt_accounts))
+
+    async def _restore_ledger(self, application):
+        chat_data = application.chat_data[TARGET_GROUP_ID]
+        if chat_data.get('balances'):
+            return
+        balances = load_ledger_snapshot()
+        if not balances:
+            logger.info("🔥 No saved ledger, waiting for a balance post")
+            return
+        chat_data['balances'] = balances
+        balance_ingest.loaded_ledger(balances)
+        logger.info("🔥 Ledger restored: %s MMK banks, %s USDT banks",
+                    len(balances['mmk_banks']), len(balances['usdt_banks']))
+
+    def summary(self):
+        if self.duration is None:
+            return "running"
+        steps = ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.steps.items())
+        summary = f"{self.duration * 1000:.0f} ms ({steps}), {self.held} held"
+        if self.failed:
+            summary += f", failed: {', '.join(self.failed)}"
+        if self.timed_out:
+            summary += f", {self.timed_out} timed out"
+        return summary
+
+warmup = WarmUp(WARMUP_TIMEOUT_SECONDS)
+
+# ============================================================================
+# UPDATE DISPATCH
+# ============================================================================
+
+def transaction_key(message):
+    """The transaction a message belongs to: the message it replies to, its album, the balance topic, or itself"""
+    chat_id = message.chat_id
+    if message.reply_to_message:
+        return f"{chat_id}:{message.reply_to_message.message_id}"
+    if message.media_group_id:
+        return f"{chat_id}:album:{message.media_group_id}"
+    if AUTO_BALANCE_TOPIC_ID and message.message_thread_id == AUTO_BALANCE_TOPIC_ID:
+        return f"{chat_id}:topic:{AUTO_BALANCE_TOPIC_ID}"
+    return f"{chat_id}:{message.message_id}"
+
+class UpdateChains:
+    """Processes updates concurrently across transaction chains, in order within one.
+
+    Every update gets a serialization key: the message it replies to (the root
+    sale message of the reply chain), else its media group, else the balance
+    topic for balance loads, else its own message id - which is the root the
+    staff reply will point at later. Updates sharing a key run one at a time
+    in arrival order; different keys run in parallel, bounded by
+    max_concurrent_updates.
+
+    Each update also runs in a trace span of its transaction (trace()).
+
+    The telegram.ext BaseUpdateProcessor it extends is only imported when the
+    processor is built, by chain_update_processor().
+    """
+
+    ALBUM_KEY_LIMIT = 5000
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._depth = {}
+        # message_id -> album key, so a reply to any photo of an album joins the album's chain
+        self._album_keys = OrderedDict()
+        # chain key -> trace context of the chain's first update, for the updates that follow it
+        self._traces = OrderedDict()
+        self.processed = 0
+        self.max_depth = 0
+
+    def serialization_key(self, update):
+        message = update.effective_message
+        if message is None:
+            return f"update:{update.update_id}"
+        key = transaction_key(message)
+        
+        if message.reply_to_message:
+            return self._album_keys.get(key, key)
+        
+        if message.media_group_id:
+            self._album_keys[f"{message.chat_id}:{message.message_id}"] = key
+            if len(self._album_keys) > self.ALBUM_KEY_LIMIT:
+                self._album_keys.popitem(last=False)
+        return key
+    
+    def trace(self, update, key):
+        """The span an update runs in, within its transaction's trace.
+        
+        Updates join the trace started by the first update of their chain:
+        the rest of an album, and the staff reply to a sale (its chain key is
+        the sale's). After a restart a reply to a pending sale resumes the
+        trace from the sale's queued pre-scan job instead. Anything else
+        starts a new trace.
+        """
+        if not tracer.enabled:
+            return NO_SPAN
+        message = update.effective_message
+        name = 'message'
+        attributes = {'chain.key': key}
+        parent = None
+        if message is not None:
+            attributes['message.id'] = message.message_id
+            attributes['message.photo'] = bool(message.photo)
+            if message.media_group_id:
+                attributes['message.media_group_id'] = message.media_group_id
+            original = message.reply_to_message
+            if original is not None:
+                attributes['message.reply_to'] = original.message_id
+                if pending_transactions.get(original.message_id, original.media_group_id) is not None:
+                    name = 'staff_reply'
+                    if key not in self._traces:
+                        parent = get_ocr_job_trace(album_job_key('sale_album_prescan', original)
+                                                   if original.media_group_id else
+                                                   f"sale_prescan:{original.chat_id}:{original.message_id}")
+        if parent is None:
+            parent = self._traces.get(key)
+        
+        span = tracer.new_span(name, parent, SPAN_KIND_SERVER, attributes)
+        if key not in self._traces:
+            self._traces[key] = span.carrier()
+            if len(self._traces) > self.ALBUM_KEY_LIMIT:
+                self._traces.popitem(last=False)
+        return tracer.activate(span)
+    
+    async def process_update(self, update, coroutine):
+        key = self.serialization_key(update)
+        # The chain key identifies the transaction in the logs of everything this update does
+        correlation_id.set(key)
+        try:
+            async with self.chain(key):
+                if not warmup.ready:
+                    # Held in the chain's lock, so the chain keeps its order once the warm-up is done
+                    await warmup.wait()
+                with self.trace(update, key):
+                    await super().process_update(update, coroutine)
+        finally:
+            self.processed += 1
+            if startup.first_update is None:
+                startup.mark_first_update()
+
+    @asynccontextmanager
+    async def chain(self, key):
+        """Hold chain `key`, in arrival order with its updates (and with jobs that join it)"""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        depth = self._depth.get(key, 0) + 1
+        self._depth[key] = depth
+        self.max_depth = max(self.max_depth, depth)
+        if depth > 1:
+            logger.info("⏳ Update queued behind %s other(s) for chain %s", depth - 1, key)
+        
+        try:
+            # asyncio.Lock wakes waiters FIFO, so a chain keeps arrival order
+            async with lock:
+                yield
+        finally:
+            depth = self._depth[key] - 1
+            if depth:
+                self._depth[key] = depth
+            else:
+                del self._depth[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        """Current per-chain queue depths and totals"""
+        busiest = sorted(self._depth.items(), key=lambda item: item[1], reverse=True)[:5]
+        return {
+            'active_chains': len(self._depth),
+            'queued': sum(depth - 1 for depth in self._depth.values()),
+            'max_depth': self.max_depth,
+            'processed': self.processed,
+            'busiest': busiest
+        }
+
+@functools.cache
+def chain_update_processor_class():
+    """UpdateChains on PTB's BaseUpdateProcessor, built on first use so telegram.ext loads lazily"""
+    from telegram.ext import BaseUpdateProcessor
+    return type('ChainUpdateProcessor', (UpdateChains, BaseUpdateProcessor), {'__doc__': UpdateChains.__doc__, '__module__': __name__})
+
+def chain_update_processor(max_concurrent_updates):
+    """A ChainUpdateProcessor for ApplicationBuilder.concurrent_updates()"""
+    return chain_update_processor_class()(max_concurrent_updates)
+
 # ============================================================================
 # MAIN
 # ============================================================================
@@ -6301,11 +9497,86 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     import traceback
     logger.error("".join(traceback.format_exception(None, context.error, context.error.__traceback__)))
 
+async def on_start(application: Application):
+    """Start background services once the event loop is running"""
+    outbound.start()
+    ocr_job_worker.start(application)
+    
+    # Web dynos must bind PORT even when updates come from polling
+    if BOT_MODE != 'webhook' and PORT:
+        health_server = WebhookServer(application, PORT, accept_updates=False)
+        await health_server.start()
+        application.bot_data['health_server'] = health_server
+    
+    # Updates are held by the chains until the warm-up is done
+    application.bot_data['warmup_task'] = asyncio.create_task(warmup.run(application))
+
+async def on_stop(application: Application):
+    """Let running OCR jobs finish, publish any balance update still waiting in the
+    coalescing window, then drain outbound messages"""
+    health_server = application.bot_data.pop('health_server', None)
+    if health_server:
+        await health_server.stop()
+    warmup_task = application.bot_data.pop('warmup_task', None)
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    await ocr_job_worker.stop()
+    await balance_publisher.shutdown()
+    await outbound.stop()
+
+async def run_ocr_worker(app):
+    """Worker process: claim OCR pre-scan jobs from the shared queue until SIGTERM/SIGINT"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    # The bot is only used to download photos and post pre-scan results
+    async with app:
+        outbound.start()
+        ocr_job_worker.kinds = OCR_PRESCAN_KINDS
+        ocr_job_worker.start(app)
+        await warmup.run(app, ledger=False)
+        await stop_event.wait()
+        logger.info("🛑 Stopping OCR worker")
+        await ocr_job_worker.stop()
+        await outbound.stop()
+
 def main():
     """Start bot"""
+    from telegram import Update
+    from telegram.ext import Application, CommandHandler, MessageHandler, filters
+    
+    if not TELEGRAM_BOT_TOKEN or not OPENAI_API_KEY:
+        raise ValueError("Missing required environment variables")
+    
+    log_pipeline.start()
+    tracer.start()
+    
     # Initialize database
     init_database()
     
+    if OCR_WORKER_PROCESS:
+        logger.info("🧵 Infinity Balance Bot OCR worker started (%s loops, lease %ss)",
+                    OCR_JOB_WORKERS, OCR_JOB_LEASE_SECONDS)
+        app = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .connect_timeout(60.0)
+            .read_timeout(60.0)
+            .write_timeout(60.0)
+            .pool_timeout(60.0)
+            .build()
+        )
+        asyncio.run(run_ocr_worker(app))
+        return
+    
+    if OCR_REMOTE_WORKERS:
+        ocr_job_worker.kinds = tuple(kind for kind in OCR_JOB_HANDLERS if kind not in OCR_PRESCAN_KINDS)
+    
     # Build application with increased connection pool settings and timeouts
     # Increased timeouts to handle slow network connections
     app = (
@@ -6319,6 +9590,9 @@ def main():
         .get_updates_read_timeout(60.0)     # Timeout for getUpdates read
         .get_updates_write_timeout(60.0)    # Timeout for getUpdates write
         .get_updates_pool_timeout(60.0)     # Timeout for getUpdates pool
+        .concurrent_updates(chain_update_processor(MAX_CONCURRENT_UPDATES))
+        .post_init(on_start)
+        .post_stop(on_stop)
         .build()
     )
     
@@ -6327,6 +9601,9 @@ def main():
     
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("balance", balance_command))
+    app.add_handler(CommandHandler("post_balance", post_balance_command))
+    app.add_handler(CommandHandler("pending", pending_command))
+    app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CommandHandler("load", load_command))
     app.add_handler(CommandHandler("set_user", set_user_reply_command))
     app.add_handler(CommandHandler("list_users", list_users_command))
@@ -6349,14 +9626,36 @@ def main():
     logger.info(f"💱 USDT Topic: {USDT_TRANSFERS_TOPIC_ID}")
     logger.info(f"📊 Balance Topic: {AUTO_BALANCE_TOPIC_ID}")
     logger.info(f"🏦 Accounts Matter Topic: {ACCOUNTS_MATTER_TOPIC_ID}")
+    logger.info("⏱️ Balance publish interval: %ss", BALANCE_PUBLISH_INTERVAL)
+    logger.info("🔀 Concurrent updates: %s", MAX_CONCURRENT_UPDATES)
+    logger.info("🧵 OCR job workers: %s (lease %ss)%s",
+                OCR_JOB_WORKERS, OCR_JOB_LEASE_SECONDS,
+                ', pre-scans left to --worker processes' if OCR_REMOTE_WORKERS else '')
+    logger.info("📌 Live balance message: %s", 'on' if BALANCE_LIVE_MESSAGE else 'off')
+    logger.info("📤 Outbound rate: %g/min per group%s", OUTBOUND_GROUP_RATE / OUTBOUND_PROCESSES,
+                f" (1/{OUTBOUND_PROCESSES} of {OUTBOUND_GROUP_RATE}, shared with worker processes)"
+                if OUTBOUND_PROCESSES > 1 else '')
+    logger.info("📥 Update mode: %s (%s pending updates)",
+                BOT_MODE, 'dropping' if DROP_PENDING_UPDATES else 'replaying')
+    
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL is required when BOT_MODE=webhook")
+        if not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', WEBHOOK_SECRET):
+            raise ValueError("WEBHOOK_SECRET is required when BOT_MODE=webhook (1-256 characters: A-Z, a-z, 0-9, _ and -)")
+        asyncio.run(run_webhook(app))
+        return
     
     # Run with error handling for network issues
+    # (start_polling removes any webhook left over from webhook mode)
     app.run_polling(
         allowed_updates=Update.ALL_TYPES,
-        drop_pending_updates=True,
+        drop_pending_updates=bool(DROP_PENDING_UPDATES),
         # Automatically retry on network errors
         close_loop=False
     )
 
+startup.mark_imported()
+
 if __name__ == '__main__':
     main()
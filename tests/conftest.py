@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# bot.py reads its configuration at import time
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '1:test')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ['TARGET_GROUP_ID'] = '-1001'
+os.environ['ACCOUNTS_MATTER_TOPIC_ID'] = '7'
+os.environ['SQLITE_DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'bot_data.db')
+os.environ.pop('DATABASE_URL', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,43 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telegram import Chat, Message, Update, User
+
+import bot
+
+bot.init_database()
+
+
+def internal_transfer_update(message_id):
+    message = Message(
+        message_id, datetime.now(timezone.utc), Chat(bot.TARGET_GROUP_ID, Chat.SUPERGROUP),
+        from_user=User(42, 'staff', False), text='San(Wave) to NDT(Wave)',
+        message_thread_id=bot.ACCOUNTS_MATTER_TOPIC_ID)
+    return Update(message_id, message=message)
+
+
+def test_redelivered_update_is_reprocessed_after_failure_before_any_balance_change(monkeypatch):
+    alerts = []
+
+    async def send_alert(message, text, context):
+        alerts.append(text)
+        if len(alerts) == 1:
+            raise RuntimeError('Telegram is down')
+
+    monkeypatch.setattr(bot, 'send_alert', send_alert)
+    # No balance loaded: the handler alerts before it could change one
+    context = SimpleNamespace(chat_data={})
+    update = internal_transfer_update(1001)
+
+    try:
+        asyncio.run(bot.handle_message(update, context))
+    except RuntimeError:
+        pass
+    assert len(alerts) == 1
+
+    # The redelivery runs the handler again, and then it counts as handled
+    asyncio.run(bot.handle_message(update, context))
+    assert len(alerts) == 2
+    asyncio.run(bot.handle_message(update, context))
+    assert len(alerts) == 2
@@ -0,0 +1,13 @@
+import bot
+
+
+def test_find_any_prefers_the_last_section_for_a_name_in_two_sections():
+    balances = bot.Ledger(
+        mmk_banks=[{'bank_name': 'San(KBZ)', 'amount': 1000000, 'prefix': 'San', 'bank': 'KBZ'}],
+        usdt_banks=[{'bank_name': 'San(Swift)', 'amount': 500, 'prefix': 'San', 'bank': 'Swift'}],
+        thb_banks=[{'bank_name': 'San(KBZ)', 'amount': 2000, 'prefix': 'San', 'bank': 'KBZ'}],
+    )
+
+    assert balances.find_any('San(KBZ)') is balances['thb_banks'][0]
+    assert balances.find_any('San(Swift)') is balances['usdt_banks'][0]
+    assert balances.find('mmk_banks', 'San(KBZ)') is balances['mmk_banks'][0]